@@ -0,0 +1,194 @@
+"""
+Calibration of the cost model of the planner (chronix2grid.planner).
+
+The generation is run on cases of several sizes (synthetic cases of several
+numbers of nodes, or a real case over several horizons), and the cost model
+coefficients are fitted on the timings, peak memory and output files of the
+runs by least squares.
+"""
+
+import bz2
+import json
+import os
+import statistics
+
+import numpy as np
+
+from .hot_paths import machine_info
+from .scaling import run_generation
+from .synthetic_case import write_synthetic_case
+from .. import constants as cst
+from .. import instrumentation as instr
+from .. import planner
+
+
+def fit_coefficients(features, targets):
+    """
+    Non negative least squares fit of targets on features, one row per run.
+    Features that do not vary enough to be fitted get a zero coefficient
+    """
+    features = np.asarray(features, dtype=float)
+    targets = np.asarray(targets, dtype=float)
+    coefficients, _, _, _ = np.linalg.lstsq(features, targets, rcond=None)
+    if (coefficients < 0).any():
+        # Refit without the features with negative coefficients
+        keep = coefficients >= 0
+        coefficients = np.zeros(features.shape[1])
+        coefficients[keep] = fit_coefficients(features[:, keep], targets)
+    return coefficients
+
+
+def output_bytes_per_value(scenario_folder, n_values):
+    """Bytes per value of the bz2 files of a scenario, compressed and as csv"""
+    compressed, uncompressed = 0, 0
+    for file_name in os.listdir(scenario_folder):
+        if file_name.endswith('.csv.bz2'):
+            with open(os.path.join(scenario_folder, file_name), 'rb') as f:
+                data = f.read()
+            compressed += len(data)
+            uncompressed += len(bz2.decompress(data))
+    return dict(csv=uncompressed / n_values, bz2=compressed / n_values)
+
+
+def observe_run(summary, sizes, weeks, mode, n_scenarios, start_date,
+                scenario_folder):
+    """Quantities of a run on which the cost model is fitted"""
+    values = planner.stage_values(sizes, weeks, mode)
+    return dict(
+        values=values,
+        n_windows=(planner.count_opf_windows(start_date, weeks, sizes['mode_opf'],
+                                             sizes['step_opf_min'])
+                   if 'T' in mode else 0),
+        stage_seconds={stage: steps['total']['seconds'] / n_scenarios
+                       for stage, steps in summary['stages'].items()
+                       if stage in values and 'total' in steps},
+        scenario_values=(sizes['n_loads'] + sizes['n_prods'])
+        * planner.n_time_steps(weeks, sizes['dt']),
+        peak_rss_mb=summary['peak_rss_mb'],
+        bytes_per_value=output_bytes_per_value(
+            scenario_folder, planner.written_values(sizes, weeks, mode)))
+
+
+def fit_cost_model(observations, efficiencies=None):
+    """
+    Cost model fitted on runs observed with observe_run
+
+    Parameters
+    ----------
+    observations: list
+        As returned by observe_run
+    efficiencies: list or None
+        Parallel efficiencies measured by the scaling benchmark
+
+    Returns
+    -------
+    dict
+        Cost model, in the format of planner.DEFAULT_COST_MODEL, with the
+        stages observed only
+    """
+    stages = {}
+    for stage in planner.DEFAULT_COST_MODEL['stages']:
+        runs = [observation for observation in observations
+                if stage in observation['stage_seconds']]
+        if not runs:
+            continue
+        targets = [run['stage_seconds'][stage] for run in runs]
+        if stage == 'T':
+            names = ['seconds_per_window', 'seconds_per_value']
+            features = [[run['n_windows'], run['values'][stage]] for run in runs]
+        else:
+            names = ['seconds_per_value', 'seconds']
+            features = [[run['values'][stage], 1.] for run in runs]
+        if len(runs) == 1:
+            # A single run cannot separate two costs: all the time goes to
+            # the first one
+            names, features = names[:1], [row[:1] for row in features]
+        stages[stage] = dict(zip(names, fit_coefficients(features, targets).tolist()))
+
+    runs = [observation for observation in observations
+            if observation['peak_rss_mb'] is not None]
+    base_rss_mb, mb_per_value = None, None
+    if len(runs) > 1:
+        base_rss_mb, mb_per_value = fit_coefficients(
+            [[1., run['scenario_values']] for run in runs],
+            [run['peak_rss_mb'] for run in runs]).tolist()
+    # Compression ratios are best measured on the largest run
+    largest = max(observations, key=lambda observation: observation['scenario_values'])
+    return dict(
+        stages=stages, base_rss_mb=base_rss_mb, mb_per_value=mb_per_value,
+        bytes_per_value=largest['bytes_per_value'],
+        parallel_efficiency=(statistics.median(efficiencies)
+                             if efficiencies else None))
+
+
+def read_efficiencies(scaling_results_path):
+    """Parallel efficiencies of the runs with several cores of a scaling benchmark"""
+    with open(scaling_results_path) as f:
+        results = json.load(f)
+    return [run['efficiency'] for run in results['runs'] if run['nb_core'] > 1]
+
+
+def calibrate(work_folder, input_folder=None, case=None, nodes_list=(118, 1000),
+              weeks_list=(2,), mode=None, start_date='2012-01-01',
+              scaling_results_path=None):
+    """
+    Run the generation on cases of several sizes and fit the cost model
+
+    Parameters
+    ----------
+    work_folder: str
+        Folder receiving the inputs and outputs of the runs
+    input_folder, case: str or None
+        Real case to run, synthetic cases of nodes_list nodes if None
+    nodes_list: list
+        Numbers of nodes of the synthetic cases
+    weeks_list: list
+        Horizons of the runs, in weeks
+    mode: str or None
+        Mode of the runs, LRTK for a real case and LR for synthetic cases
+        (which have no grid) if None
+    scaling_results_path: str or None
+        Results of the scaling benchmark, to calibrate the parallel efficiency
+
+    Returns
+    -------
+    dict
+        The cost model, with the machine it was calibrated on
+    """
+    if input_folder is None:
+        mode = mode or 'LR'
+        cases = []
+        for n_nodes in nodes_list:
+            synthetic_input_folder = os.path.join(work_folder, f'input_{n_nodes}')
+            write_synthetic_case(synthetic_input_folder, f'synthetic_{n_nodes}', n_nodes)
+            cases.append((synthetic_input_folder, f'synthetic_{n_nodes}'))
+    else:
+        mode = mode or 'LRTK'
+        cases = [(input_folder, case)]
+
+    observations = []
+    for case_input_folder, case_name in cases:
+        sizes = planner.case_sizes(case_input_folder, case_name)
+        for weeks in weeks_list:
+            output_folder = os.path.join(work_folder, f'output_{case_name}_{weeks}')
+            run_generation(case_input_folder, output_folder, case_name, mode,
+                           1, 1, weeks, start_date, seed=0)
+            with open(os.path.join(output_folder, cst.TIMINGS_FOLDER_NAME,
+                                   case_name, start_date,
+                                   instr.SUMMARY_FILE_NAME)) as f:
+                summary = json.load(f)
+            scenario_folder = os.path.join(
+                output_folder, cst.GENERATION_FOLDER_NAME, case_name,
+                start_date, cst.SCENARIO_FOLDER_BASE_NAME + '_0')
+            observations.append(observe_run(summary, sizes, weeks, mode, 1,
+                                            start_date, scenario_folder))
+            print('Calibration run {} weeks={}: {}'.format(
+                case_name, weeks, ', '.join(
+                    '{} {:.2f}s'.format(stage, seconds) for stage, seconds
+                    in observations[-1]['stage_seconds'].items())))
+
+    efficiencies = (read_efficiencies(scaling_results_path)
+                    if scaling_results_path is not None else None)
+    cost_model = fit_cost_model(observations, efficiencies)
+    cost_model['machine'] = machine_info()
+    return cost_model
@@ -0,0 +1,179 @@
+import json
+import os
+import tempfile
+
+import click
+
+from .calibration import calibrate as calibrate_cost_model
+from .gate import PROFILES, failed, format_diff, run_gate
+from .hot_paths import BENCHMARKS, run_hot_paths
+from .scaling import run_scaling
+from .synthetic_case import write_synthetic_case
+
+
+def parse_int_list(ctx, param, value):
+    try:
+        return [int(item) for item in value.split(',') if item.strip()]
+    except ValueError:
+        raise click.BadParameter('expected comma separated integers, e.g. 118,1000')
+
+
+@click.group()
+def benchmark():
+    """Benchmarks of chronix2grid"""
+
+
+@benchmark.command('hot-paths')
+@click.option('--nodes', default='118,1000', callback=parse_int_list,
+              help='comma separated numbers of nodes of the synthetic cases')
+@click.option('--weeks', default='4', callback=parse_int_list,
+              help='comma separated horizons, in weeks')
+@click.option('--repeat', default=3, help='number of timed runs of each benchmark')
+@click.option('--only', default=None,
+              help='comma separated names of the benchmarks to run, among '
+                   + ', '.join(BENCHMARKS))
+@click.option('--seed', default=0, help='seed of the synthetic cases')
+@click.option('--output', default=None,
+              help='JSON file in which results are written')
+def hot_paths(nodes, weeks, repeat, only, seed, output):
+    """Time the hot paths of the generation on synthetic cases"""
+    names = None if only is None else [name.strip() for name in only.split(',')]
+    try:
+        results = run_hot_paths(nodes, weeks, repeat, names, seed)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint='--only')
+    if output is not None:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print('Results written in ' + output)
+
+
+@benchmark.command('scaling')
+@click.option('--input-folder', default=None,
+              help='input folder of the case, a synthetic case is written in '
+                   'the work folder if not given')
+@click.option('--case', default=None,
+              help='case to generate, synthetic_N by default')
+@click.option('--nodes', default=118,
+              help='number of nodes of the synthetic case')
+@click.option('--cores', default='1,2,4', callback=parse_int_list,
+              help='comma separated numbers of cores (--nb_core)')
+@click.option('--modes', default='LRK',
+              help='comma separated modes (--mode) to run')
+@click.option('--n-scenarios', default=8, help='number of scenarios of each run')
+@click.option('--weeks', default=4, help='horizon of the scenarios, in weeks')
+@click.option('--seed', default=0, help='seed of the generation')
+@click.option('--work-folder', default=None,
+              help='folder receiving the outputs of the runs, a temporary '
+                   'folder by default')
+@click.option('--output', default=None,
+              help='JSON file in which results are written')
+def scaling(input_folder, case, nodes, cores, modes, n_scenarios, weeks, seed,
+            work_folder, output):
+    """Run the generation end to end at several core counts and modes"""
+    modes = [mode.strip() for mode in modes.split(',') if mode.strip()]
+    work_folder = work_folder or tempfile.mkdtemp()
+    if input_folder is None:
+        if any('T' in mode for mode in modes):
+            raise click.BadParameter(
+                'synthetic cases have no grid, give --input-folder to run the '
+                'dispatch', param_hint='--modes')
+        case = case or f'synthetic_{nodes}'
+        input_folder = os.path.join(work_folder, 'input')
+        write_synthetic_case(input_folder, case, nodes, seed)
+    elif case is None:
+        raise click.BadParameter('required with --input-folder',
+                                 param_hint='--case')
+    results = run_scaling(input_folder, case, cores, modes, n_scenarios, weeks,
+                          os.path.join(work_folder, 'output'), seed=seed)
+    if output is not None:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print('Results written in ' + output)
+
+
+@benchmark.command('gate')
+@click.option('--profile', 'profile_name', default='lr-small',
+              type=click.Choice(list(PROFILES)), help='benchmark profile to run')
+@click.option('--baseline', default=None,
+              help='baseline JSON, benchmarks/baselines/PROFILE.json by default')
+@click.option('--update-baseline', is_flag=True,
+              help='write the baseline from this run instead of comparing with it')
+@click.option('--input-folder', default=None,
+              help='input folder of profiles running on a real case, the '
+                   'example input folder by default')
+@click.option('--repeat', default=1,
+              help='number of runs, the best value of each metric is kept')
+@click.option('--time-threshold', default=None, type=float,
+              help='relative increase of time allowed, 0.25 by default')
+@click.option('--memory-threshold', default=None, type=float,
+              help='relative increase of peak memory allowed, 0.15 by default')
+@click.option('--bytes-threshold', default=None, type=float,
+              help='relative increase of bytes written allowed, 0.05 by default')
+def gate(profile_name, baseline, update_baseline, input_folder, repeat,
+         time_threshold, memory_threshold, bytes_threshold):
+    """Fail if a benchmark profile got slower or bigger than its baseline"""
+    thresholds = {metric: threshold for metric, threshold in [
+        ('seconds', time_threshold), ('peak_rss_mb', memory_threshold),
+        ('bytes_written', bytes_threshold)] if threshold is not None}
+    try:
+        rows = run_gate(profile_name, baseline, update_baseline, input_folder,
+                        repeat, thresholds)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    if update_baseline:
+        return
+    print(format_diff(rows))
+    regressions = failed(rows)
+    if regressions:
+        raise click.ClickException('{} metrics of profile {} exceed their threshold'.format(
+            len(regressions), profile_name))
+    print('No regression for profile ' + profile_name)
+
+
+@benchmark.command('calibrate')
+@click.option('--input-folder', default=None,
+              help='input folder of a real case to calibrate on, synthetic '
+                   'cases by default')
+@click.option('--case', default=None, help='real case to calibrate on')
+@click.option('--nodes', default='118,1000', callback=parse_int_list,
+              help='comma separated numbers of nodes of the synthetic cases')
+@click.option('--weeks', default='2', callback=parse_int_list,
+              help='comma separated horizons of the runs, in weeks')
+@click.option('--mode', default=None,
+              help='mode of the runs, LRTK for a real case and LR for '
+                   'synthetic cases by default')
+@click.option('--scaling-results', default=None,
+              help='results of the scaling command, to calibrate the '
+                   'parallel efficiency')
+@click.option('--work-folder', default=None,
+              help='folder receiving the outputs of the runs, a temporary '
+                   'folder by default')
+@click.option('--output', default='cost_model.json',
+              help='JSON file in which the cost model is written')
+def calibrate(input_folder, case, nodes, weeks, mode, scaling_results,
+              work_folder, output):
+    """Fit the cost model of chronix2grid plan on runs of this machine"""
+    if input_folder is not None and case is None:
+        raise click.BadParameter('required with --input-folder',
+                                 param_hint='--case')
+    cost_model = calibrate_cost_model(
+        work_folder or tempfile.mkdtemp(), input_folder, case, nodes, weeks,
+        mode, scaling_results_path=scaling_results)
+    with open(output, 'w') as f:
+        json.dump(cost_model, f, indent=2)
+    print('Cost model written in ' + output)
+
+
+@benchmark.command('make-case')
+@click.option('--input-folder', required=True,
+              help='input folder in which the case is written')
+@click.option('--case', default=None,
+              help='name of the case, synthetic_N by default')
+@click.option('--nodes', default=118, help='number of nodes of the case')
+@click.option('--seed', default=0, help='seed of the random draws')
+def make_case(input_folder, case, nodes, seed):
+    """Write a synthetic case that chronix2grid can generate chronics for"""
+    case = case or f'synthetic_{nodes}'
+    print('Synthetic case written in ' +
+          write_synthetic_case(input_folder, case, nodes, seed))
@@ -0,0 +1,280 @@
+"""
+Performance regression gate.
+
+A benchmark profile is a fixed generation run (case, mode, number of
+scenarios, horizon and cores). The gate runs it, collects the time, peak
+memory and bytes written of each stage from the timings of the run, and
+compares them with a baseline JSON committed with the code. It fails when a
+metric grows beyond its threshold, and the baseline can be refreshed from the
+current run once a slowdown is accepted.
+"""
+
+import json
+import os
+import shutil
+import tempfile
+from collections import OrderedDict, namedtuple
+
+from .hot_paths import machine_info
+from .scaling import run_generation
+from .synthetic_case import write_synthetic_case
+from .. import constants as cst
+from .. import instrumentation as instr
+
+BenchmarkProfile = namedtuple('BenchmarkProfile', [
+    'case', 'nodes', 'mode', 'n_scenarios', 'weeks', 'nb_core'])
+
+# Profiles without nodes run on a case of the input folder, the others on a
+# synthetic case of that number of nodes. There is no KPI profile on synthetic
+# cases: the KPI references are given for the generators of the real cases
+PROFILES = OrderedDict([
+    ('lr-small', BenchmarkProfile('synthetic_118', 118, 'LR', 2, 2, 1)),
+    ('lr-large', BenchmarkProfile('synthetic_2000', 2000, 'LR', 2, 4, 2)),
+    ('dispatch-case118', BenchmarkProfile('case118_l2rpn_wcci', None, 'LRT', 1, 1, 1)),
+])
+DEFAULT_INPUT_FOLDER = os.path.normpath(os.path.join(
+    os.path.dirname(__file__), '..', '..', 'getting_started', 'example', 'input'))
+DEFAULT_BASELINE_FOLDER = os.path.normpath(os.path.join(
+    os.path.dirname(__file__), '..', '..', 'benchmarks', 'baselines'))
+
+METRICS = ['seconds', 'peak_rss_mb', 'bytes_written']
+# Relative increase of each metric above which the gate fails...
+DEFAULT_THRESHOLDS = dict(seconds=0.25, peak_rss_mb=0.15, bytes_written=0.05)
+# ... provided the absolute increase is also above this, so that small and
+# noisy values do not fail the gate
+MIN_DIFFERENCES = dict(seconds=0.5, peak_rss_mb=20., bytes_written=0)
+# Name of the entry holding the metrics of the whole run
+RUN_ENTRY = 'run'
+
+
+def default_baseline_path(profile_name):
+    return os.path.join(DEFAULT_BASELINE_FOLDER, profile_name + '.json')
+
+
+def stage_metrics(summary):
+    """
+    Time, peak memory and bytes written of each stage of a timings summary,
+    and of the whole run
+
+    Parameters
+    ----------
+    summary: dict
+        As returned by chronix2grid.instrumentation.summarize
+
+    Returns
+    -------
+    dict
+        For each stage and for the run, a dict with the METRICS
+    """
+    metrics = OrderedDict()
+    for stage, steps in summary['stages'].items():
+        if 'total' not in steps:
+            continue
+        metrics[stage] = dict(seconds=steps['total']['seconds'],
+                              peak_rss_mb=steps['total'].get('peak_rss_mb'),
+                              bytes_written=steps['total']['bytes_written'])
+    metrics[RUN_ENTRY] = dict(
+        seconds=summary['wall_time'], peak_rss_mb=summary['peak_rss_mb'],
+        bytes_written=sum(values['bytes_written'] for values in metrics.values()))
+    return metrics
+
+
+def best_metrics(metrics_list):
+    """Lowest value of each metric over repeated runs"""
+    best = OrderedDict()
+    for metrics in metrics_list:
+        for stage, values in metrics.items():
+            best_values = best.setdefault(stage, dict(values))
+            for metric, value in values.items():
+                if value is not None and (best_values[metric] is None
+                                          or value < best_values[metric]):
+                    best_values[metric] = value
+    return best
+
+
+def run_profile(profile, work_folder, input_folder=None, repeat=1):
+    """
+    Run a benchmark profile repeat times and return its best metrics
+
+    Parameters
+    ----------
+    profile: BenchmarkProfile
+    work_folder: str
+        Folder receiving the inputs (for synthetic cases) and outputs of the runs
+    input_folder: str or None
+        Input folder of profiles running on a real case, the example input
+        folder of the repository if None
+    repeat: int
+        Number of runs
+
+    Returns
+    -------
+    dict
+        As returned by stage_metrics
+    """
+    if profile.nodes is not None:
+        input_folder = os.path.join(work_folder, 'input')
+        write_synthetic_case(input_folder, profile.case, profile.nodes)
+    elif input_folder is None:
+        input_folder = DEFAULT_INPUT_FOLDER
+    start_date = '2012-01-01'
+    metrics_list = []
+    for i in range(repeat):
+        output_folder = os.path.join(work_folder, f'output_{i}')
+        wall_time = run_generation(input_folder, output_folder, profile.case,
+                                   profile.mode, profile.nb_core,
+                                   profile.n_scenarios, profile.weeks,
+                                   start_date, seed=0)
+        timings_folder = os.path.join(output_folder, cst.TIMINGS_FOLDER_NAME,
+                                      profile.case, start_date)
+        with open(os.path.join(timings_folder, instr.SUMMARY_FILE_NAME)) as f:
+            summary = json.load(f)
+        # The wall time seen from outside includes the startup of the command
+        summary['wall_time'] = wall_time
+        metrics_list.append(stage_metrics(summary))
+        shutil.rmtree(output_folder, ignore_errors=True)
+    return best_metrics(metrics_list)
+
+
+def compare(baseline, current, thresholds=None):
+    """
+    Compare the metrics of a run with the ones of the baseline
+
+    Parameters
+    ----------
+    baseline: dict
+        Metrics of the baseline, as returned by stage_metrics
+    current: dict
+        Metrics of the run
+    thresholds: dict or None
+        Relative increase allowed for each metric, DEFAULT_THRESHOLDS if None
+
+    Returns
+    -------
+    list
+        One dict per stage and metric with the stage, metric, baseline and
+        current values, relative change, threshold and status: ok, REGRESSION,
+        improved, MISSING (stage of the baseline not run) or new
+    """
+    thresholds = dict(DEFAULT_THRESHOLDS, **(thresholds or {}))
+    rows = []
+    for stage in list(baseline) + [stage for stage in current
+                                   if stage not in baseline]:
+        for metric in METRICS:
+            baseline_value = baseline.get(stage, {}).get(metric)
+            current_value = current.get(stage, {}).get(metric)
+            change = None
+            if stage not in current:
+                status = 'MISSING'
+            elif stage not in baseline:
+                status = 'new'
+            elif baseline_value is None or current_value is None:
+                status = 'ok'
+            else:
+                difference = current_value - baseline_value
+                change = difference / baseline_value if baseline_value else None
+                if (difference > MIN_DIFFERENCES[metric]
+                        and (change is None or change > thresholds[metric])):
+                    status = 'REGRESSION'
+                elif change is not None and change < -thresholds[metric]:
+                    status = 'improved'
+                else:
+                    status = 'ok'
+            rows.append(dict(stage=stage, metric=metric,
+                             baseline=baseline_value, current=current_value,
+                             change=change, threshold=thresholds[metric],
+                             status=status))
+    return rows
+
+
+def failed(rows):
+    return [row for row in rows if row['status'] in ['REGRESSION', 'MISSING']]
+
+
+def format_diff(rows):
+    """Table of the comparison, one line per stage and metric"""
+    def format_value(value):
+        if value is None:
+            return '-'
+        return '{:.2f}'.format(value) if isinstance(value, float) else str(value)
+
+    lines = ['{:<6} {:<14} {:>14} {:>14} {:>9} {:>9}  {}'.format(
+        'stage', 'metric', 'baseline', 'current', 'change', 'threshold', 'status')]
+    for row in rows:
+        lines.append('{:<6} {:<14} {:>14} {:>14} {:>9} {:>9}  {}'.format(
+            row['stage'], row['metric'], format_value(row['baseline']),
+            format_value(row['current']),
+            '-' if row['change'] is None else '{:+.1%}'.format(row['change']),
+            '{:.0%}'.format(row['threshold']), row['status']))
+    return '\n'.join(lines)
+
+
+def write_baseline(path, profile_name, metrics):
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    baseline = dict(profile=profile_name,
+                    settings=PROFILES[profile_name]._asdict(),
+                    machine=machine_info(), metrics=metrics)
+    with open(path, 'w') as f:
+        json.dump(baseline, f, indent=2)
+    return baseline
+
+
+def read_baseline(path, profile_name):
+    """
+    Read a baseline, checking that it was recorded for the same profile
+
+    Raises
+    ------
+    ValueError
+        If the baseline was recorded with other profile settings
+    """
+    with open(path) as f:
+        baseline = json.load(f)
+    settings = PROFILES[profile_name]._asdict()
+    if baseline.get('profile') != profile_name or baseline.get('settings') != settings:
+        raise ValueError(
+            f'Baseline {path} was recorded for profile {baseline.get("profile")} '
+            f'with settings {baseline.get("settings")}, not for {profile_name} '
+            f'with settings {settings}: refresh it')
+    return baseline
+
+
+def run_gate(profile_name, baseline_path=None, update_baseline=False,
+             input_folder=None, repeat=1, thresholds=None, work_folder=None):
+    """
+    Run a profile and compare it with its baseline, or refresh the baseline
+
+    Returns
+    -------
+    list
+        Rows of the comparison (see compare), empty when the baseline is
+        refreshed
+    """
+    if profile_name not in PROFILES:
+        raise ValueError(f'Unknown profile {profile_name}, expected one of {list(PROFILES)}')
+    baseline_path = baseline_path or default_baseline_path(profile_name)
+    if not update_baseline:
+        if not os.path.exists(baseline_path):
+            raise ValueError(f'No baseline at {baseline_path}, create it with '
+                             f'--update-baseline')
+        baseline = read_baseline(baseline_path, profile_name)
+
+    remove_work_folder = work_folder is None
+    work_folder = work_folder or tempfile.mkdtemp()
+    try:
+        metrics = run_profile(PROFILES[profile_name], work_folder,
+                              input_folder, repeat)
+    finally:
+        if remove_work_folder:
+            shutil.rmtree(work_folder, ignore_errors=True)
+
+    if update_baseline:
+        write_baseline(baseline_path, profile_name, metrics)
+        print('Baseline written in ' + baseline_path)
+        return []
+    if baseline['machine'].get('node') != machine_info()['node']:
+        print('WARNING: the baseline was recorded on another machine ({})'.format(
+            baseline['machine'].get('node')))
+    return compare(baseline['metrics'], metrics, thresholds)
@@ -0,0 +1,240 @@
+"""
+Benchmarks of the hot paths of the generation, run on synthetic cases of
+increasing size and horizon to track scaling curves over time.
+
+Each benchmark is a function taking a BenchmarkCase and returning the
+function to time, so that the setup (noise draws, files to read...) is not
+part of the timings.
+"""
+
+import os
+import platform
+import shutil
+import statistics
+import tempfile
+import time
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+import pandas as pd
+
+from .synthetic_case import (make_synthetic_case, make_synthetic_patterns,
+                             make_synthetic_time_params)
+from .. import output_processor
+from ..generation import generation_utils as gu
+from ..generation.consumption import consumption_utils as conso
+from ..generation.renewable import solar_wind_utils as swutils
+from ..kpi.preprocessing.pivot_utils import chronics_to_kpi
+
+BenchmarkCase = namedtuple('BenchmarkCase', [
+    'n_nodes', 'weeks', 'params', 'loads_charac', 'prods_charac',
+    'load_weekly_pattern', 'solar_pattern', 'folder'])
+
+
+def make_benchmark_case(n_nodes, weeks, folder, seed=0):
+    params, loads_charac, prods_charac = make_synthetic_case(n_nodes, seed)
+    load_weekly_pattern, solar_pattern = make_synthetic_patterns(
+        params['year_solar_pattern'], seed)
+    params = make_synthetic_time_params(params, weeks)
+    return BenchmarkCase(n_nodes, weeks, params, loads_charac, prods_charac,
+                         load_weekly_pattern, solar_pattern, folder)
+
+
+def _locations(charac, gen_type=None):
+    if gen_type is not None:
+        charac = charac[charac['type'] == gen_type]
+    return charac[['x', 'y']].values, charac['Pmax'].values
+
+
+def bench_interpolate_noise(case):
+    noise = gu.generate_coarse_noise(case.params, 'temperature',
+                                     np.random.RandomState(0))
+    locations, _ = _locations(case.loads_charac)
+
+    def run():
+        for location in locations:
+            gu.interpolate_noise(noise, case.params, location,
+                                 time_scale=case.params['temperature_corr'])
+    return run
+
+
+def bench_compute_loads(case):
+    noise = gu.generate_coarse_noise(case.params, 'temperature',
+                                     np.random.RandomState(0))
+
+    def run():
+        # compute_load_pattern normalizes the pattern in place
+        conso.compute_loads(case.loads_charac, noise, case.params,
+                            case.load_weekly_pattern.copy())
+    return run
+
+
+def bench_compute_solar_series(case):
+    noise = gu.generate_coarse_noise(case.params, 'solar',
+                                     np.random.RandomState(0))
+    locations, pmax = _locations(case.prods_charac, 'solar')
+    solar_pattern = case.solar_pattern[:-1]
+
+    def run():
+        for location, p in zip(locations, pmax):
+            swutils.compute_solar_series(
+                location, p, noise, case.params, solar_pattern,
+                case.params['smoothdist'], time_scale=case.params['solar_corr'])
+    return run
+
+
+def bench_compute_wind_series(case):
+    random_state = np.random.RandomState(0)
+    noises = [gu.generate_coarse_noise(case.params, data_type, random_state)
+              for data_type in ['long_wind', 'medium_wind', 'short_wind']]
+    locations, pmax = _locations(case.prods_charac, 'wind')
+
+    def run():
+        for location, p in zip(locations, pmax):
+            swutils.compute_wind_series(location, p, *noises, case.params,
+                                        case.params['smoothdist'])
+    return run
+
+
+def _series(names, case, seed=0):
+    datetime_index = pd.date_range(start=case.params['start_date'],
+                                   end=case.params['end_date'],
+                                   freq=str(case.params['dt']) + 'min')
+    random_state = np.random.RandomState(seed)
+    series = {name: 100 * random_state.rand(len(datetime_index))
+              for name in names}
+    series['datetime'] = datetime_index
+    return series
+
+
+def bench_create_csv_loads(case):
+    series = _series(case.loads_charac['name'], case)
+
+    def run():
+        conso.create_csv(series, case.folder, reordering=True,
+                         noise=case.params['planned_std'], index=False,
+                         random_state=np.random.RandomState(0))
+    return run
+
+
+def bench_create_csv_renewables(case):
+    res_charac = case.prods_charac[case.prods_charac['type'].isin(['solar', 'wind'])]
+    series = _series(res_charac['name'], case)
+    path = os.path.join(case.folder, 'prod_p.csv.bz2')
+
+    def run():
+        swutils.create_csv(series, path, reordering=True,
+                           noise=case.params['planned_std'],
+                           random_state=np.random.RandomState(0))
+    return run
+
+
+def _write_chronics(case, scenario_name):
+    """Write prod_p, load_p and prices of a scenario as the dispatch does"""
+    scenario_folder = os.path.join(case.folder, scenario_name)
+    os.makedirs(scenario_folder, exist_ok=True)
+    for file_name, names in [('prod_p.csv.bz2', case.prods_charac['name']),
+                             ('load_p.csv.bz2', case.loads_charac['name']),
+                             ('prices.csv.bz2', ['price'])]:
+        df = pd.DataFrame(_series(names, case)).drop(columns='datetime')
+        df.to_csv(os.path.join(scenario_folder, file_name), sep=';',
+                  index=False, float_format='%.1f')
+    return scenario_folder
+
+
+def bench_output_processor_to_chunks(case):
+    _write_chronics(case, 'Scenario_chunks')
+
+    def run():
+        output_processor.output_processor_to_chunks(
+            case.folder, 'Scenario_chunks', 1, 1, case.weeks)
+    return run
+
+
+def bench_chronics_to_kpi(case):
+    scenario_folder = _write_chronics(case, 'Scenario_kpi')
+
+    def run():
+        chronics_to_kpi(scenario_folder, '60min', case.params, thermal=True)
+    return run
+
+
+BENCHMARKS = OrderedDict([
+    ('interpolate_noise', bench_interpolate_noise),
+    ('compute_loads', bench_compute_loads),
+    ('compute_solar_series', bench_compute_solar_series),
+    ('compute_wind_series', bench_compute_wind_series),
+    ('create_csv_loads', bench_create_csv_loads),
+    ('create_csv_renewables', bench_create_csv_renewables),
+    ('output_processor_to_chunks', bench_output_processor_to_chunks),
+    ('chronics_to_kpi', bench_chronics_to_kpi),
+])
+
+
+def time_function(function, repeat):
+    """Wall times in seconds of repeat calls of function"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def machine_info():
+    """Description of the machine and libraries the benchmarks run on"""
+    return dict(node=platform.node(), machine=platform.machine(),
+                processor=platform.processor(), cpu_count=os.cpu_count(),
+                python=platform.python_version(), numpy=np.__version__,
+                pandas=pd.__version__)
+
+
+def run_hot_paths(n_nodes_list=(118,), weeks_list=(4,), repeat=3, names=None,
+                  seed=0):
+    """
+    Run the hot paths benchmarks for every combination of number of nodes and
+    horizon
+
+    Parameters
+    ----------
+    n_nodes_list: list
+        Numbers of nodes of the synthetic cases
+    weeks_list: list
+        Horizons, in weeks
+    repeat: int
+        Number of timed runs of each benchmark
+    names: list or None
+        Names of the benchmarks to run (all of BENCHMARKS if None)
+    seed: int
+        Seed of the synthetic cases
+
+    Returns
+    -------
+    dict
+        Machine information and, for each benchmark and case, its timings
+    """
+    names = list(BENCHMARKS) if names is None else names
+    unknown_names = set(names) - set(BENCHMARKS)
+    if unknown_names:
+        raise ValueError(f'Unknown benchmarks {sorted(unknown_names)}, '
+                         f'expected some of {list(BENCHMARKS)}')
+    results = []
+    for n_nodes in n_nodes_list:
+        for weeks in weeks_list:
+            folder = tempfile.mkdtemp()
+            try:
+                case = make_benchmark_case(n_nodes, weeks, folder, seed)
+                for name in names:
+                    times = time_function(BENCHMARKS[name](case), repeat)
+                    result = dict(
+                        name=name, n_nodes=n_nodes, weeks=weeks,
+                        n_loads=len(case.loads_charac),
+                        n_prods=len(case.prods_charac),
+                        repeat=repeat, best=min(times),
+                        median=statistics.median(times), times=times)
+                    print('{:<28} nodes={:<6} weeks={:<3} best={:.4f}s median={:.4f}s'.format(
+                        name, n_nodes, weeks, result['best'], result['median']))
+                    results.append(result)
+            finally:
+                shutil.rmtree(folder, ignore_errors=True)
+    return dict(machine=machine_info(), results=results)
@@ -0,0 +1,189 @@
+"""
+End-to-end parallel scaling benchmark.
+
+The same set of scenarios is generated with the chronix2grid command for
+several numbers of cores and several modes. Each run is a separate process,
+and the timings it records (see chronix2grid.instrumentation) give the CPU
+time of each stage, the peak memory and the number of OS threads of each
+worker. From them, the benchmark reports wall times, speedups, parallel
+efficiencies and CPU shares of stages, and flags runs whose workers use more
+CPU than the cores they were given, which happens when BLAS or solver
+libraries start their own threads in every worker.
+"""
+
+import json
+import os
+import subprocess
+import sys
+import time
+
+from .hot_paths import machine_info
+from .. import constants as cst
+from .. import instrumentation as instr
+from ..worker_resources import THREADS_ENV_VARIABLES
+# Ratio of CPU time to wall time x cores above which workers are considered
+# to run more threads than the cores they were given
+OVERSUBSCRIPTION_TOLERANCE = 1.1
+
+
+def blas_info():
+    """Thread pools of the BLAS libraries loaded, if threadpoolctl is installed"""
+    try:
+        from threadpoolctl import threadpool_info
+    except ImportError:
+        return None
+    return [dict(library=pool.get('internal_api'),
+                 num_threads=pool.get('num_threads'))
+            for pool in threadpool_info()]
+
+
+def run_generation(input_folder, output_folder, case, mode, nb_core,
+                   n_scenarios, weeks, start_date, seed):
+    """
+    Run the chronix2grid command in a new process
+
+    Returns
+    -------
+    float
+        Wall time of the run in seconds
+    """
+    command = [
+        sys.executable, '-c',
+        'from chronix2grid.main import generate_mp; generate_mp()',
+        '--case', case, '--start-date', start_date, '--weeks', str(weeks),
+        '--by-n-weeks', str(weeks), '--n_scenarios', str(n_scenarios),
+        '--mode', mode, '--input-folder', input_folder,
+        '--output-folder', output_folder, '--seed-for-loads', str(seed),
+        '--seed-for-res', str(seed), '--seed-for-dispatch', str(seed),
+        '--nb_core', str(nb_core), '--ignore-warnings'
+    ]
+    start = time.perf_counter()
+    subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def analyse_run(summary, wall_time, nb_core, cpu_count):
+    """
+    Scaling indicators of a run from its timings summary
+
+    Parameters
+    ----------
+    summary: dict
+        As returned by chronix2grid.instrumentation.summarize
+    wall_time: float
+        Wall time of the run in seconds
+    nb_core: int
+        Number of worker processes of the run
+    cpu_count: int
+        Number of CPUs of the machine
+
+    Returns
+    -------
+    dict
+    """
+    stage_cpu = {stage: steps.get('total', {}).get('cpu_seconds', 0.)
+                 for stage, steps in summary['stages'].items()}
+    total_cpu = sum(stage_cpu.values())
+    workers = summary.get('workers', {})
+    threads = [worker['max_threads'] for worker in workers.values()
+               if worker.get('max_threads') is not None]
+    max_threads = max(threads) if threads else None
+    cpu_utilization = total_cpu / (wall_time * nb_core) if wall_time else 0.
+    oversubscribed = cpu_utilization > OVERSUBSCRIPTION_TOLERANCE or (
+        max_threads is not None and max_threads > 1
+        and nb_core * max_threads > cpu_count)
+    return dict(
+        wall_time=wall_time,
+        cpu_time=total_cpu,
+        stage_cpu_share={stage: (cpu / total_cpu if total_cpu else 0.)
+                         for stage, cpu in stage_cpu.items()},
+        peak_rss_mb_per_worker=max(
+            [worker['peak_rss_mb'] for worker in workers.values()], default=None),
+        n_workers=len(workers),
+        max_threads_per_worker=max_threads,
+        cpu_utilization=cpu_utilization,
+        oversubscribed=oversubscribed)
+
+
+def add_efficiencies(runs):
+    """
+    Add the speedup and parallel efficiency of each run, relative to the run
+    of the same mode with the fewest cores
+    """
+    for mode in {run['mode'] for run in runs}:
+        mode_runs = [run for run in runs if run['mode'] == mode]
+        reference = min(mode_runs, key=lambda run: run['nb_core'])
+        for run in mode_runs:
+            run['speedup'] = reference['wall_time'] / run['wall_time']
+            run['efficiency'] = run['speedup'] * reference['nb_core'] / run['nb_core']
+    return runs
+
+
+def run_scaling(input_folder, case, cores, modes, n_scenarios, weeks,
+                work_folder, start_date='2012-01-01', seed=0):
+    """
+    Generate the same scenarios for every mode and number of cores
+
+    Parameters
+    ----------
+    input_folder: str
+        Input folder of chronix2grid
+    case: str
+        Case to generate
+    cores: list
+        Numbers of cores (--nb_core) to run with
+    modes: list
+        Modes (--mode) to run
+    n_scenarios: int
+        Number of scenarios of each run
+    weeks: int
+        Horizon of the scenarios in weeks
+    work_folder: str
+        Folder receiving the outputs of the runs
+    start_date: str
+        Start date of the scenarios
+    seed: int
+        Seed of loads, renewables and dispatch
+
+    Returns
+    -------
+    dict
+        Machine information, runs and warnings
+    """
+    cpu_count = os.cpu_count()
+    runs = []
+    for mode in modes:
+        for nb_core in cores:
+            output_folder = os.path.join(work_folder, f'{mode}_{nb_core}')
+            wall_time = run_generation(input_folder, output_folder, case,
+                                       mode, nb_core, n_scenarios, weeks,
+                                       start_date, seed)
+            with open(os.path.join(
+                    output_folder, cst.TIMINGS_FOLDER_NAME, case, start_date,
+                    instr.SUMMARY_FILE_NAME)) as f:
+                summary = json.load(f)
+            run = dict(mode=mode, nb_core=nb_core, n_scenarios=n_scenarios,
+                       weeks=weeks, case=case)
+            run.update(analyse_run(summary, wall_time, nb_core, cpu_count))
+            print('mode={:<5} nb_core={:<3} wall time={:.1f}s cpu utilization={:.2f}{}'.format(
+                mode, nb_core, wall_time, run['cpu_utilization'],
+                ' OVERSUBSCRIBED' if run['oversubscribed'] else ''))
+            runs.append(run)
+    add_efficiencies(runs)
+
+    warnings = []
+    if any(run['oversubscribed'] for run in runs):
+        warnings.append(
+            'Workers used more CPU than the cores they were given: BLAS or '
+            'solver threads are probably running in every worker. Lower '
+            '--blas-threads and --solver-threads, or --nb_core.')
+    if max(cores) > cpu_count:
+        warnings.append(f'More cores requested ({max(cores)}) than available ({cpu_count})')
+    for warning in warnings:
+        print('WARNING: ' + warning)
+
+    info = machine_info()
+    info['threads_env'] = {name: os.environ.get(name)
+                           for name in THREADS_ENV_VARIABLES}
+    info['blas'] = blas_info()
+    return dict(machine=info, runs=runs, warnings=warnings)
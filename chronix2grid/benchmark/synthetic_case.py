@@ -0,0 +1,176 @@
+"""
+Synthetic cases of any size for benchmarks.
+
+A synthetic case has the same inputs as a real case (loads_charac.csv,
+prods_charac.csv, params.json, params_opf.json and the load and solar
+patterns), with nodes spread uniformly on the domain and a mix of generators
+in the same proportions as in case118_l2rpn. It has no grid.json: it is meant
+for the loads, renewables and KPI stages, not for the dispatch.
+"""
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from .. import constants as cst
+from ..generation import generation_utils as gu
+
+DEFAULT_PARAMS = {
+    'Lx': 1000, 'Ly': 1000, 'dx_corr': 250, 'dy_corr': 250, 'dt': 5,
+    'T_hazards_min': 0, 'T_maintenance_min': 0,
+    'daily_proba_hazards': '0.05', 'daily_proba_maintenance': '0.1',
+    'long_wind_corr': 20160, 'medium_wind_corr': 1440, 'short_wind_corr': 300,
+    'solar_corr': 100, 'temperature_corr': 400, 'nuclear_smoothing': 10080,
+    'planned_std': '0.01', 'smoothdist': 0.001,
+    'std_temperature_noise': 0.06, 'std_solar_noise': 0.1,
+    'std_short_wind_noise': 0.04, 'std_medium_wind_noise': 0.3,
+    'std_long_wind_noise': 0.3, 'year_solar_pattern': 2007
+}
+
+DEFAULT_PARAMS_OPF = {
+    'step_opf_min': 5, 'mode_opf': 'month', 'reactive_comp': 1,
+    'losses_pct': 1, 'dispatch_by_carrier': False, 'ramp_mode': 'hard',
+    'pyomo': False, 'solver_name': 'cbc'
+}
+
+# Share of nodes with a load, and number of generators of each type per node,
+# as in case118_l2rpn
+LOADS_PER_NODE = 0.84
+GENERATORS_PER_NODE = {'thermal': 22 / 118, 'solar': 16 / 118,
+                       'wind': 14 / 118, 'hydro': 7 / 118, 'nuclear': 3 / 118}
+PMAX_RANGES = {'thermal': (30., 400.), 'solar': (20., 80.),
+               'wind': (30., 100.), 'hydro': (30., 250.),
+               'nuclear': (300., 400.)}
+MARGINAL_COSTS = {'thermal': 70., 'solar': 0., 'wind': 0., 'hydro': 0.,
+                  'nuclear': 40.}
+
+
+def make_synthetic_case(n_nodes, seed=0):
+    """
+    Build the characteristics of a synthetic case
+
+    Parameters
+    ----------
+    n_nodes: int
+        Number of nodes (buses) of the case
+    seed: int
+        Seed of the random draws of locations and capacities
+
+    Returns
+    -------
+    dict, pandas.DataFrame, pandas.DataFrame
+        params (as in params.json), loads_charac and prods_charac
+    """
+    random_state = np.random.RandomState(seed)
+    params = dict(DEFAULT_PARAMS)
+
+    def draw_locations(n):
+        x = random_state.randint(0, params['Lx'], n)
+        y = -random_state.randint(0, params['Ly'], n)
+        return x, y
+
+    load_buses = np.sort(random_state.choice(
+        n_nodes, max(int(round(LOADS_PER_NODE * n_nodes)), 1), replace=False))
+    x, y = draw_locations(len(load_buses))
+    loads_charac = pd.DataFrame({
+        'name': [f'load_{bus}_{i}' for i, bus in enumerate(load_buses)],
+        'bus': load_buses,
+        'Pmax': np.round(random_state.uniform(5., 120., len(load_buses)), 1),
+        'zone': 'R1', 'PF': 0., 'type': 'residential', 'x': x, 'y': y,
+        'vn_kv': 138.
+    })
+
+    gen_types = []
+    for gen_type, n_per_node in GENERATORS_PER_NODE.items():
+        gen_types += [gen_type] * max(int(round(n_per_node * n_nodes)), 1)
+    gen_types = random_state.permutation(gen_types)
+    gen_buses = np.sort(random_state.randint(0, n_nodes, len(gen_types)))
+    x, y = draw_locations(len(gen_types))
+    pmax = [np.round(random_state.uniform(*PMAX_RANGES[gen_type]), 1)
+            for gen_type in gen_types]
+    prods_charac = pd.DataFrame({
+        'name': [f'gen_{bus}_{i}' for i, bus in enumerate(gen_buses)],
+        'Pmax': pmax, 'Pmin': 0., 'type': gen_types, 'bus': gen_buses,
+        'max_ramp_up': [np.nan if gen_type in ['solar', 'wind'] else 0.1 * p
+                        for gen_type, p in zip(gen_types, pmax)],
+        'max_ramp_down': [np.nan if gen_type in ['solar', 'wind'] else 0.1 * p
+                          for gen_type, p in zip(gen_types, pmax)],
+        'min_up_time': 0., 'min_down_time': 0.,
+        'marginal_cost': [MARGINAL_COSTS[gen_type] for gen_type in gen_types],
+        'shut_down_cost': 0, 'start_cost': 0., 'zone': 'R1',
+        'generator': np.arange(len(gen_types)), 'x': x, 'y': y,
+        'V': [355.4 if gen_type == 'nuclear' else 142.1
+              for gen_type in gen_types]
+    })
+    return params, loads_charac, prods_charac
+
+
+def make_synthetic_patterns(year=2007, seed=0):
+    """
+    Build a yearly load pattern at 5 minutes, with daily and weekly cycles, and
+    an hourly solar pattern of 8761 values between 0 and 1
+
+    Returns
+    -------
+    pandas.DataFrame, numpy.ndarray
+        load_weekly_pattern and solar_pattern
+    """
+    random_state = np.random.RandomState(seed)
+    index = pd.date_range(start=f'{year}-01-01', end=f'{year + 1}-01-01',
+                          freq='5min')
+    hours = (index.hour + index.minute / 60).values
+    daily = 1 + 0.2 * np.cos(2 * np.pi * (hours - 19) / 24)
+    weekly = np.where(index.dayofweek.values >= 5, 0.85, 1.)
+    noise = 1 + 0.01 * random_state.randn(len(index))
+    load_weekly_pattern = pd.DataFrame({'test': daily * weekly * noise},
+                                       index=index)
+
+    hours = np.arange(8761)
+    day_of_year = hours / 24
+    daylight = np.clip(np.sin(2 * np.pi * (hours % 24 - 6) / 24), 0, None)
+    seasonal = 0.7 + 0.3 * np.cos(2 * np.pi * (day_of_year - 172) / 365)
+    solar_pattern = daylight * seasonal
+    return load_weekly_pattern, solar_pattern / solar_pattern.max()
+
+
+def make_synthetic_time_params(params, weeks, start_date='2012-01-01'):
+    """params of a synthetic case completed with the time parameters of a
+    horizon of weeks weeks, as read by the generation"""
+    params = {key: float(value) for key, value in params.items()}
+    params.update(gu.time_parameters(weeks, start_date))
+    return gu.updated_time_parameters_with_timestep(params, params['dt'])
+
+
+def write_synthetic_case(input_folder, case, n_nodes, seed=0):
+    """
+    Write a synthetic case in input_folder, with the layout expected by the
+    generation: generation/case/{loads_charac.csv, prods_charac.csv,
+    params.json, params_opf.json} and generation/patterns
+
+    Returns
+    -------
+    str
+        Path of the folder of the case
+    """
+    params, loads_charac, prods_charac = make_synthetic_case(n_nodes, seed)
+    load_weekly_pattern, solar_pattern = make_synthetic_patterns(
+        params['year_solar_pattern'], seed)
+
+    generation_folder = os.path.join(input_folder, cst.GENERATION_FOLDER_NAME)
+    case_folder = os.path.join(generation_folder, case)
+    patterns_folder = os.path.join(generation_folder, 'patterns')
+    os.makedirs(case_folder, exist_ok=True)
+    os.makedirs(patterns_folder, exist_ok=True)
+
+    loads_charac.to_csv(os.path.join(case_folder, 'loads_charac.csv'), index=False)
+    prods_charac.to_csv(os.path.join(case_folder, 'prods_charac.csv'), index=False)
+    with open(os.path.join(case_folder, 'params.json'), 'w') as f:
+        json.dump(params, f, indent=2)
+    with open(os.path.join(case_folder, 'params_opf.json'), 'w') as f:
+        json.dump(DEFAULT_PARAMS_OPF, f, indent=2)
+    load_weekly_pattern.to_csv(
+        os.path.join(patterns_folder, 'load_weekly_pattern.csv'))
+    np.save(os.path.join(patterns_folder, 'solar_pattern.npy'), solar_pattern)
+    return case_folder
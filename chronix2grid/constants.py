@@ -6,6 +6,8 @@ reads/writes.
 GENERATION_FOLDER_NAME = 'generation'
 KPI_FOLDER_NAME = 'kpi'
 KPI_IMAGES_FOLDER_NAME = 'images'
+TIMINGS_FOLDER_NAME = 'timings'
+PROFILES_FOLDER_NAME = 'profiles'
 
 DEFAULT_OUTPUT_FOLDER_NAME = 'output'
 DEFAULT_INPUT_FOLDER_NAME = 'input'
@@ -6,6 +6,7 @@ from scipy.interpolate import interp1d
 
 from .. import generation_utils as utils
 import chronix2grid.constants as cst
+from chronix2grid import instrumentation as instr
 
 def compute_loads(loads_charac, temperature_noise, params, load_weekly_pattern):
     # Compute active part of loads
@@ -24,6 +25,65 @@ def compute_loads(loads_charac, temperature_noise, params, load_weekly_pattern):
             loads_series[name] = compute_industrial(Pmax, params)
     return loads_series
 
+def compute_loads_batch(loads_charac, temperature_noise, params, load_weekly_pattern):
+    """
+    Vectorized version of compute_loads, computing the loads of several
+    scenarios at once
+
+    Input:
+        loads_charac: (pandas.DataFrame) characteristics of loads nodes
+        temperature_noise: (np.array) coarse noises of all scenarios, of shape
+            (n_scenarios, Nx_comp, Ny_comp, Nt_comp)
+        params: (dict) system params such as timestep or mesh characteristics
+        load_weekly_pattern: (pandas.DataFrame) 5 minutes weekly load chronic
+
+    Output:
+        (list) names of the generated (residential) loads
+        (np.array) loads of shape (n_scenarios, n_loads, Nt_inter), in the
+            order of the names
+    """
+    if (loads_charac['type'] == 'industrial').any():
+        raise NotImplementedError("Impossible to generate industrial loads for now.")
+    weekly_pattern = load_weekly_pattern['test'].values
+    # Positions in loads_charac are kept since they select the weekly pattern
+    indices = np.flatnonzero((loads_charac['type'] == 'residential').values)
+    residential_charac = loads_charac.iloc[indices]
+    locations = residential_charac[['x', 'y']].values
+    Pmax = residential_charac['Pmax'].values
+
+    # Compute refined signals
+    temperature_signal = utils.interpolate_noise_batch(
+        temperature_noise, params, locations,
+        time_scale=params['temperature_corr'])
+
+    # Seasonal pattern is the same for every load
+    seasonal_pattern = compute_seasonal_pattern(params)
+
+    # Weekly patterns only depend on the index of the load, modulo the
+    # number of weeks in the pattern
+    index_weekly_perweek = 12 * 24 * 7
+    n_weeks = int(weekly_pattern.shape[0] / index_weekly_perweek - 1)
+    weekly_patterns = {}
+    for index in indices:
+        if index % n_weeks not in weekly_patterns:
+            weekly_patterns[index % n_weeks] = compute_load_pattern(params, weekly_pattern, index)
+    weekly_patterns = np.stack([weekly_patterns[i % n_weeks] for i in indices])
+
+    std_temperature_noise = params['std_temperature_noise']
+    loads = (Pmax[None, :, None] * weekly_patterns[None, :, :]
+             * (std_temperature_noise * temperature_signal + seasonal_pattern))
+    return residential_charac['name'].tolist(), loads
+
+
+@instr.timed('pattern building')
+def compute_seasonal_pattern(params):
+    Nt_inter = int(params['T'] // params['dt'] + 1)
+    t = np.linspace(0, params['T'], Nt_inter, endpoint=True)
+    start_year = pd.to_datetime(str(params['start_date'].year) + '/01/01', format='%Y-%m-%d')
+    start_min = int(pd.Timedelta(params['start_date'] - start_year).total_seconds() // 60)
+    return 5.5/7 + 1.5/7*np.cos((2*np.pi/(365*24*60))*(t-30*24*60 - start_min))
+
+
 def compute_residential(locations, Pmax, temperature_noise, params, weekly_pattern, index):
 
 
@@ -35,12 +95,7 @@ def compute_residential(locations, Pmax, temperature_noise, params, weekly_patte
         time_scale=params['temperature_corr'])
 
     # Compute seasonal pattern
-    Nt_inter = int(params['T'] // params['dt'] + 1)
-    t = np.linspace(0, params['T'], Nt_inter, endpoint=True)
-    start_year = pd.to_datetime(str(params['start_date'].year) + '/01/01', format='%Y-%m-%d')
-    # start_min = int(pd.Timedelta(params['start_date'] - pd.to_datetime('2018/01/01', format='%Y-%m-%d')).total_seconds() // 60)
-    start_min = int(pd.Timedelta(params['start_date'] - start_year).total_seconds() // 60)
-    seasonal_pattern = 5.5/7 + 1.5/7*np.cos((2*np.pi/(365*24*60))*(t-30*24*60 - start_min))
+    seasonal_pattern = compute_seasonal_pattern(params)
 
     # Get weekly pattern
     weekly_pattern = compute_load_pattern(params, weekly_pattern, index)
@@ -49,6 +104,7 @@ def compute_residential(locations, Pmax, temperature_noise, params, weekly_patte
 
     return residential_series
 
+@instr.timed('pattern building')
 def compute_load_pattern(params, weekly_pattern, index):
     """
     Loads a typical hourly pattern, and interpolates it to generate
@@ -96,7 +152,8 @@ def compute_load_pattern(params, weekly_pattern, index):
 
 
 def create_csv(dict_, path, forecasted=False, reordering=True, noise=None,
-               shift=False, write_results=True, index=False):
+               shift=False, write_results=True, index=False,
+               random_state=np.random):
     df = pd.DataFrame.from_dict(dict_)
     df.set_index('datetime', inplace=True)
     df = df.sort_index(ascending=True)
@@ -113,16 +170,17 @@ def create_csv(dict_, path, forecasted=False, reordering=True, noise=None,
 
     df_reactive_power = 0.7 * df
     if noise is not None:
-        df *= np.random.lognormal(mean=0.0,sigma=noise, size=df.shape)
-        df_reactive_power *= np.random.lognormal(mean=0.0, sigma=noise,
-                                                 size=df.shape)
+        df *= random_state.lognormal(mean=0.0,sigma=noise, size=df.shape)
+        df_reactive_power *= random_state.lognormal(mean=0.0, sigma=noise,
+                                                    size=df.shape)
 
     if write_results:
         file_extension = '_forecasted' if forecasted else ''
-        df.to_csv(
-            os.path.join(path, f'load_p{file_extension}.csv.bz2'),
+        instr.to_csv(
+            df, os.path.join(path, f'load_p{file_extension}.csv.bz2'),
             index=index, sep=';', float_format=cst.FLOATING_POINT_PRECISION_FORMAT)
-        df_reactive_power.to_csv(
+        instr.to_csv(
+            df_reactive_power,
             os.path.join(path, f'load_q{file_extension}.csv.bz2'),
             index=False, sep=';', float_format=cst.FLOATING_POINT_PRECISION_FORMAT)
 
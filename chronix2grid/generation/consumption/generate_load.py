@@ -46,6 +46,59 @@ def main(scenario_destination_path, seed, params, loads_charac, load_weekly_patt
     loads_series = conso.compute_loads(loads_charac, temperature_noise, params, load_weekly_pattern)
     loads_series['datetime'] = datetime_index
 
+    return save_results(scenario_destination_path, params, loads_series,
+                        write_results)
+
+
+def main_batch(scenario_destination_paths, random_states, params, loads_charac,
+               load_weekly_pattern, write_results=True):
+    """
+    Batch version of main: generates the loads of several scenarios at once,
+    the computations being vectorized across scenarios.
+
+    Each scenario draws its noises from its own random stream, in the same
+    order as main does with the global random state, so that a scenario
+    generated in a batch is the same as a scenario generated alone.
+
+    Parameters
+    ----------
+    scenario_destination_paths (list): where results are written for each scenario
+    random_states (list): numpy.random.RandomState of each scenario, seeded with the seed of the scenario
+    params (dict): system params such as timestep or mesh characteristics
+    loads_charac (pandas.DataFrame): characteristics of loads node such as Pmax and type of demand
+    load_weekly_pattern (pandas.DataFrame): 5 minutes weekly load chronic that represent specificity of the demand context
+    write_results (boolean): whether to write_results or not. Default is True
+
+    Returns
+    -------
+    list: for each scenario, the tuple (load_p, load_p_forecasted) returned by main
+    """
+    datetime_index = pd.date_range(
+        start=params['start_date'],
+        end=params['end_date'],
+        freq=str(params['dt']) + 'min')
+
+    print('Computing global auto-correlated spatio-temporal noise for thermosensible demand of {} scenarios...'.format(
+        len(random_states)))
+    temperature_noise = np.stack([
+        utils.generate_coarse_noise(params, 'temperature', random_state)
+        for random_state in random_states])
+
+    print('Computing loads ...')
+    names, loads = conso.compute_loads_batch(loads_charac, temperature_noise,
+                                             params, load_weekly_pattern)
+
+    results = []
+    for s, (path, random_state) in enumerate(zip(scenario_destination_paths, random_states)):
+        loads_series = dict(zip(names, loads[s]))
+        loads_series['datetime'] = datetime_index
+        results.append(save_results(path, params, loads_series, write_results,
+                                    random_state))
+    return results
+
+
+def save_results(scenario_destination_path, params, loads_series,
+                 write_results=True, random_state=np.random):
     # Save files
     print('Saving files in zipped csv in "{}"'.format(scenario_destination_path))
     if not os.path.exists(scenario_destination_path):
@@ -57,7 +110,7 @@ def main(scenario_destination_path, seed, params, loads_charac, load_weekly_patt
         loads_series, scenario_destination_path,
         reordering=True,
         noise=params['planned_std'], write_results=write_results,
-        index=False
+        index=False, random_state=random_state
     )
     
     return load_p, load_p_forecasted
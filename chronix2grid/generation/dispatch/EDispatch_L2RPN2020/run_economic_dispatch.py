@@ -3,17 +3,19 @@ import os
 import time
 
 import pandas as pd
-import pypsa
 
 from .utils import add_noise_gen
-from .utils import get_grouped_snapshots
+from .utils import calendar_windows, dispatch_calendar
 from .utils import interpolate_dispatch
+from .utils import marginal_prices_from_dispatch, marginal_prices_from_duals
 from .utils import preprocess_input_data
 from .utils import preprocess_net, filter_ramps
 from .utils import run_opf
 from .utils import update_gen_constrains, update_params
+from chronix2grid.generation.dispatch import lp_dispatch
 from chronix2grid.generation.dispatch.utils import RampMode
 import chronix2grid.constants as cst
+from chronix2grid import instrumentation as instr
 
 
 def main_run_disptach(pypsa_net, 
@@ -29,62 +31,114 @@ def main_run_disptach(pypsa_net,
     params = update_params(load.shape[0], load.index[0], params)
 
     print ('Preprocessing input data..')
+    # OPF time steps and windows, computed once for the whole dispatch
+    calendar = dispatch_calendar(params['snapshots'], params['step_opf_min'],
+                                 params['mode_opf'])
     # Preprocess input data:
     #   - Add date range as index 
     #   - Check whether gen constraints has same lenght as load
-    load_, gen_constraints_ = preprocess_input_data(load, gen_constraints, params)
-    tot_snap = load_.index
-
-    print('Filter generators ramps up/down')
-    # Preprocess pypsa net ramps according to
-    # the level specified
-    pypsa_net = filter_ramps(pypsa_net, ramp_mode)
-
-    print('Adapting PyPSA grid with parameters..')
-    # Preprocess net parameters:
-    #   - Change ramps according to params step_opf_min (assuming original 
-    #     values are normalizing for every 5 minutes)
-    #   - It checks for all gen units if commitable variables is False
-    #     (commitable as False helps to create a LP problem for PyPSA)
-    pypsa_net = preprocess_net(pypsa_net, params['step_opf_min'])
-
-    months = tot_snap.month.unique()
+    load_, gen_constraints_ = preprocess_input_data(load, gen_constraints,
+                                                    params, calendar)
+
+    native = params.get('solver_name') == lp_dispatch.NATIVE_SOLVER_NAME
+    lp_path = native or params.get('persistent_lp', False)
+    generators = lp_dispatch.prepare_generators(
+        pypsa_net.generators, ramp_mode, params['step_opf_min'])
+    merit_order = (params.get('merit_order', True)
+                   and not lp_dispatch.has_ramps(generators))
+    g_max_pu, g_min_pu = gen_constraints_['p_max_pu'], gen_constraints_['p_min_pu']
+    aggregation = None
+    if lp_path and not merit_order and params.get('aggregate_generators', True):
+        # Generators with the same cost, ramps and bounds per unit are
+        # dispatched as one, and their dispatch shared in proportion to p_nom
+        aggregation = lp_dispatch.aggregate_generators(generators, g_max_pu, g_min_pu)
+        generators = aggregation.generators
+        g_max_pu = lp_dispatch.aggregate_bounds(aggregation, g_max_pu)
+        g_min_pu = lp_dispatch.aggregate_bounds(aggregation, g_min_pu)
+        print(f'{len(aggregation.units)} generators aggregated into '
+              f'{len(generators.names)}')
+    if merit_order:
+        # Without ramps, time steps are independent: each one is dispatched
+        # in merit order, without solving any LP
+        print('No ramp constraints, dispatching in merit order')
+
+        def solve_window(demand, gen_max, gen_min, initial=None):
+            return lp_dispatch.run_merit_order_window(generators, demand,
+                                                      gen_max, gen_min)
+    elif lp_path:
+        # The LP is built from the generators table, without pypsa, once per
+        # window length: only its demand, bounds and costs are updated from
+        # one window to the next
+        print('Using the native LP dispatch' if native else
+              'Using a persistent LP model across OPF windows')
+        lp_cache = {}
+
+        def solve_window(demand, gen_max, gen_min, initial=None):
+            dispatch, termination_condition, prices = lp_dispatch.run_lp_window(
+                lp_cache, generators, demand, gen_max, gen_min,
+                engine=params.get('lp_engine'),
+                solver_options=kwargs.get('solver_options'), initial=initial,
+                warm_start=params.get('lp_warm_start', True))
+            if termination_condition != 'optimal' and initial is not None:
+                print('** Window infeasible from the end of the previous one, '
+                      'solved again without initial state **')
+                return solve_window(demand, gen_max, gen_min)
+            return dispatch, termination_condition, prices
+    else:
+        print('Filter generators ramps up/down')
+        # Preprocess pypsa net ramps according to
+        # the level specified
+        pypsa_net = filter_ramps(pypsa_net, ramp_mode)
+
+        print('Adapting PyPSA grid with parameters..')
+        # Preprocess net parameters:
+        #   - Change ramps according to params step_opf_min (assuming original 
+        #     values are normalizing for every 5 minutes)
+        #   - It checks for all gen units if commitable variables is False
+        #     (commitable as False helps to create a LP problem for PyPSA)
+        pypsa_net = preprocess_net(pypsa_net, params['step_opf_min'])
+
+        def solve_window(demand, gen_max, gen_min, initial=None):
+            return run_opf(pypsa_net, demand, gen_max, gen_min, params, **kwargs)
+
     start = time.time()
-    results, termination_conditions = [], []
-    if (params['mode_opf'] is not None):
-        print('mode_opf is not None')
-        for month in months:
-            # Get snapshots per month
-            snap_per_month = tot_snap[tot_snap.month == month]
-            # Filter input data per month
-            load_per_month = load_.loc[snap_per_month]
-            # Get gen constraints separated and filter by month
-            g_max_pu, g_min_pu = gen_constraints_['p_max_pu'], gen_constraints_['p_min_pu']
-            g_max_pu_per_month = g_max_pu.loc[snap_per_month]
-            g_min_pu_per_month = g_min_pu.loc[snap_per_month]
-            # Get grouped snapsshots given monthly snapshots
-            if (params['mode_opf'] is not None):
-                snap_per_mode = get_grouped_snapshots(snap_per_month, params['mode_opf'])
-                for snaps in snap_per_mode:
-                    # Truncate input data per mode (day, week, month)
-                    load_per_mode = load_per_month.loc[snaps]
-                    gen_max_pu_per_mode = g_max_pu_per_month.loc[snaps]
-                    gen_min_pu_per_mode = g_min_pu_per_month.loc[snaps]
-                    # Run opf given in specified mode
-                    dispatch, termination_condition = run_opf(
-                        pypsa_net, load_per_mode, gen_max_pu_per_mode,
-                        gen_min_pu_per_mode, params, **kwargs)
-
-                    results.append(dispatch)
-                    termination_conditions.append(termination_condition)
+    results, termination_conditions, window_prices = [], [], []
+    # Positions of each window per mode (day, week, month) in every month
+    windows = calendar_windows(calendar)
+    # Windows which cannot be solved are found before solving any, and are
+    # then reported (flag) or have their demand relaxed (relax)
+    if params.get('feasibility_screen') is not None:
+        load_ = lp_dispatch.screen_windows(
+            generators, load_, g_max_pu, g_min_pu, windows,
+            params['feasibility_screen'])
+    n_parallel = params.get('parallel_windows', 1)
+    if n_parallel > 1 and len(windows) > 1 and lp_path and not merit_order:
+        # Windows solved concurrently with overlapping margins, and stitched
+        margin_steps = params.get('window_margin_min', 60) // params['step_opf_min']
+        print(f'Solving {len(windows)} OPF windows with {n_parallel} workers')
+        results, termination_conditions, window_prices = lp_dispatch.run_parallel_windows(
+            generators, load_, g_max_pu, g_min_pu, windows, n_parallel,
+            margin_steps, engine=params.get('lp_engine'),
+            solver_options=kwargs.get('solver_options'))
     else:
-        g_max_pu, g_min_pu = gen_constraints_['p_max_pu'], gen_constraints_['p_min_pu']
-        dispatch, termination_condition = run_opf(
-               pypsa_net, load_, g_max_pu,
-               g_min_pu, params, **kwargs)
+        if n_parallel > 1 and not lp_path and not merit_order:
+            print('parallel_windows needs the native or persistent LP dispatch, '
+                  'solving windows in sequence')
+        # With the LP dispatch, each window starts within ramps of the last
+        # dispatch of the previous one
+        carry_state = lp_path and params.get('carry_window_state', True)
+        initial = None
+        for first, last in windows:
+            # Run opf given in specified mode, on slices of the inputs
+            dispatch, termination_condition, prices = solve_window(
+                load_.iloc[first:last], g_max_pu.iloc[first:last],
+                g_min_pu.iloc[first:last], initial)
+            initial = (dispatch.values[-1] if carry_state
+                       and termination_condition == 'optimal' else None)
 
-        results.append(dispatch)
-        termination_conditions.append(termination_condition)
+            results.append(dispatch)
+            termination_conditions.append(termination_condition)
+            window_prices.append(prices)
 
     # Unpack individual dispatchs and prices
     opf_prod = pd.DataFrame()
@@ -93,18 +147,48 @@ def main_run_disptach(pypsa_net,
 
     # Sort by datetime
     opf_prod.sort_index(inplace=True)
+    refine = params['step_opf_min'] > 5 and params.get('refine_dispatch', False)
+    if refine:
+        # Second stage: the dispatch at 5 minutes, solved by small LPs
+        # around the one of the OPF time steps
+        print ('\n => Refining dispatch into 5 minutes resolution..')
+        with instr.timed('dispatch refinement'):
+            fine_calendar = dispatch_calendar(params['snapshots'], 5,
+                                              params['mode_opf'])
+            fine_load, fine_constraints = preprocess_input_data(
+                load, gen_constraints, params, fine_calendar)
+            fine_max_pu = fine_constraints['p_max_pu']
+            fine_min_pu = fine_constraints['p_min_pu']
+            if aggregation is not None:
+                fine_max_pu = lp_dispatch.aggregate_bounds(aggregation, fine_max_pu)
+                fine_min_pu = lp_dispatch.aggregate_bounds(aggregation, fine_min_pu)
+            opf_prod = lp_dispatch.run_refinement(
+                generators, opf_prod, fine_load, fine_max_pu, fine_min_pu,
+                calendar.step, merit_order,
+                band_pu=params.get('refine_band_pu', 0.1),
+                block_steps=params.get('refine_block_min', 1440) // 5,
+                n_workers=n_parallel, engine=params.get('lp_engine'),
+                solver_options=kwargs.get('solver_options'),
+                relax=params.get('feasibility_screen') == 'relax')
+    if aggregation is not None:
+        opf_prod = lp_dispatch.disaggregate(aggregation, opf_prod)
     # Create complete prod_p dataframe and interpolate missing rows
     prod_p = opf_prod.copy()
     # Apply interpolation in case of step_opf_min greater than 5 min
-    if params['step_opf_min'] > 5:
+    if params['step_opf_min'] > 5 and not refine:
         print ('\n => Interpolating dispatch into 5 minutes resolution..')
-        prod_p = interpolate_dispatch(prod_p)
+        with instr.timed('dispatch interpolation'):
+            prod_p = interpolate_dispatch(prod_p)
 
-    # Get the prices of the marginal generator at each timestep
-    marginal_costs = pypsa_net.generators.marginal_cost
-    marginal_prices = prod_p.apply(
-        lambda row: marginal_costs[row[row > 0].index].max(),
-        axis=1)
+    with instr.timed('prices'):
+        # Marginal prices are the duals of the balance when the solver gives
+        # them, otherwise the prices of the marginal generator at each timestep
+        marginal_prices = None
+        if params.get('prices_from_duals', True):
+            marginal_prices = marginal_prices_from_duals(window_prices, prod_p.index)
+        if marginal_prices is None:
+            marginal_prices = marginal_prices_from_dispatch(
+                prod_p, pypsa_net.generators.marginal_cost)
 
     # Add noise to results
     # gen_cap = pypsa_net.generators.p_nom
@@ -153,6 +237,7 @@ if __name__ == "__main__":
 
     # **  **  **  **  ** 
     # Load the PyPSA grid
+    import pypsa
     net = pypsa.Network(import_name=args.grid_path)
 
     # Load consumption data without index
@@ -1,12 +1,20 @@
+from collections import namedtuple
 from datetime import datetime
 from enum import Enum
 
 import numpy as np
 import pandas as pd
-import pypsa
 import copy 
 
-from chronix2grid.generation.dispatch.utils import RampMode
+from chronix2grid.generation.dispatch.utils import CARRIERS_WITHOUT_RAMPS, iso_week
+from chronix2grid import instrumentation as instr
+
+# Time steps of a dispatch: snapshots are the 5 minutes input time steps,
+# index the OPF time steps (one snapshot out of step) and window_offsets the
+# positions in index of the first time step of each OPF window, followed by
+# len(index)
+DispatchCalendar = namedtuple('DispatchCalendar',
+                              ['snapshots', 'step', 'index', 'window_offsets'])
 
 
 def filter_ramps(net, mode):
@@ -23,16 +31,10 @@ def filter_ramps(net, mode):
     -------
     The modified pypsa.Network instance
     """
-    hydro_names = net.generators[net.generators.carrier == 'hydro'].index.tolist()
-    thermal_names = net.generators[net.generators.carrier == 'thermal'].index.tolist()
-    nuclear_names = net.generators[net.generators.carrier == 'nuclear'].index.tolist()
-
-    if mode == RampMode.medium:
-        net = remove_ramps(net, thermal_names)
-    if mode == RampMode.easy:
-        net = remove_ramps(net, hydro_names + thermal_names)
-    if mode == RampMode.none:
-        net = remove_ramps(net, nuclear_names + hydro_names + thermal_names)
+    carriers = CARRIERS_WITHOUT_RAMPS[mode]
+    if carriers:
+        net = remove_ramps(
+            net, net.generators[net.generators.carrier.isin(carriers)].index.tolist())
     return net
 
 
@@ -118,7 +120,42 @@ def update_params(num, start_date, params_user):
         params.update({'snapshots': snapshots})
     return params
 
-def preprocess_input_data(load, gen_constraints, params):
+def dispatch_calendar(snapshots, step_opf_min, mode):
+    """ Precompute the OPF time steps and windows of a dispatch: every
+    month is split per opf mode, in windows of consecutive time steps
+    
+    Parameters
+    ----------
+    snapshots : DatetimeIndex
+        Input time steps, every 5 minutes
+    step_opf_min : int
+        Minutes between two OPF time steps
+    mode : str or None
+        [day, week, month], or None for a single window
+    
+    Returns
+    -------
+    DispatchCalendar
+    """
+    step = max(int(step_opf_min) // 5, 1)
+    index = snapshots[::step]
+    if mode is None or len(index) == 0:
+        starts = np.zeros(min(len(index), 1), dtype=int)
+    else:
+        keys = {'day': index.day.values,
+                'week': iso_week(index),
+                'month': np.zeros(len(index), dtype=int)}[mode]
+        keys = index.month.values * 100 + keys
+        starts = np.r_[0, np.flatnonzero(keys[1:] != keys[:-1]) + 1]
+    return DispatchCalendar(snapshots=snapshots, step=step, index=index,
+                            window_offsets=np.r_[starts, len(index)])
+
+def calendar_windows(calendar):
+    """ (first, last) positions in calendar.index of each OPF window """
+    offsets = calendar.window_offsets.tolist()
+    return list(zip(offsets[:-1], offsets[1:]))
+
+def preprocess_input_data(load, gen_constraints, params, calendar=None):
     """ Functions to modify temporarily input data as following:
            - It checks whether load and gen constraints have same lengt.
            - It sets up index in all dataframes with temp data_range format.
@@ -135,26 +172,31 @@ def preprocess_input_data(load, gen_constraints, params):
            - p_min_pu: df with all min gen constraints in pu
     params : dict
         OPF parameters
+    calendar : DispatchCalendar or None
+        As returned by dispatch_calendar, computed from params if None
     
     Returns
     -------
     df, dict
-        Updated input data 
+        Updated input data, indexed by the OPF time steps
     """    
     # Check lenght between load and gen constraints
     for k in gen_constraints:
         if gen_constraints[k] is not None and gen_constraints[k].shape[0] != load.shape[0]:
             raise RuntimeError(f'Gen constraint in [{k}] does not have same lenght as input data')
+    if calendar is None:
+        calendar = dispatch_calendar(params['snapshots'], params['step_opf_min'],
+                                     params['mode_opf'])
     # Get load after adapting to step_opf_min  
-    new_load = reformat_load(load, params)
+    new_load = reformat_load(load, params, calendar)
     # Get gen contraints after adapting to step_opf_min
-    new_gen_const = reformat_gen_constraints(gen_constraints, params, new_load.index)
+    new_gen_const = reformat_gen_constraints(gen_constraints, params, calendar)
     return new_load, new_gen_const
     
-def reformat_load(load, params):
+def reformat_load(load, params, calendar):
     """ Reformat Load input data:
-          - Set date_range as index to load df
-          - Resamples according to param -step_opf_min-
+          - Keep the time steps of the calendar (every step_opf_min)
+          - Set the calendar time steps as index
     
     Parameters
     ----------
@@ -162,6 +204,7 @@ def reformat_load(load, params):
         Consumption to be filled in opf
     params : dict
         OPF parameters
+    calendar : DispatchCalendar
     
     Returns
     -------
@@ -169,24 +212,18 @@ def reformat_load(load, params):
     """  
     if not isinstance(load, pd.DataFrame): 
         raise RuntimeError(f'Load must be a dataframe - > Error!! {type(load)}')
-    snapshots, step_opf, q_compensation = params['snapshots'], params['step_opf_min'], params['reactive_comp']
-    # Set temp index to load
-    load.index = snapshots
-    # Resample data and scale to compensate reactive part
-    load_resampled = load.resample(f'{str(step_opf)}min').apply(lambda x: x[0])
-    load_resampled *= q_compensation
+    # Time steps of the OPF, scaled to compensate reactive part
+    values = load.values[::calendar.step] * params['reactive_comp']
     # -- Agregate load in case it is not
-    if load_resampled.columns.tolist() == ['agg_load']:
-        return load_resampled
-    else:
-        agg_load = load_resampled.sum(axis=1).to_frame()
-        agg_load.columns = ['agg_load']
-        return agg_load
+    if load.columns.tolist() != ['agg_load']:
+        values = values.sum(axis=1, keepdims=True)
+    return pd.DataFrame(values, index=calendar.index, columns=['agg_load'])
 
-def reformat_gen_constraints(gen_constraints, params, new_snaps):
+def reformat_gen_constraints(gen_constraints, params, calendar):
     """
-          - Set date_range as index to all dfs in gen constraints dictionary
-          - Resamples according to param -step_opf_min-
+          - Keep the time steps of the calendar (every step_opf_min), as
+            strided views of the constraints
+          - Set the calendar time steps as index
     
     Parameters
     ----------
@@ -196,28 +233,24 @@ def reformat_gen_constraints(gen_constraints, params, new_snaps):
            - p_min_pu: df with all min gen constraints 
     params : dict
         OPF parameters
-    new_snaps : Datetime
-        Resampled index extracted from input df
+    calendar : DispatchCalendar
     
     Returns
     -------
     dict
         Updated gen dict constraints
     """    
-    snapshots = params['snapshots']
-    resampled_snapshots = new_snaps
-    # Set index in gen contraints 
-    for k in gen_constraints:
-        if gen_constraints[k] is None:  # If no data is passed. An empty df is created
-            gen_constraints.update({k: pd.DataFrame(index=snapshots)})
-        else:  # Otherwise it will set up new indexes
-            if not isinstance(gen_constraints[k], pd.DataFrame): 
-                raise RuntimeError(f'Gen constraints {k} must be a dataframe - > Error!! {type(gen_constraints[k])}')
-            gen_constraints[k].index = snapshots
-            gen_constraints.update({k: gen_constraints[k]})
-        # Finally a resampled df is updated in dict
-        gen_constraints.update({k: gen_constraints[k].loc[resampled_snapshots]})
-    return gen_constraints
+    new_gen_constraints = {}
+    for k, constraint in gen_constraints.items():
+        if constraint is None:  # If no data is passed. An empty df is created
+            new_gen_constraints[k] = pd.DataFrame(index=calendar.index)
+            continue
+        if not isinstance(constraint, pd.DataFrame): 
+            raise RuntimeError(f'Gen constraints {k} must be a dataframe - > Error!! {type(constraint)}')
+        new_gen_constraints[k] = pd.DataFrame(
+            constraint.values[::calendar.step], index=calendar.index,
+            columns=constraint.columns)
+    return new_gen_constraints
 
 def preprocess_net(net, every_min, input_data_resolution=5):
     """ Function that mainly performs the following tasks:
@@ -261,12 +294,27 @@ def get_grouped_snapshots(snapshot, mode):
     mode : str
         [day, week, month]
     """    
-    # Define all posibilities mode
-    periods = {'day': snapshot.groupby(snapshot.day).values(),
-               'week': snapshot.groupby(snapshot.week).values(),
-               'month': snapshot.groupby(snapshot.month).values()
-    }
-    return periods[mode]
+    calendar = dispatch_calendar(snapshot, 5, mode)
+    return [snapshot[first:last] for first, last in calendar_windows(calendar)]
+
+def get_opf_windows(snapshots, mode):
+    """ Get the snapshots of each OPF window: every month is split
+    per opf mode
+    
+    Parameters
+    ----------
+    snapshots : datetime
+    mode : str or None
+        [day, week, month], or None for a single window
+    
+    Returns
+    -------
+    list
+        Snapshots of the windows, in chronological order
+    """
+    if mode is None:
+        return [snapshots]
+    return get_grouped_snapshots(snapshots, mode)
 
 def run_opf(net, demand, gen_max, gen_min, params, **kwargs):
     """ Run linear OPF problem in PyPSA considering
@@ -286,8 +334,9 @@ def run_opf(net, demand, gen_max, gen_min, params, **kwargs):
     
     Returns
     -------
-    dataframe
-        Results of OPF dispatch
+    dataframe, str, series
+        Results of OPF dispatch, termination condition and marginal price
+        of the bus (dual of the balance), None if not available
     """    
     
     to_disp = {'day': demand.index.day.unique().values[0],
@@ -301,25 +350,29 @@ def run_opf(net, demand, gen_max, gen_min, params, **kwargs):
         print(f'\n--> OPF formulation by => {mode} - Analyzing {mode} # {to_disp[mode]}')
     # Reset information previously 
     # saved it in PyPSA instance
-    net.loads_t.p_set = net.loads_t.p_set.iloc[0:0, 0:0]
-    net.generators_t.p_max_pu = net.generators_t.p_max_pu.iloc[0:0, 0:0]
-    net.generators_t.p_min_pu = net.generators_t.p_min_pu.iloc[0:0, 0:0]
-    # Set snapshots
-    net.set_snapshots(demand.index)
-    # ++  ++  ++  ++  ++  ++  ++  ++  ++  ++  ++ 
-    # Fill load and gen constraints to PyPSA grid
-    net.loads_t.p_set = pd.concat([demand])
-    net.generators_t.p_max_pu = pd.concat([gen_max], axis=1)
-    net.generators_t.p_min_pu = pd.concat([gen_min], axis=1)
+    with instr.timed('opf build'):
+        net.loads_t.p_set = net.loads_t.p_set.iloc[0:0, 0:0]
+        net.generators_t.p_max_pu = net.generators_t.p_max_pu.iloc[0:0, 0:0]
+        net.generators_t.p_min_pu = net.generators_t.p_min_pu.iloc[0:0, 0:0]
+        # Set snapshots
+        net.set_snapshots(demand.index)
+        # ++  ++  ++  ++  ++  ++  ++  ++  ++  ++  ++ 
+        # Fill load and gen constraints to PyPSA grid
+        net.loads_t.p_set = pd.concat([demand])
+        net.generators_t.p_max_pu = pd.concat([gen_max], axis=1)
+        net.generators_t.p_min_pu = pd.concat([gen_min], axis=1)
     # ++  ++  ++  ++
-    # Run Linear OPF
-    status, termination_condition = net.lopf(net.snapshots, **kwargs)
+    # Run Linear OPF (pypsa builds the LP model and solves it in lopf)
+    with instr.timed('opf solve'):
+        status, termination_condition = net.lopf(net.snapshots, **kwargs)
     if status != 'ok':
         print('** OPF failed to find an optimal solution **')
     else:
         print('-- opf succeeded  >Objective value (should be greater than zero!')
 
-    return net.generators_t.p.copy(), termination_condition
+    marginal_price = net.buses_t.marginal_price
+    prices = marginal_price.iloc[:, 0].copy() if len(marginal_price.columns) else None
+    return net.generators_t.p.copy(), termination_condition, prices
 
                            
 def add_noise_gen(dispatch, gen_cap, noise_factor):
@@ -354,6 +407,49 @@ def add_noise_gen(dispatch, gen_cap, noise_factor):
         dispatch_new[col] = dispatch[col] * noise
     return dispatch_new.round(2)
 
+def marginal_prices_from_dispatch(dispatch, marginal_costs):
+    """Price of the most expensive generator producing at each time step,
+    NaN when none produces
+    
+    Parameters
+    ----------
+    dispatch : dataframe
+        OPF dispatch result
+    marginal_costs : series
+        Marginal cost of the generators
+    
+    Returns
+    -------
+    series
+    """
+    costs = marginal_costs.reindex(dispatch.columns).values.astype(float)
+    masked_costs = np.where(dispatch.values > 0, costs, -np.inf)
+    prices = masked_costs.max(axis=1) if masked_costs.shape[1] else \
+        np.full(len(dispatch), -np.inf)
+    prices[np.isneginf(prices)] = np.nan
+    return pd.Series(prices, index=dispatch.index)
+
+def marginal_prices_from_duals(window_prices, index):
+    """Marginal prices of the OPF windows on the dispatch index, each price
+    holding until the next OPF time step. None if any window has no prices
+    
+    Parameters
+    ----------
+    window_prices : list
+        Duals of the balance of each window (series), or None
+    index : datetime
+        Index of the (interpolated) dispatch
+    
+    Returns
+    -------
+    series or None
+    """
+    if not window_prices or any(prices is None or prices.isna().any()
+                                for prices in window_prices):
+        return None
+    prices = pd.concat(window_prices).sort_index()
+    return prices.reindex(index, method='ffill')
+
 def interpolate_dispatch(dispatch, method='quadratic'):
     """Function to interpolate in case opf in running for 
     steps greater than 5 min.
@@ -3,24 +3,55 @@ an economic dispatch based on RES and consumption time series"""
 
 from collections import namedtuple
 from copy import deepcopy
-import datetime as dt
 import os
+import pickle
+import tempfile
 
-import grid2op
-from grid2op.Chronics import ChangeNothing
+import numpy as np
 import pandas as pd
-import plotly.express as px
 import pypsa
 
-from .utils import RampMode
+from .utils import RampMode, minute_of_year
+from . import lp_dispatch
 from .EDispatch_L2RPN2020.run_economic_dispatch import main_run_disptach
 from .EDispatch_L2RPN2020.utils import add_noise_gen
 import chronix2grid.constants as cst
+from chronix2grid import instrumentation as instr
+from chronix2grid.stage_cache import BoundedCache, hash_file, hash_inputs
 
 DispatchResults = namedtuple('DispatchResults', ['chronix', 'terminal_conditions'])
 
-
-def init_dispatcher_from_config(grid_path, input_folder):
+# Sub folder of the cache folder receiving the Dispatchers built from a grid
+DISPATCHER_CACHE_FOLDER_NAME = 'dispatcher'
+# Sub folder of the cache folder receiving the results of the dispatch
+DISPATCH_RESULTS_CACHE_FOLDER_NAME = 'dispatch_results'
+# Options of the OPF without effect on its results, left out of the key of
+# the results cache
+DISPATCH_CACHE_NEUTRAL_PARAMS = ['solver_threads', 'blas_threads', 'pin_workers',
+                                 'dispatch_cache_max_entries',
+                                 'dispatch_cache_max_mb']
+# Values of options of the OPF giving the same results as leaving the option
+# out: the 'flag' screen either fails or leaves the demand as it is
+DISPATCH_CACHE_NEUTRAL_VALUES = {'feasibility_screen': [None, 'flag']}
+
+
+def gen_table_from_grid2op_env(grid2op_env):
+    """
+    Characteristics of the generators of a grid2op environment needed by the
+    Dispatcher, indexed by generator name
+    """
+    return pd.DataFrame(
+        index=pd.Index(list(grid2op_env.name_gen), name='name'),
+        data=dict(type=list(grid2op_env.gen_type),
+                  pmax=list(grid2op_env.gen_pmax),
+                  max_ramp_up=list(grid2op_env.gen_max_ramp_up),
+                  max_ramp_down=list(grid2op_env.gen_max_ramp_down),
+                  cost_per_MW=list(grid2op_env.gen_cost_per_MW)))
+
+
+def build_dispatcher(grid_path, hydro_file_path):
+    import grid2op
+    from grid2op.Chronics import ChangeNothing
 
     #Patch: we need to modify slighty Pmax and ramps according to the floating point number precision we have
     #
@@ -33,12 +64,70 @@ def init_dispatcher_from_config(grid_path, input_folder):
 
     dispatcher = Dispatcher.from_gri2op_env(env118_withoutchron)
 
-    dispatcher.read_hydro_guide_curves(
-        os.path.join(input_folder, 'patterns', 'hydro_french.csv'))
+    dispatcher.read_hydro_guide_curves(hydro_file_path)
 
     return dispatcher
 
 
+def init_dispatcher_from_config(grid_path, input_folder, cache_folder=None):
+    """
+    Build the Dispatcher of a grid, with the hydro guide curves of input_folder
+
+    If cache_folder is not None, the generators table and the Dispatcher are
+    stored in it under a hash of the grid and hydro files, and restored
+    without starting grid2op by later calls with the same files
+    """
+    hydro_file_path = os.path.join(input_folder, 'patterns', 'hydro_french.csv')
+    if cache_folder is None:
+        return build_dispatcher(grid_path, hydro_file_path)
+
+    key = hash_inputs(hash_file(grid_path), hash_file(hydro_file_path))
+    dispatcher_folder = os.path.join(cache_folder, DISPATCHER_CACHE_FOLDER_NAME)
+    entry_path = os.path.join(dispatcher_folder, key + '.pkl')
+    if os.path.isfile(entry_path):
+        with open(entry_path, 'rb') as f:
+            entry = pickle.load(f)
+        print(f'Restoring dispatcher from cache ({key[:12]})')
+        if entry['dispatcher'] is not None:
+            return entry['dispatcher']
+        # The network could not be pickled: it is rebuilt from the
+        # generators table, which does not need grid2op either
+        dispatcher = Dispatcher.from_gen_table(entry['gen_table'])
+        dispatcher.read_hydro_guide_curves(hydro_file_path)
+        return dispatcher
+
+    dispatcher = build_dispatcher(grid_path, hydro_file_path)
+    try:
+        entry = pickle.dumps(dict(gen_table=dispatcher._gen_table,
+                                  dispatcher=dispatcher))
+    except (pickle.PicklingError, TypeError, AttributeError):
+        entry = pickle.dumps(dict(gen_table=dispatcher._gen_table,
+                                  dispatcher=None))
+    os.makedirs(dispatcher_folder, exist_ok=True)
+    # Written in a temporary file and then renamed, so that concurrent
+    # workers never read a partially written entry
+    file_descriptor, tmp_path = tempfile.mkstemp(dir=dispatcher_folder)
+    with os.fdopen(file_descriptor, 'wb') as f:
+        f.write(entry)
+    os.replace(tmp_path, entry_path)
+    return dispatcher
+
+
+def make_dispatch_result_cache(cache_folder, params_opf):
+    """
+    Bounded cache of the results of the dispatch in cache_folder, holding at
+    most dispatch_cache_max_entries results (32 by default) and
+    dispatch_cache_max_mb MB (1000 by default) of params_opf. None if
+    cache_folder is None
+    """
+    if cache_folder is None:
+        return None
+    return BoundedCache(
+        os.path.join(cache_folder, DISPATCH_RESULTS_CACHE_FOLDER_NAME),
+        max_entries=params_opf.get('dispatch_cache_max_entries', 32),
+        max_mb=params_opf.get('dispatch_cache_max_mb', 1000.))
+
+
 class Dispatcher(pypsa.Network):
     """Wrapper around a pypsa.Network to add higher level methods"""
 
@@ -46,7 +135,8 @@ class Dispatcher(pypsa.Network):
         super().__init__(*args, **kwargs)
         self.add('Bus', 'node')
         self.add('Load', name='agg_load', bus='node')
-        self._env = None  # The grid2op environment when instanciated with from_gri2dop_env
+        self._gen_table = None  # Generators of the grid, set by from_gen_table
+        self._initial_ramps = None  # Ramps set by from_gen_table
         self._chronix_scenario = None
         self._simplified_chronix_scenario = None
         self._has_results = False
@@ -92,8 +182,16 @@ class Dispatcher(pypsa.Network):
 
     @classmethod
     def from_gri2op_env(cls, grid2op_env):
+        return cls.from_gen_table(gen_table_from_grid2op_env(grid2op_env))
+
+    @classmethod
+    def from_gen_table(cls, gen_table):
+        """
+        Dispatcher of the generators of gen_table, as returned by
+        gen_table_from_grid2op_env
+        """
         net = cls()
-        net._env = grid2op_env
+        net._gen_table = gen_table
 
         carrier_types_to_exclude = ['wind', 'solar']
         
@@ -102,61 +200,69 @@ class Dispatcher(pypsa.Network):
         PmaxCorrectingFactor=1
         RampCorrectingFactor=0.1
 
-        for i, generator in enumerate(grid2op_env.name_gen):
-            gen_type = grid2op_env.gen_type[i]
+        for generator, characteristics in gen_table.iterrows():
+            gen_type = characteristics['type']
             if gen_type not in carrier_types_to_exclude:
-                p_max=grid2op_env.gen_pmax[i]
+                p_max=characteristics['pmax']
                 pnom=p_max-PmaxCorrectingFactor
-                rampUp=(grid2op_env.gen_max_ramp_up[i]-RampCorrectingFactor) / p_max
-                RampDown=(grid2op_env.gen_max_ramp_down[i]-RampCorrectingFactor) / p_max
+                rampUp=(characteristics['max_ramp_up']-RampCorrectingFactor) / p_max
+                RampDown=(characteristics['max_ramp_down']-RampCorrectingFactor) / p_max
                 
                 net.add(
                     class_name='Generator', name=generator, bus='node',
-                    p_nom=pnom, carrier=grid2op_env.gen_type[i],
-                    marginal_cost=grid2op_env.gen_cost_per_MW[i],
+                    p_nom=pnom, carrier=gen_type,
+                    marginal_cost=characteristics['cost_per_MW'],
                     ramp_limit_up=rampUp,
                     ramp_limit_down=RampDown,
                 )
+        # Kept to restore the ramps after each run, so that a Dispatcher can
+        # be reused for several scenarios
+        net._initial_ramps = net.generators[
+            ['ramp_limit_up', 'ramp_limit_down']].copy()
 
         return net
 
     def reset_ramps_from_grid2op_env(self):
-        if self._env is None:
+        if self._gen_table is None:
             raise Exception('This method can only be applied when Dispatch has been'
                             'instantiated from a grid2op Environment.')
-        for i, generator in enumerate(self._env.name_gen):
-            if generator in self.generators.index:
-                self.generators.loc[generator, 'ramp_limit_up'] = \
-                    self._env.gen_max_ramp_up[i] / self._env.gen_pmax[i]
-                self.generators.loc[generator, 'ramp_limit_down'] = \
-                    self._env.gen_max_ramp_down[i] / self._env.gen_pmax[i]
+        generators = self._initial_ramps.index.intersection(self.generators.index)
+        for column in ['ramp_limit_up', 'ramp_limit_down']:
+            self.generators.loc[generators, column] = \
+                self._initial_ramps.loc[generators, column]
 
     def read_hydro_guide_curves(self, hydro_file_path):
-        dateparse = lambda x: dt.datetime.strptime(x, '%Y-%m-%d %H:%M')
-        hydro_pattern = pd.read_csv(hydro_file_path, usecols=[0, 2, 3],
-                                    parse_dates=[0], date_parser=dateparse)
-        hydro_pattern.set_index(hydro_pattern.columns[0], inplace=True)
+        """
+        Read the guide curves, in per unit, shared by all the hydro generators.
+        They are indexed by minute of the year (see utils.minute_of_year) and
+        the curve is broadcast to the generators without being copied
+        """
+        hydro_pattern = pd.read_csv(hydro_file_path, usecols=[0, 2, 3])
+        minutes = minute_of_year(pd.to_datetime(hydro_pattern.iloc[:, 0],
+                                                format='%Y-%m-%d %H:%M'))
+        order = np.argsort(minutes, kind='stable')
         hydro_names = self.generators[self.generators.carrier == 'hydro'].index
 
         for extremum in ['min', 'max']:
-            hydro_pu = hydro_pattern[[f'p_{extremum}_u'] * len(hydro_names)]
-            hydro_pu.columns = hydro_names
-            hydro_pu.index = hydro_pu.index.map(
-                lambda x: (x.month, x.day, x.hour, x.minute, x.second))
+            curve = hydro_pattern[f'p_{extremum}_u'].values[order]
+            hydro_pu = pd.DataFrame(
+                np.broadcast_to(curve[:, np.newaxis], (len(curve), len(hydro_names))),
+                index=pd.Index(minutes[order], name='minute_of_year'),
+                columns=hydro_names)
             setattr(self, f'_{extremum}_hydro_pu', hydro_pu)
 
+        # Constraints of the scenario windows already computed, by date range
+        self._hydro_windows = {}
         self._hydro_file_path = hydro_file_path
 
     def read_load_and_res_scenario(self, load_path_file, prod_path_file,
                                    scenario_name, start_date, end_date, dt):
-        if self._env is None:
+        if self._gen_table is None:
             raise Exception('This method can only be applied when Dispatch has been'
                             'instantiated from a grid2op Environment.')
         res_names = dict(
-            wind=[name for i, name in enumerate(self._env.name_gen)
-                  if self._env.gen_type[i] == 'wind'],
-            solar=[name for i, name in enumerate(self._env.name_gen)
-                   if self._env.gen_type[i] == 'solar']
+            wind=list(self._gen_table.index[self._gen_table['type'] == 'wind']),
+            solar=list(self._gen_table.index[self._gen_table['type'] == 'solar'])
         )
         self._chronix_scenario = ChroniXScenario.from_disk(
             load_path_file, prod_path_file,
@@ -169,14 +275,24 @@ class Dispatcher(pypsa.Network):
             raise Exception('This method can only be applied when a Scenario for load'
                             'and renewables has been instantiated and hydro guide'
                             'curves have been read.')
-        index_slice = self._chronix_scenario.loads.index.map(
-           lambda x: (x.month, x.day, x.hour, x.minute, x.second)
-        )
-
-        self._min_hydro_pu = self._min_hydro_pu.reindex(index_slice).fillna(method='ffill')
-        self._max_hydro_pu = self._max_hydro_pu.reindex(index_slice).fillna(method='ffill')
-
-        return {'p_max_pu': self._max_hydro_pu.copy(), 'p_min_pu': self._min_hydro_pu.copy()}
+        index = self._chronix_scenario.loads.index
+        key = (index[0], index[-1], len(index))
+        if key not in self._hydro_windows:
+            # Last point of the guide curves at or before each date
+            positions = np.searchsorted(self._max_hydro_pu.index.values,
+                                        minute_of_year(index), side='right') - 1
+            positions = np.maximum(positions, 0)
+            self._hydro_windows[key] = {
+                f'p_{extremum}_pu': pd.DataFrame(
+                    np.broadcast_to(
+                        getattr(self, f'_{extremum}_hydro_pu').values[positions, :1],
+                        (len(index), self._max_hydro_pu.shape[1])),
+                    index=index, columns=self._max_hydro_pu.columns)
+                for extremum in ['min', 'max']}
+
+        # Copies, since the dispatch modifies the constraints it is given
+        return {name: constraint.copy()
+                for name, constraint in self._hydro_windows[key].items()}
 
     def modify_marginal_costs(self, new_costs):
         """
@@ -198,6 +314,8 @@ class Dispatcher(pypsa.Network):
                 raise
 
     def plot_ramps(self):
+        import plotly.express as px
+
         caract_gen = self.generators[['p_nom', 'carrier', 'ramp_limit_up']].reset_index()
         caract_gen = caract_gen.rename(columns={'index': 'name'})
 
@@ -243,25 +361,93 @@ class Dispatcher(pypsa.Network):
             ], axis=1))
         return simplified_net
 
+    def dispatch_key(self, load, params, gen_constraints, ramp_mode, by_carrier,
+                     **kwargs):
+        """
+        Hash of everything determining the results of run: the net load, the
+        options of the OPF, the generators and their constraints. The solver
+        and worker options only limit their threads and are left out
+        """
+        return hash_inputs(
+            load,
+            {key: value for key, value in params.items()
+             if key not in DISPATCH_CACHE_NEUTRAL_PARAMS
+             and value not in DISPATCH_CACHE_NEUTRAL_VALUES.get(key, [])},
+            self._gen_table,
+            self.generators[['carrier', 'p_nom', 'marginal_cost',
+                             'ramp_limit_up', 'ramp_limit_down']],
+            {key: constraint for key, constraint in gen_constraints.items()
+             if constraint is not None},
+            ramp_mode.name, by_carrier,
+            {key: value for key, value in kwargs.items()
+             if key != 'solver_options'})
+
     def run(self, load, params, gen_constraints=None,
-                     ramp_mode=RampMode.hard, by_carrier=False, **kwargs):
+                     ramp_mode=RampMode.hard, by_carrier=False,
+                     result_cache=None, **kwargs):
+        """
+        Run the dispatch of load. If result_cache (a BoundedCache, see
+        make_dispatch_result_cache) is given, the results are restored from
+        it when the same dispatch has already been run, without solving it
+        """
+        gen_constraints = gen_constraints or {}
+        cache_key = None
+        if result_cache is not None:
+            cache_key = self.dispatch_key(load, params, gen_constraints,
+                                          ramp_mode, by_carrier, **kwargs)
+            with instr.timed('cache restore'):
+                cached = result_cache.get(cache_key)
+            if cached is not None:
+                print(f'Restoring dispatch results from cache ({cache_key[:12]})')
+                return self._set_results(*cached)
+        unit_constraints = {key: constraint.copy() for key, constraint
+                            in gen_constraints.items() if constraint is not None}
+        if by_carrier:
+            # Bounds of the carriers from the ones of their generators
+            gen_constraints = {
+                key: lp_dispatch.carrier_bounds(constraint, self.generators, key)
+                for key, constraint in gen_constraints.items()}
         prods_dispatch, terminal_conditions, marginal_prices = main_run_disptach(
             self if not by_carrier else self.simplify_net(),
             load, params, gen_constraints, ramp_mode, **kwargs)
+        simplified = False
         if by_carrier:
+            simplified = True
+            if params.get('disaggregate_by_carrier', True):
+                # Dispatch of the generators shared out of their carriers'
+                with instr.timed('disaggregation'):
+                    unit_constraints = {
+                        key: pd.DataFrame(constraint.values[:len(prods_dispatch)],
+                                          index=prods_dispatch.index,
+                                          columns=constraint.columns)
+                        for key, constraint in unit_constraints.items()}
+                    prods_dispatch = lp_dispatch.disaggregate_carriers(
+                        prods_dispatch, self.generators, ramp_mode,
+                        unit_constraints.get('p_max_pu'),
+                        unit_constraints.get('p_min_pu'))
+                simplified = False
+        self.reset_ramps_from_grid2op_env()
+        if result_cache is not None:
+            result_cache.put(cache_key, (prods_dispatch, marginal_prices,
+                                   terminal_conditions, simplified))
+        return self._set_results(prods_dispatch, marginal_prices,
+                                 terminal_conditions, simplified)
+
+    def _set_results(self, prods_dispatch, marginal_prices, terminal_conditions,
+                     simplified):
+        """
+        Attach the results of a dispatch to the scenario, or to its version by
+        carrier if simplified, as saved by save_results
+        """
+        if simplified:
             self._simplified_chronix_scenario = self._chronix_scenario.simplify_chronix()
-            self._simplified_chronix_scenario.prods_dispatch = prods_dispatch
-            self._simplified_chronix_scenario.marginal_prices = marginal_prices
             results = self._simplified_chronix_scenario
-            self._has_simplified_results = True
-            self._has_results = False
         else:
-            self._chronix_scenario.prods_dispatch = prods_dispatch
-            self._chronix_scenario.marginal_prices = marginal_prices
             results = self._chronix_scenario
-            self._has_results = True
-            self._has_simplified_results = False
-        self.reset_ramps_from_grid2op_env()
+        results.prods_dispatch = prods_dispatch
+        results.marginal_prices = marginal_prices
+        self._has_results = not simplified
+        self._has_simplified_results = simplified
         return DispatchResults(chronix=results, terminal_conditions=terminal_conditions)
 
     def save_results(self, params, output_folder):
@@ -275,42 +461,45 @@ class Dispatcher(pypsa.Network):
             print('Saving results for the grids with aggregated generators by carriers...')
             res_load_scenario = self._simplified_chronix_scenario
 
-        full_opf_dispatch = pd.concat(
-            [res_load_scenario.prods_dispatch, res_load_scenario.wind_p,
-             res_load_scenario.solar_p],
-            axis=1
-        )
-        try:
-            full_opf_dispatch = full_opf_dispatch[self._env.name_gen].round(2)
-        except KeyError:
-            # Either we're trying to save results from a simplified dispatch or
-            # using the save function before instanciating an env.
-            pass
-
-        gen_cap = pd.Series({gen_name: gen_pmax for gen_name, gen_pmax in
-                             zip(self._env.name_gen, self._env.gen_pmax)})
-        
-        prod_p_forecasted_with_noise = add_noise_gen(full_opf_dispatch, gen_cap, noise_factor=params['planned_std'])
+        with instr.timed('saving'):
+            full_opf_dispatch = pd.concat(
+                [res_load_scenario.prods_dispatch, res_load_scenario.wind_p,
+                 res_load_scenario.solar_p],
+                axis=1
+            )
+            try:
+                full_opf_dispatch = full_opf_dispatch[self._gen_table.index].round(2)
+            except KeyError:
+                # Either we're trying to save results from a simplified dispatch or
+                # using the save function before instanciating an env.
+                pass
+
+            gen_cap = self._gen_table['pmax']
+
+            prod_p_forecasted_with_noise = add_noise_gen(full_opf_dispatch, gen_cap, noise_factor=params['planned_std'])
 
-          
         #prod_p_forecasted_with_noise.to_csv(
-        prod_p_forecasted_with_noise.to_csv(
+        instr.to_csv(
+            prod_p_forecasted_with_noise,
             os.path.join(output_folder, "prod_p_forecasted.csv.bz2"),
             sep=';', index=False,
             float_format=cst.FLOATING_POINT_PRECISION_FORMAT
         )
         #prod_p_with_noise.to_csv(
-        full_opf_dispatch.to_csv(
+        instr.to_csv(
+            full_opf_dispatch,
             os.path.join(output_folder, "prod_p.csv.bz2"),
             sep=';', index=False,
             float_format=cst.FLOATING_POINT_PRECISION_FORMAT
         )
-        res_load_scenario.marginal_prices.to_csv(
+        instr.to_csv(
+            res_load_scenario.marginal_prices,
             os.path.join(output_folder, "prices.csv.bz2"),
             sep=';', index=False,
             float_format=cst.FLOATING_POINT_PRECISION_FORMAT
         )
-        res_load_scenario.loads.to_csv(
+        instr.to_csv(
+            res_load_scenario.loads,
             os.path.join(output_folder, "load_p.csv.bz2"),
             sep=';', index=False,
             float_format=cst.FLOATING_POINT_PRECISION_FORMAT
@@ -4,9 +4,12 @@ import shutil
 import numpy as np
 
 from .EDispatch_L2RPN2020 import run_economic_dispatch
+from .EconomicDispatch import make_dispatch_result_cache
+from ...worker_resources import solver_options
 
 
-def main(dispatcher, input_folder, output_folder, seed, params, params_opf):
+def main(dispatcher, input_folder, output_folder, seed, params, params_opf,
+         cache_folder=None):
     """
 
     Parameters
@@ -21,6 +24,10 @@ def main(dispatcher, input_folder, output_folder, seed, params, params_opf):
         Random seed for parallel execution
     params_opf : dict
         Options for the OPF
+    cache_folder : str
+        If not None, results of the OPF are cached in this folder under a hash
+        of the net load, params_opf and the generators, and restored without
+        solving by later dispatches of the same net load
 
     Returns
     -------
@@ -41,7 +48,9 @@ def main(dispatcher, input_folder, output_folder, seed, params, params_opf):
         ramp_mode=parse_ramp_mode(params_opf['ramp_mode']),
         by_carrier=params_opf['dispatch_by_carrier'],
         pyomo=params_opf['pyomo'],
-        solver_name=params_opf['solver_name']
+        solver_name=params_opf['solver_name'],
+        solver_options=solver_options(params_opf['solver_name'], params_opf),
+        result_cache=make_dispatch_result_cache(cache_folder, params_opf)
     )
     dispatcher.save_results(params, output_folder)
 
@@ -0,0 +1,1084 @@
+"""
+Linear program of the single bus economic dispatch, built once per window
+length and updated in place between windows.
+
+The Dispatcher is a copper plate: generators with a nominal power, a
+marginal cost, ramp limits and bounds (time varying for hydro) feed a single
+aggregated load. For a window of T time steps and G generators, the LP
+variables are the dispatch p[t, g] (time major), with:
+
+- one balance row per time step: sum_g p[t, g] = demand[t]
+- ramp rows for the generators with ramp limits, for t >= 1:
+  p[t, g] - p[t-1, g] <= ramp_up[g] and p[t-1, g] - p[t, g] <= ramp_down[g]
+- bounds p_min[t, g] <= p[t, g] <= p_max[t, g]
+- the objective sum marginal_cost[g] * p[t, g]
+
+as pypsa builds it in lopf. Only the demand (right-hand side of the balance
+rows), the bounds and the costs change from one window to the next: the
+matrices are built once per window length, and with highspy the solver
+model itself is kept and updated, so that each solve starts from the basis
+of the previous one. Without highspy, scipy.optimize.linprog solves the
+cached matrices.
+
+This module does not depend on pypsa: with solver_name 'highs' in
+params_opf.json, the whole dispatch runs on the generators table of the
+Dispatcher, without any pypsa model building nor external solver.
+
+Windows can also be solved concurrently (run_parallel_windows): each window
+is solved with margins overlapping its neighbours, and the seams between
+windows are then solved again with the dispatch on both sides as ramp
+constrained boundary conditions, so that ramps hold across windows.
+
+A dispatch solved every step_opf_min minutes can be refined to 5 minutes
+(run_refinement) by small LPs of a few hours or a day, within a band around
+the coarse dispatch and between its values as boundaries, instead of being
+interpolated.
+"""
+
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import hashlib
+import multiprocessing
+import threading
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.optimize import linprog
+
+from ... import instrumentation as instr
+from .utils import CARRIERS_WITHOUT_RAMPS
+
+try:
+    import highspy
+except ImportError:
+    highspy = None
+
+LP_ENGINES = ['highspy', 'linprog']
+# solver_name of params_opf.json selecting the native dispatch
+NATIVE_SOLVER_NAME = 'highs'
+# Checks of screen_dispatch, and what screen_windows does of the windows
+# failing them
+SCREEN_CHECKS = ['shortage', 'surplus', 'ramp_up', 'ramp_down']
+SCREEN_MODES = ['flag', 'relax']
+
+GeneratorData = namedtuple('GeneratorData', [
+    'names', 'p_nom', 'marginal_cost', 'p_min_pu', 'p_max_pu', 'ramp_up',
+    'ramp_down'])
+# Generators merged by aggregate_generators: aggregate of each generator of
+# units, and share of the aggregate's dispatch it gets
+Aggregation = namedtuple('Aggregation', ['generators', 'units', 'members',
+                                         'shares'])
+
+
+def generator_data(generators):
+    """
+    Generators of a dispatch as arrays
+
+    Parameters
+    ----------
+    generators: pandas.DataFrame
+        Generators table of a pypsa.Network (p_nom, marginal_cost, p_min_pu,
+        p_max_pu, ramp_limit_up and ramp_limit_down, in per unit of p_nom per
+        time step of the OPF, NaN meaning no limit)
+
+    Returns
+    -------
+    GeneratorData
+        With ramps in MW per time step of the OPF
+    """
+    p_nom = generators['p_nom'].values.astype(float)
+    return GeneratorData(
+        names=generators.index,
+        p_nom=p_nom,
+        marginal_cost=generators['marginal_cost'].values.astype(float),
+        p_min_pu=generators['p_min_pu'].values.astype(float),
+        p_max_pu=generators['p_max_pu'].values.astype(float),
+        ramp_up=generators['ramp_limit_up'].values.astype(float) * p_nom,
+        ramp_down=generators['ramp_limit_down'].values.astype(float) * p_nom)
+
+
+def prepare_generators(generators, ramp_mode, step_opf_min,
+                       input_data_resolution=5):
+    """
+    Generators of a dispatch with the ramps of ramp_mode, scaled to the time
+    step of the OPF, as filter_ramps and preprocess_net do on the pypsa network
+
+    Parameters
+    ----------
+    generators: pandas.DataFrame
+        Generators table of the Dispatcher, not modified
+    ramp_mode: RampMode
+        Level of the ramp constraints
+    step_opf_min: int
+        Time step of the OPF in minutes
+    input_data_resolution: int
+        Time step of the ramps of the table in minutes
+
+    Returns
+    -------
+    GeneratorData
+    """
+    generators = generators.copy()
+    generators.loc[generators['carrier'].isin(CARRIERS_WITHOUT_RAMPS[ramp_mode]),
+                   ['ramp_limit_up', 'ramp_limit_down']] = np.nan
+    generators[['ramp_limit_up', 'ramp_limit_down']] *= step_opf_min / input_data_resolution
+    return generator_data(generators)
+
+
+def _series_key(series_pu, name):
+    if series_pu is None or name not in series_pu.columns:
+        return None
+    values = np.ascontiguousarray(series_pu[name].values, dtype=float)
+    return hashlib.sha1(values.tobytes()).hexdigest()
+
+
+def aggregate_generators(generators, gen_max_pu=None, gen_min_pu=None,
+                         decimals=9):
+    """
+    Merge the generators with the same marginal cost, ramps and bounds in
+    per unit of p_nom (time varying ones included) into one generator of
+    their total p_nom. Dispatching the aggregates and sharing their dispatch
+    in proportion to p_nom (disaggregate) is a solution of the dispatch of
+    the generators, of the same cost
+
+    Parameters
+    ----------
+    generators: GeneratorData
+    gen_max_pu, gen_min_pu: pandas.DataFrame or None
+        Time varying bounds in per unit for some generators
+    decimals: int
+        Decimals of the per unit values compared
+
+    Returns
+    -------
+    Aggregation
+        The aggregates are named after their first generator
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        per_unit = np.column_stack([
+            generators.marginal_cost, generators.ramp_up / generators.p_nom,
+            generators.ramp_down / generators.p_nom, generators.p_min_pu,
+            generators.p_max_pu]).round(decimals)
+    keys = [tuple(row) + (_series_key(gen_max_pu, name),
+                          _series_key(gen_min_pu, name))
+            for row, name in zip(np.nan_to_num(per_unit, nan=-1.), generators.names)]
+    first_of_key = {}
+    members = np.array([first_of_key.setdefault(key, len(first_of_key))
+                        for key in keys])
+    firsts = np.array([np.flatnonzero(members == group)[0]
+                       for group in range(len(first_of_key))])
+
+    p_nom = np.bincount(members, weights=generators.p_nom)
+    shares = np.where(p_nom[members] > 0,
+                      generators.p_nom / np.where(p_nom[members] > 0, p_nom[members], 1.),
+                      1. / np.bincount(members)[members])
+    ramp_scale = np.where(generators.p_nom[firsts] > 0,
+                          p_nom / np.where(generators.p_nom[firsts] > 0,
+                                           generators.p_nom[firsts], 1.), 0.)
+    aggregates = GeneratorData(
+        names=generators.names[firsts], p_nom=p_nom,
+        marginal_cost=generators.marginal_cost[firsts],
+        p_min_pu=generators.p_min_pu[firsts],
+        p_max_pu=generators.p_max_pu[firsts],
+        ramp_up=generators.ramp_up[firsts] * ramp_scale,
+        ramp_down=generators.ramp_down[firsts] * ramp_scale)
+    return Aggregation(generators=aggregates, units=generators.names,
+                       members=members, shares=shares)
+
+
+def aggregate_bounds(aggregation, gen_pu):
+    """Time varying bounds in per unit of the aggregates"""
+    if gen_pu is None:
+        return None
+    return gen_pu[aggregation.generators.names.intersection(gen_pu.columns)]
+
+
+def disaggregate(aggregation, dispatch):
+    """
+    Dispatch of the generators from the one of their aggregates (columns),
+    in proportion to their p_nom
+    """
+    values = dispatch[aggregation.generators.names].values
+    return pd.DataFrame(values[:, aggregation.members] * aggregation.shares,
+                        index=dispatch.index, columns=aggregation.units)
+
+
+def carrier_bounds(gen_pu, generators, static_column):
+    """
+    Time varying bounds in per unit of the generators of each carrier, as
+    one generator of the carrier's total p_nom (dispatch by carrier), from
+    the ones of its generators
+
+    Parameters
+    ----------
+    gen_pu: pandas.DataFrame or None
+        Time varying bounds in per unit for some generators
+    generators: pandas.DataFrame
+        Generators table, with p_nom, carrier and the static bounds
+    static_column: str
+        Static bound of the generators without time varying one (p_min_pu or
+        p_max_pu)
+
+    Returns
+    -------
+    pandas.DataFrame or None
+        Time varying bounds of the carriers with some time varying bounds
+    """
+    if gen_pu is None:
+        return None
+    bounds = {}
+    for carrier, units in generators.groupby('carrier'):
+        varying = units.index.intersection(gen_pu.columns)
+        if varying.empty:
+            continue
+        static = units.drop(varying)
+        bounds[carrier] = (
+            gen_pu[varying].values @ units.loc[varying, 'p_nom'].values
+            + (static[static_column] * static['p_nom']).sum()) / units['p_nom'].sum()
+    return pd.DataFrame(bounds, index=gen_pu.index)
+
+
+def disaggregate_carriers(carrier_dispatch, generators, ramp_mode,
+                          gen_max_pu=None, gen_min_pu=None, step_min=5):
+    """
+    Dispatch of the generators from the dispatch of their carriers
+
+    At each time step, the dispatch of a carrier fills the range between the
+    bounds of its generators (time varying ones included) in proportion to
+    their width, which keeps the bounds, for all time steps at once. Ramps
+    are checked afterwards: only from the time steps where a generator
+    exceeds its ramps, the dispatch is rebuilt step by step, each generator
+    following this allocation as close as its ramps from the previous step
+    allow, the rest of the carrier's dispatch being shared within the room
+    left by the ramps (then by the bounds only, when the ramps of the
+    generators cannot follow the carrier's dispatch: the ramp of a carrier
+    is the sum of the ones of its generators, which may not all be able to
+    follow it. The time steps where this happens are reported).
+
+    Parameters
+    ----------
+    carrier_dispatch: pandas.DataFrame
+        Dispatch of each carrier (columns)
+    generators: pandas.DataFrame
+        Generators table, with carrier, p_nom, static bounds and ramps
+    ramp_mode: RampMode
+        Level of the ramp constraints of the dispatch
+    gen_max_pu, gen_min_pu: pandas.DataFrame or None
+        Time varying bounds in per unit for some generators, same index as
+        carrier_dispatch
+    step_min: int
+        Time step of carrier_dispatch in minutes
+
+    Returns
+    -------
+    pandas.DataFrame
+        Dispatch of the generators of the carriers of carrier_dispatch
+    """
+    units = generators[generators['carrier'].isin(carrier_dispatch.columns)]
+    unit_data = prepare_generators(units, ramp_mode, step_min)
+    p_min, p_max = window_bounds(unit_data, carrier_dispatch.index, gen_min_pu,
+                                 gen_max_pu)
+    ramp_up = np.where(np.isnan(unit_data.ramp_up), np.inf, unit_data.ramp_up)
+    ramp_down = np.where(np.isnan(unit_data.ramp_down), np.inf,
+                         unit_data.ramp_down)
+    carriers = units['carrier'].values
+    dispatch = np.zeros(p_min.shape)
+    for carrier in carrier_dispatch.columns:
+        members = np.flatnonzero(carriers == carrier)
+        if not len(members):
+            continue
+        dispatch[:, members] = _share_carrier_dispatch(
+            carrier_dispatch[carrier].values, ramp_up[members],
+            ramp_down[members], p_min[:, members], p_max[:, members])
+        n_exceeding = len(_steps_exceeding_ramps(
+            dispatch[:, members], ramp_up[members], ramp_down[members]))
+        if n_exceeding:
+            print(f'** Generators of {carrier} cannot follow its dispatch within '
+                  f'their ramps at {n_exceeding} time steps **')
+    return pd.DataFrame(dispatch, index=carrier_dispatch.index,
+                        columns=units.index)
+
+
+def _share_within(x, total, low, high):
+    """Move x within [low, high] so that it sums to total, if possible"""
+    residual = total - x.sum()
+    room = (high - x) if residual > 0 else (x - low)
+    if room.sum() > 0:
+        x = x + np.sign(residual) * room * min(abs(residual) / room.sum(), 1.)
+    return x
+
+
+def _steps_exceeding_ramps(dispatch, ramp_up, ramp_down, tolerance=1e-6):
+    variations = np.diff(dispatch, axis=0)
+    return np.flatnonzero(((variations > ramp_up + tolerance)
+                           | (-variations > ramp_down + tolerance)).any(axis=1)) + 1
+
+
+def _share_carrier_dispatch(carrier_dispatch, ramp_up, ramp_down, p_min, p_max,
+                            tolerance=1e-6):
+    """Dispatch of the generators of a carrier, see disaggregate_carriers"""
+    width = p_max - p_min
+    total_width = width.sum(axis=1)
+    fill = (carrier_dispatch - p_min.sum(axis=1)) / np.where(total_width > 0,
+                                                            total_width, 1.)
+    target = p_min + np.clip(fill, 0., 1.)[:, None] * width
+
+    exceeding = _steps_exceeding_ramps(target, ramp_up, ramp_down, tolerance)
+    dispatch = target.copy()
+    step = exceeding[0] if len(exceeding) else len(target)
+    while step < len(target):
+        previous = dispatch[step - 1]
+        low = np.maximum(p_min[step], previous - ramp_down)
+        high = np.minimum(p_max[step], previous + ramp_up)
+        # Bounds moving faster than ramps
+        low, high = np.minimum(low, high), np.maximum(low, high)
+        x = _share_within(np.clip(target[step], low, high),
+                          carrier_dispatch[step], low, high)
+        dispatch[step] = _share_within(x, carrier_dispatch[step], p_min[step],
+                                       p_max[step])
+        if np.allclose(dispatch[step], target[step], atol=tolerance):
+            # Back on the allocation, up to the next step exceeding ramps
+            following = exceeding[exceeding > step]
+            step = following[0] if len(following) else len(target)
+        else:
+            step += 1
+    return dispatch
+
+
+def has_ramps(generators):
+    """Whether some generators have ramp limits, coupling time steps"""
+    return bool((~np.isnan(generators.ramp_up)).any()
+                or (~np.isnan(generators.ramp_down)).any())
+
+
+def default_engine():
+    return 'highspy' if highspy is not None else 'linprog'
+
+
+def _ramp_matrix(n_steps, n_gens, ramped, sign):
+    """Rows sign * (p[t, g] - p[t-1, g]) for the generators ramped and t >= 1"""
+    n_rows = (n_steps - 1) * len(ramped)
+    if n_rows == 0:
+        return sparse.csr_matrix((0, n_steps * n_gens))
+    steps = np.repeat(np.arange(1, n_steps), len(ramped))
+    gens = np.tile(ramped, n_steps - 1)
+    rows = np.arange(n_rows)
+    return sparse.csr_matrix(
+        (np.concatenate([np.full(n_rows, sign), np.full(n_rows, -sign)]),
+         (np.concatenate([rows, rows]),
+          np.concatenate([steps * n_gens + gens, (steps - 1) * n_gens + gens]))),
+        shape=(n_rows, n_steps * n_gens))
+
+
+class WindowLP:
+    """
+    Dispatch LP of windows of n_steps time steps, reused across windows
+
+    Parameters
+    ----------
+    generators: GeneratorData
+        Generators of the dispatch, whose ramps are fixed for all windows
+    n_steps: int
+        Number of time steps of the windows
+    engine: str or None
+        'highspy' to keep a HiGHS model updated in place, 'linprog' to solve
+        with scipy. highspy if installed when None
+    solver_options: dict or None
+        Options of the HiGHS model (e.g. threads), highspy engine only
+    warm_start: bool
+        Start each solve from the basis of the previous one, highspy engine
+        only (scipy's linprog always starts cold)
+
+    Attributes
+    ----------
+    iterations: int
+        Iterations of the solver in the last solve
+    """
+    def __init__(self, generators, n_steps, engine=None, solver_options=None,
+                 warm_start=True):
+        self.generators = generators
+        self.n_steps = n_steps
+        self.n_gens = len(generators.names)
+        self.engine = engine or default_engine()
+        if self.engine not in LP_ENGINES:
+            raise ValueError(f'Unknown LP engine {self.engine}, expected one of {LP_ENGINES}')
+        if self.engine == 'highspy' and highspy is None:
+            raise ImportError('highspy is needed by the highspy LP engine')
+        n_vars = n_steps * self.n_gens
+
+        self.a_eq = sparse.kron(sparse.eye(n_steps),
+                                np.ones((1, self.n_gens))).tocsr()
+        ramped_up = np.flatnonzero(~np.isnan(generators.ramp_up))
+        ramped_down = np.flatnonzero(~np.isnan(generators.ramp_down))
+        self.a_ub = sparse.vstack([
+            _ramp_matrix(n_steps, self.n_gens, ramped_up, 1.),
+            _ramp_matrix(n_steps, self.n_gens, ramped_down, -1.)]).tocsr()
+        self.b_ub = np.concatenate([
+            np.tile(generators.ramp_up[ramped_up], n_steps - 1),
+            np.tile(generators.ramp_down[ramped_down], n_steps - 1)])
+        self.cost = np.tile(generators.marginal_cost, n_steps)
+        self.warm_start = warm_start
+        self.iterations = 0
+        self._highs = None
+        if self.engine == 'highspy':
+            self._highs = self._build_highs_model(n_vars, solver_options or {})
+
+    def _build_highs_model(self, n_vars, solver_options):
+        a = sparse.vstack([self.a_eq, self.a_ub]).tocsc()
+        n_rows = a.shape[0]
+        lp = highspy.HighsLp()
+        lp.num_col_ = n_vars
+        lp.num_row_ = n_rows
+        lp.col_cost_ = self.cost
+        lp.col_lower_ = np.zeros(n_vars)
+        lp.col_upper_ = np.zeros(n_vars)
+        lp.row_lower_ = np.concatenate([np.zeros(self.n_steps),
+                                        np.full(len(self.b_ub), -highspy.kHighsInf)])
+        lp.row_upper_ = np.concatenate([np.zeros(self.n_steps), self.b_ub])
+        lp.a_matrix_.format_ = highspy.MatrixFormat.kColwise
+        lp.a_matrix_.start_ = a.indptr
+        lp.a_matrix_.index_ = a.indices
+        lp.a_matrix_.value_ = a.data
+        highs = highspy.Highs()
+        highs.setOptionValue('output_flag', False)
+        for option, value in solver_options.items():
+            highs.setOptionValue(option, value)
+        highs.passModel(lp)
+        return highs
+
+    def solve(self, demand, p_min, p_max, marginal_cost=None, initial=None,
+              final=None):
+        """
+        Solve the dispatch of a window
+
+        Parameters
+        ----------
+        demand: numpy.ndarray
+            Demand at each time step, shape (n_steps,)
+        p_min, p_max: numpy.ndarray
+            Bounds of the generators in MW, shape (n_steps, n_gens)
+        marginal_cost: numpy.ndarray or None
+            Costs of the generators if they differ from the ones the LP was
+            built with, shape (n_gens,)
+        initial, final: numpy.ndarray or None
+            Dispatch just before and just after the window, shape (n_gens,):
+            the first and last steps of the window are then limited by the
+            ramps from and to them
+
+        Returns
+        -------
+        numpy.ndarray, str, numpy.ndarray
+            Dispatch of shape (n_steps, n_gens), termination condition
+            ('optimal' or the reason of the failure) and duals of the balance
+            rows (marginal prices), shape (n_steps,)
+        """
+        demand = np.asarray(demand, dtype=float)
+        p_min, p_max = ramp_limited_bounds(self.generators, p_min, p_max,
+                                           initial, final)
+        if (p_min > p_max).any():
+            return None, 'infeasible', None
+        lower, upper = p_min.ravel(), p_max.ravel()
+        if marginal_cost is not None:
+            self.cost = np.tile(marginal_cost, self.n_steps)
+        if self._highs is not None:
+            return self._solve_highs(demand, lower, upper, marginal_cost is not None)
+
+        result = linprog(
+            self.cost, A_ub=self.a_ub if self.a_ub.shape[0] else None,
+            b_ub=self.b_ub if self.a_ub.shape[0] else None,
+            A_eq=self.a_eq, b_eq=demand, bounds=np.column_stack([lower, upper]),
+            method='highs')
+        self.iterations = result.nit
+        if result.status != 0:
+            return None, result.message, None
+        return (result.x.reshape(self.n_steps, self.n_gens), 'optimal',
+                result.eqlin.marginals)
+
+    def _solve_highs(self, demand, lower, upper, cost_changed):
+        highs = self._highs
+        n_vars = self.n_steps * self.n_gens
+        columns = np.arange(n_vars, dtype=np.int32)
+        highs.changeColsBounds(n_vars, columns, lower, upper)
+        if hasattr(highs, 'changeRowsBounds'):
+            highs.changeRowsBounds(self.n_steps, np.arange(self.n_steps, dtype=np.int32),
+                                   demand, demand)
+        else:
+            # highspy before 1.7 (the last ones for python 3.7) changes rows
+            # one at a time
+            for row, value in enumerate(demand):
+                highs.changeRowBounds(row, value, value)
+        if cost_changed:
+            highs.changeColsCost(n_vars, columns, self.cost)
+        if not self.warm_start:
+            highs.clearSolver()
+        highs.run()
+        self.iterations = highs.getInfo().simplex_iteration_count
+        status = highs.getModelStatus()
+        if status != highspy.HighsModelStatus.kOptimal:
+            return None, highs.modelStatusToString(status), None
+        solution = highs.getSolution()
+        return (np.asarray(solution.col_value).reshape(self.n_steps, self.n_gens),
+                'optimal', np.asarray(solution.row_dual)[:self.n_steps])
+
+
+def ramp_limited_bounds(generators, p_min, p_max, initial=None, final=None):
+    """
+    Bounds of the generators (shape (n_steps, n_gens)) with the first step
+    within ramps of the initial dispatch and the last step within ramps of
+    the final one
+    """
+    p_min = np.array(p_min, dtype=float)
+    p_max = np.array(p_max, dtype=float)
+    ramp_up = np.where(np.isnan(generators.ramp_up), np.inf, generators.ramp_up)
+    ramp_down = np.where(np.isnan(generators.ramp_down), np.inf,
+                         generators.ramp_down)
+    if initial is not None:
+        p_min[0] = np.maximum(p_min[0], initial - ramp_down)
+        p_max[0] = np.minimum(p_max[0], initial + ramp_up)
+    if final is not None:
+        p_min[-1] = np.maximum(p_min[-1], final - ramp_up)
+        p_max[-1] = np.minimum(p_max[-1], final + ramp_down)
+    return p_min, p_max
+
+
+def window_bounds(generators, index, gen_min_pu, gen_max_pu):
+    """
+    Bounds of the generators in MW over a window: the static p_min_pu and
+    p_max_pu of the generators, replaced by the time series of gen_min_pu
+    and gen_max_pu for the generators they have (e.g. hydro)
+    """
+    bounds = []
+    for static_pu, series_pu in [(generators.p_min_pu, gen_min_pu),
+                                 (generators.p_max_pu, gen_max_pu)]:
+        bound_pu = np.tile(static_pu, (len(index), 1))
+        if series_pu is not None and len(series_pu.columns):
+            positions = generators.names.get_indexer(series_pu.columns)
+            known = positions >= 0
+            bound_pu[:, positions[known]] = series_pu.values[:, known]
+        bounds.append(bound_pu * generators.p_nom)
+    return bounds
+
+
+def merit_order_dispatch(generators, demand, p_min, p_max):
+    """
+    Dispatch without ramps: at each time step, the generators are started
+    at their minimum and the rest of the demand is met in increasing order
+    of marginal cost, for all time steps at once
+
+    Parameters
+    ----------
+    generators: GeneratorData
+    demand: numpy.ndarray
+        Demand at each time step, shape (n_steps,)
+    p_min, p_max: numpy.ndarray
+        Bounds of the generators in MW, shape (n_steps, n_gens)
+
+    Returns
+    -------
+    numpy.ndarray, str, numpy.ndarray
+        As WindowLP.solve, the prices being the marginal cost of the last
+        generator called at each time step
+    """
+    order = np.argsort(generators.marginal_cost, kind='stable')
+    capacity = (p_max - p_min)[:, order]
+    residual = np.asarray(demand, dtype=float) - p_min.sum(axis=1)
+    cumulated = np.cumsum(capacity, axis=1)
+    tolerance = 1e-6 * np.maximum(np.abs(residual), 1.)
+    if (capacity < 0).any() or (residual < -tolerance).any() \
+            or (residual > cumulated[:, -1] + tolerance).any():
+        return None, 'infeasible', None
+    residual = np.clip(residual, 0., cumulated[:, -1])
+    called = np.clip(residual[:, None] - (cumulated - capacity), 0., capacity)
+    dispatch = p_min.copy()
+    dispatch[:, order] += called
+    marginal = np.minimum((cumulated < residual[:, None] - tolerance[:, None]).sum(axis=1),
+                          len(order) - 1)
+    prices = generators.marginal_cost[order][marginal]
+    return dispatch, 'optimal', prices
+
+
+def run_merit_order_window(generators, demand, gen_max_pu, gen_min_pu):
+    """
+    Dispatch of a window without ramps in merit order, returned as
+    run_lp_window does
+    """
+    with instr.timed('merit order'):
+        p_min, p_max = window_bounds(generators, demand.index, gen_min_pu,
+                                     gen_max_pu)
+        dispatch, termination_condition, prices = merit_order_dispatch(
+            generators, demand.values[:, 0], p_min, p_max)
+    if dispatch is None:
+        print('** OPF failed to find an optimal solution **')
+        dispatch = np.full(p_min.shape, np.nan)
+        prices = np.full(len(demand), np.nan)
+    return (pd.DataFrame(dispatch, index=demand.index, columns=generators.names),
+            termination_condition, pd.Series(prices, index=demand.index))
+
+
+def run_lp_window(lp_cache, generators, demand, gen_max_pu, gen_min_pu,
+                  engine=None, solver_options=None, initial=None, final=None,
+                  warm_start=True):
+    """
+    Dispatch of a window with the LP of its length, built on the first window
+    of that length and kept in lp_cache
+
+    Parameters
+    ----------
+    lp_cache: dict
+        WindowLP by number of time steps
+    generators: GeneratorData
+    demand: pandas.DataFrame
+        Demand of the window, a single column indexed by the snapshots
+    gen_max_pu, gen_min_pu: pandas.DataFrame
+        Time varying bounds in per unit for some generators
+    engine, solver_options, warm_start:
+        See WindowLP
+    initial, final: numpy.ndarray or None
+        See WindowLP.solve
+
+    Returns
+    -------
+    pandas.DataFrame, str, pandas.Series
+        Dispatch of the generators, termination condition, and marginal
+        prices of the balance
+    """
+    n_steps = len(demand)
+    with instr.timed('opf build'):
+        if n_steps not in lp_cache:
+            lp_cache[n_steps] = WindowLP(generators, n_steps, engine,
+                                         solver_options, warm_start)
+        p_min, p_max = window_bounds(generators, demand.index, gen_min_pu,
+                                     gen_max_pu)
+    with instr.timed('opf solve'):
+        dispatch, termination_condition, duals = lp_cache[n_steps].solve(
+            demand.values[:, 0], p_min, p_max, initial=initial, final=final)
+    if dispatch is None:
+        print('** OPF failed to find an optimal solution **')
+        dispatch = np.full((n_steps, len(generators.names)), np.nan)
+        duals = np.full(n_steps, np.nan)
+    return (pd.DataFrame(dispatch, index=demand.index, columns=generators.names),
+            termination_condition, pd.Series(duals, index=demand.index))
+
+
+# Settings and LP cache of the workers solving windows concurrently, per
+# thread or process
+_window_worker = threading.local()
+
+
+def _init_window_worker(generators, engine, solver_options):
+    _window_worker.settings = (generators, engine, solver_options)
+    _window_worker.lp_cache = {}
+
+
+def _solve_window_task(demand, gen_max_pu, gen_min_pu, initial=None,
+                       final=None):
+    generators, engine, solver_options = _window_worker.settings
+    return run_lp_window(_window_worker.lp_cache, generators, demand,
+                         gen_max_pu, gen_min_pu, engine, solver_options,
+                         initial, final)
+
+
+def window_executor(n_workers, generators, engine=None, solver_options=None):
+    """
+    Pool of n_workers processes solving windows. In a daemonic process, such
+    as a worker of multiprocessing.Pool, which cannot start processes, a pool
+    of threads instead: HiGHS releases the GIL while it solves
+    """
+    kwargs = dict(initializer=_init_window_worker,
+                  initargs=(generators, engine, solver_options))
+    if multiprocessing.current_process().daemon:
+        return ThreadPoolExecutor(n_workers, **kwargs)
+    return ProcessPoolExecutor(n_workers, **kwargs)
+
+
+def run_parallel_windows(generators, demand, gen_max_pu, gen_min_pu, windows,
+                         n_workers, margin_steps, engine=None,
+                         solver_options=None):
+    """
+    Dispatch of consecutive windows solved concurrently, stitched so that
+    ramps hold across windows
+
+    Each window is solved over margin_steps more time steps on both sides,
+    which are then dropped. The seams are solved again over margin_steps
+    steps on each side, between the dispatch of the windows just before and
+    just after them as boundary conditions.
+
+    Parameters
+    ----------
+    generators: GeneratorData
+    demand: pandas.DataFrame
+        Demand over all the windows, a single column
+    gen_max_pu, gen_min_pu: pandas.DataFrame
+        Time varying bounds in per unit for some generators, same index as
+        demand
+    windows: list
+        (first, last) positions in demand.index of each window, consecutive
+        and partitioning it
+    n_workers: int
+        Number of processes (threads in a daemonic process) solving windows
+    margin_steps: int
+        Overlap of the windows and half width of the seams, in time steps.
+        Reduced to fit in half of the shortest window
+
+    Returns
+    -------
+    list, list, list
+        Dispatch, termination condition and marginal prices of each window
+    """
+    n_steps = len(demand)
+    starts = [first for first, _ in windows]
+    lengths = [last - first for first, last in windows]
+    margin_steps = max(min([margin_steps] + [length // 2 - 1 for length in lengths]), 0)
+
+    def ranges_data(ranges):
+        return zip(*[(demand.iloc[first:last], gen_max_pu.iloc[first:last],
+                      gen_min_pu.iloc[first:last]) for first, last in ranges])
+
+    extended = [(max(start - margin_steps, 0),
+                 min(start + length + margin_steps, n_steps))
+                for start, length in zip(starts, lengths)]
+    with window_executor(n_workers, generators, engine, solver_options) as executor:
+        solved = list(executor.map(_solve_window_task, *ranges_data(extended)))
+        results = [dispatch.iloc[start - first:start - first + length]
+                   for (dispatch, _, _), start, length, (first, _)
+                   in zip(solved, starts, lengths, extended)]
+        termination_conditions = [termination_condition
+                                  for _, termination_condition, _ in solved]
+        prices = [window_prices.iloc[start - first:start - first + length]
+                  for (_, _, window_prices), start, length, (first, _)
+                  in zip(solved, starts, lengths, extended)]
+
+        ramped = ~(np.isnan(generators.ramp_up) & np.isnan(generators.ramp_down))
+        if margin_steps == 0 or not ramped.any() or len(windows) == 1:
+            return results, termination_conditions, prices
+
+        # Seams between windows, with the dispatch around them as boundaries
+        dispatch = pd.concat(results).values
+        seams = [(start - margin_steps, start + margin_steps)
+                 for start in starts[1:]]
+        boundaries = [(dispatch[first - 1] if first > 0 else None,
+                       dispatch[last] if last < n_steps else None)
+                      for first, last in seams]
+        demands, gen_max_pus, gen_min_pus = ranges_data(seams)
+        stitched = list(executor.map(_solve_window_task, demands, gen_max_pus,
+                                     gen_min_pus, *zip(*boundaries)))
+
+    for window, (first, last), (seam, termination_condition, seam_prices) in zip(
+            range(1, len(windows)), seams, stitched):
+        if termination_condition != 'optimal':
+            print(f'** Seam before window {window} could not be stitched '
+                  f'({termination_condition}), ramps may not hold there **')
+            continue
+        for k in [window - 1, window]:
+            overlap = results[k].index.intersection(seam.index)
+            results[k] = results[k].copy()
+            results[k].loc[overlap] = seam.loc[overlap].values
+            prices[k] = prices[k].copy()
+            prices[k].loc[overlap] = seam_prices.loc[overlap].values
+    return results, termination_conditions, prices
+
+
+def demand_limits(generators, p_min, p_max):
+    """
+    Lowest and highest demand the generators can meet at each time step, and
+    largest increase and decrease of demand they can follow from the
+    previous time step, within their ramps and bounds (infinite at the first
+    time step)
+    """
+    ramp_up = np.where(np.isnan(generators.ramp_up), np.inf, generators.ramp_up)
+    ramp_down = np.where(np.isnan(generators.ramp_down), np.inf,
+                         generators.ramp_down)
+    increase = np.minimum(ramp_up, p_max[1:] - p_min[:-1]).sum(axis=1)
+    decrease = np.minimum(ramp_down, p_max[:-1] - p_min[1:]).sum(axis=1)
+    return (p_min.sum(axis=1), p_max.sum(axis=1), np.r_[np.inf, increase],
+            np.r_[np.inf, decrease])
+
+
+def screen_dispatch(generators, demand, p_min, p_max, tolerance=1e-6):
+    """
+    Time steps at which no dispatch can exist, for all time steps at once:
+    demand above the capacity of the generators (shortage) or below their
+    minimum (surplus), and variations of demand from the previous time step
+    larger than the generators can follow (ramp_up, ramp_down). These are
+    necessary conditions only: a window may still be infeasible without
+    failing any of them
+
+    Parameters
+    ----------
+    generators: GeneratorData
+    demand: numpy.ndarray
+        Demand at each time step, shape (n_steps,)
+    p_min, p_max: numpy.ndarray
+        Bounds of the generators in MW, shape (n_steps, n_gens)
+
+    Returns
+    -------
+    dict
+        Boolean array of shape (n_steps,) for each check of SCREEN_CHECKS
+    """
+    low, high, increase, decrease = demand_limits(generators, p_min, p_max)
+    tolerance = tolerance * np.maximum(np.abs(demand), 1.)
+    variation = np.r_[0., np.diff(demand)]
+    return dict(shortage=demand > high + tolerance,
+                surplus=demand < low - tolerance,
+                ramp_up=variation > increase + tolerance,
+                ramp_down=-variation > decrease + tolerance)
+
+
+def relax_demand(generators, demand, p_min, p_max):
+    """
+    Demand moved as little as possible, step after step, into what the
+    generators can meet and follow as demand_limits gives it
+    """
+    low, high, increase, decrease = demand_limits(generators, p_min, p_max)
+    relaxed = np.clip(demand, low, high)
+    for t in range(1, len(relaxed)):
+        relaxed[t] = np.clip(np.clip(relaxed[t], relaxed[t - 1] - decrease[t],
+                                     relaxed[t - 1] + increase[t]),
+                             low[t], high[t])
+    return relaxed
+
+
+def screen_windows(generators, demand, gen_max_pu, gen_min_pu, windows, mode):
+    """
+    Screen the windows of a dispatch before solving them (screen_dispatch),
+    and report the ones which cannot be solved
+
+    Parameters
+    ----------
+    generators: GeneratorData
+    demand: pandas.DataFrame
+        Demand over all the windows, a single column
+    gen_max_pu, gen_min_pu: pandas.DataFrame
+        Time varying bounds in per unit for some generators
+    windows: list
+        (first, last) positions in demand.index of each window
+    mode: str
+        One of SCREEN_MODES: 'flag' to raise an error naming the infeasible
+        windows before any is solved, 'relax' to move their demand into what
+        the generators can meet
+
+    Returns
+    -------
+    pandas.DataFrame
+        The demand, relaxed in the infeasible windows in mode 'relax'
+    """
+    if mode not in SCREEN_MODES:
+        raise ValueError(f'feasibility_screen should be one of {SCREEN_MODES}, '
+                         f'not {mode}')
+    with instr.timed('feasibility screen'):
+        p_min, p_max = window_bounds(generators, demand.index, gen_min_pu,
+                                     gen_max_pu)
+        values = demand.values[:, 0]
+        checks = screen_dispatch(generators, values, p_min, p_max)
+        # The first time step of a window does not follow the previous one
+        for first, _ in windows:
+            checks['ramp_up'][first] = checks['ramp_down'][first] = False
+        failing = np.logical_or.reduce([checks[check] for check in SCREEN_CHECKS])
+        relaxed = values.copy()
+        doomed = []
+        for window, (first, last) in enumerate(windows):
+            if not failing[first:last].any():
+                continue
+            reasons = ', '.join(
+                f'{check} at {checks[check][first:last].sum()} time steps'
+                for check in SCREEN_CHECKS if checks[check][first:last].any())
+            if mode == 'relax':
+                relaxed[first:last] = relax_demand(
+                    generators, values[first:last], p_min[first:last],
+                    p_max[first:last])
+                print(f'** OPF window starting {demand.index[first]} is infeasible '
+                      f'({reasons}), its demand is relaxed by up to '
+                      f'{np.abs(relaxed - values)[first:last].max():.1f} MW **')
+            else:
+                doomed.append(str(demand.index[first]))
+                print(f'** OPF window starting {demand.index[first]} is infeasible '
+                      f'({reasons}) **')
+    if doomed:
+        raise RuntimeError(
+            f'The OPF windows starting {", ".join(doomed)} are infeasible. Set '
+            f'feasibility_screen to "relax" in params_opf.json to relax their '
+            f'demand')
+    if mode == 'relax':
+        demand = pd.DataFrame(relaxed, index=demand.index, columns=demand.columns)
+    return demand
+
+
+def interpolate_coarse(coarse, n_steps, step):
+    """
+    Linear interpolation at each of n_steps time steps of a dispatch given
+    every step time steps (shape (n_coarse, n_gens)), held after its last
+    time step. It is within ramps if the coarse dispatch is within step
+    times the ramps
+    """
+    positions = np.arange(n_steps) / step
+    before = np.minimum(np.floor(positions).astype(int), len(coarse) - 1)
+    after = np.minimum(before + 1, len(coarse) - 1)
+    weight = (positions - before)[:, np.newaxis]
+    return coarse[before] * (1. - weight) + coarse[after] * weight
+
+
+def _refine_block_task(demand, bounds, initial):
+    """
+    Refined dispatch of a block, within the bands of bounds and, if that is
+    infeasible, within the next bounds (the full bounds of the generators)
+    """
+    generators, engine, solver_options = _window_worker.settings
+    n_steps = len(demand)
+    if np.isnan(initial).any() or any(np.isnan(bound).any() for pair in bounds
+                                      for bound in pair):
+        # Around a coarse window the OPF failed to solve
+        return None, 'failed coarse dispatch', 0
+    if n_steps not in _window_worker.lp_cache:
+        _window_worker.lp_cache[n_steps] = WindowLP(generators, n_steps, engine,
+                                                    solver_options)
+    for attempt, (p_min, p_max) in enumerate(bounds):
+        dispatch, termination_condition, _ = _window_worker.lp_cache[n_steps].solve(
+            demand, p_min, p_max, initial=initial)
+        if dispatch is not None:
+            return dispatch, termination_condition, attempt
+    return None, termination_condition, len(bounds)
+
+
+def refine_dispatch(generators, coarse, demand, p_min, p_max, step,
+                    band_pu=0.1, block_steps=288, n_workers=1, engine=None,
+                    solver_options=None, max_merged_blocks=4):
+    """
+    Dispatch at every time step from a dispatch every step time steps,
+    solved as small LPs around it
+
+    The time steps are solved by blocks of about block_steps time steps,
+    each one between two time steps of the coarse dispatch (which have the
+    same demand and bounds) kept as boundaries, so that blocks are
+    independent and can be solved concurrently. Each generator is kept
+    within band_pu of its nominal power around the linear interpolation of
+    the coarse dispatch, and within its full bounds in the blocks where that
+    is infeasible. Blocks still infeasible between their boundaries are
+    solved again merged with up to max_merged_blocks - 1 next ones.
+
+    Parameters
+    ----------
+    generators: GeneratorData
+        Generators with ramps per (fine) time step
+    coarse: numpy.ndarray
+        Dispatch every step time steps, shape (n_coarse, n_gens)
+    demand: numpy.ndarray
+        Demand at each time step, shape (n_steps,)
+    p_min, p_max: numpy.ndarray
+        Bounds of the generators in MW, shape (n_steps, n_gens)
+    step: int
+        Number of time steps between two time steps of the coarse dispatch
+    n_workers: int
+        Number of processes (threads in a daemonic process) solving blocks
+
+    Returns
+    -------
+    numpy.ndarray
+        Dispatch at each time step, shape (n_steps, n_gens)
+    """
+    n_steps = len(demand)
+    reference = interpolate_coarse(coarse, n_steps, step)
+    band = band_pu * generators.p_nom
+    lower = np.maximum(p_min, reference - band)
+    upper = np.minimum(p_max, reference + band)
+    # Bounds below or above the band
+    outside = lower > upper
+    lower[outside], upper[outside] = p_min[outside], p_max[outside]
+    block_steps = max(block_steps // step, 1) * step
+
+    def task(first, last):
+        # From just after a coarse time step to the coarse time step ending
+        # the range, or the end of the dispatch
+        bounds = [(np.array(low[first:last], dtype=float),
+                   np.array(high[first:last], dtype=float))
+                  for low, high in [(lower, upper), (p_min, p_max)]]
+        if (last - 1) % block_steps == 0:
+            for low, high in bounds:
+                low[-1] = high[-1] = coarse[(last - 1) // step]
+        return demand[first:last], bounds, coarse[(first - 1) // step]
+
+    blocks = [(first, min(first + block_steps, n_steps))
+              for first in range(1, n_steps, block_steps)]
+    tasks = [task(first, last) for first, last in blocks]
+    _init_window_worker(generators, engine, solver_options)
+    if n_workers > 1 and len(blocks) > 1:
+        with window_executor(n_workers, generators, engine, solver_options) as executor:
+            solved = list(executor.map(_refine_block_task, *zip(*tasks)))
+    else:
+        solved = [_refine_block_task(*block_task) for block_task in tasks]
+
+    dispatch = reference.copy()
+    dispatch[0] = coarse[0]
+    widened, failed = 0, 0
+    i = 0
+    while i < len(blocks):
+        merged = i
+        block, _, attempt = solved[i]
+        # Infeasible between its boundaries: merged with the next blocks,
+        # without the boundaries between them
+        while block is None and merged + 1 < min(i + max_merged_blocks, len(blocks)):
+            merged += 1
+            block, _, attempt = _refine_block_task(*task(blocks[i][0],
+                                                         blocks[merged][1]))
+        first, last = blocks[i][0], blocks[merged][1]
+        if block is None:
+            failed += 1
+            merged = i
+        else:
+            widened += attempt > 0 or merged > i
+            dispatch[first:last] = block
+        i = merged + 1
+    if widened:
+        print(f'{widened} blocks refined within the full bounds of the generators '
+              f'or merged with the next ones')
+    if failed:
+        print(f'** {failed} blocks could not be refined, their dispatch is '
+              f'interpolated **')
+    return dispatch
+
+
+def run_refinement(generators, coarse_dispatch, demand, gen_max_pu, gen_min_pu,
+                   step, merit_order=False, band_pu=0.1, block_steps=288,
+                   n_workers=1, engine=None, solver_options=None, relax=False):
+    """
+    Second stage of a dispatch solved every step time steps: the dispatch at
+    every time step of demand, as refine_dispatch computes it, or in merit
+    order at all time steps at once without ramps
+
+    Parameters
+    ----------
+    generators: GeneratorData
+        Generators with ramps per coarse time step, as the first stage used
+    coarse_dispatch: pandas.DataFrame
+        Dispatch of the first stage, every step time steps of demand
+    demand: pandas.DataFrame
+        Demand at each time step, a single column
+    gen_max_pu, gen_min_pu: pandas.DataFrame
+        Time varying bounds in per unit for some generators, same index as
+        demand
+    relax: bool
+        Move the demand into what the generators can meet and follow at every
+        time step (relax_demand), as the first stage had its demand relaxed
+        by screen_windows in mode 'relax'
+
+    Returns
+    -------
+    pandas.DataFrame
+        Dispatch of the generators at each time step of demand
+    """
+    generators = generators._replace(ramp_up=generators.ramp_up / step,
+                                     ramp_down=generators.ramp_down / step)
+    p_min, p_max = window_bounds(generators, demand.index, gen_min_pu, gen_max_pu)
+    values = demand.values[:, 0]
+    if relax:
+        values = relax_demand(generators, values, p_min, p_max)
+    dispatch = None
+    if merit_order:
+        dispatch, _, _ = merit_order_dispatch(generators, values, p_min, p_max)
+    if dispatch is None:
+        dispatch = refine_dispatch(
+            generators, coarse_dispatch[generators.names].values, values,
+            p_min, p_max, step, band_pu, block_steps, n_workers, engine,
+            solver_options)
+    return pd.DataFrame(dispatch, index=demand.index, columns=generators.names)
@@ -1,6 +1,9 @@
 import os
 from enum import Enum
 
+import numpy as np
+import pandas as pd
+
 
 class RampMode(Enum):
     """
@@ -13,6 +16,48 @@ class RampMode(Enum):
     hard = 2
 
 
+# Carriers whose ramp constraints are removed at each level of RampMode
+CARRIERS_WITHOUT_RAMPS = {
+    RampMode.hard: [],
+    RampMode.medium: ['thermal'],
+    RampMode.easy: ['hydro', 'thermal'],
+    RampMode.none: ['nuclear', 'hydro', 'thermal'],
+}
+
+
+def minute_of_year(index):
+    """
+    Minutes since the beginning of the year of the dates of index, counted on
+    a leap year calendar so that a given date has the same minute whatever
+    its year (March 1st 00:00 is always minute 60 * 24 * 60)
+
+    Parameters
+    ----------
+    index: pandas.DatetimeIndex or array-like of dates
+
+    Returns
+    -------
+    numpy.ndarray
+        Minutes of the year, as integers
+    """
+    index = pd.DatetimeIndex(index)
+    day = index.dayofyear.values - 1
+    day = day + ((~index.is_leap_year) & (index.month > 2))
+    return ((day * 24 + index.hour.values) * 60
+            + index.minute.values).astype(np.int64)
+
+
+def iso_week(index):
+    """
+    ISO week number of the dates of a DatetimeIndex, as integers.
+    DatetimeIndex.isocalendar only exists from pandas 1.1, and
+    DatetimeIndex.week is deprecated from then on
+    """
+    if hasattr(index, 'isocalendar'):
+        return index.isocalendar().week.values.astype(np.int64)
+    return np.asarray(index.week, dtype=np.int64)
+
+
 def make_scenario_input_output_directories(input_folder, output_folder, scenario_name):
     os.makedirs(os.path.join(input_folder, scenario_name), exist_ok=True)
     os.makedirs(os.path.join(output_folder, scenario_name), exist_ok=True)
@@ -1,23 +1,34 @@
 import os
 
+import numpy as np
 import pandas as pd
 
 from .consumption import generate_load as gen_loads
 from .renewable import generate_solar_wind as gen_enr
 from .dispatch import utils as du
-from .dispatch import generate_dispatch as gen_dispatch
-from .dispatch import EconomicDispatch as ec
 from . import generation_utils as gu
 from ..config import DispatchConfigManager, LoadsConfigManager, ResConfigManager
 from .. import constants as cst
+from .. import instrumentation as instr
 from ..seed_manager import dump_seeds
+from ..stage_cache import (hash_file, make_stage_cache, run_cached_stage,
+                           run_cached_batch_stage)
 from .. import utils as ut
 
+LOAD_STAGE_FILES = ['load_p.csv.bz2', 'load_q.csv.bz2',
+                    'load_p_forecasted.csv.bz2', 'load_q_forecasted.csv.bz2']
+RES_STAGE_FILES = ['solar_p.csv.bz2', 'solar_p_forecasted.csv.bz2',
+                   'wind_p.csv.bz2', 'wind_p_forecasted.csv.bz2',
+                   'prod_p.csv.bz2', 'prod_v.csv.bz2']
+DISPATCH_STAGE_FILES = ['prod_p.csv.bz2', 'prod_p_forecasted.csv.bz2',
+                        'prices.csv.bz2', 'load_p.csv.bz2']
+
 
 # Call generation scripts n_scenario times with dedicated random seeds
 def main(case, n_scenarios, input_folder, output_folder, scen_names,
          time_params, mode='LRTK', scenario_id=None,
-         seed_for_loads=None, seed_for_res=None, seed_for_disp=None):
+         seed_for_loads=None, seed_for_res=None, seed_for_disp=None,
+         cache_folder=None):
     """
     Main function for chronics generation. It works with three steps: load generation, renewable generation (solar and wind) and then dispatch computation to get the whole energy mix
 
@@ -34,6 +45,7 @@ def main(case, n_scenarios, input_folder, output_folder, scen_names,
     solar_pattern (pandas.DataFrame): as returned by function chronix2grid.generation.generate_chronics.read_configuration
     load_weekly_pattern (pandas.DataFrame): as returned by function chronix2grid.generation.generate_chronics.read_configuration
     mode (str): options to launch certain parts of the generation process : L load R renewable T thermal
+    cache_folder (str): if not None, outputs of stages L, R and T are cached in this folder under a hash of their inputs, and restored instead of being recomputed
 
 
     Returns
@@ -94,7 +106,10 @@ def main(case, n_scenarios, input_folder, output_folder, scen_names,
     dispath_config_manager.validate_configuration()
     params_opf = dispath_config_manager.read_configuration()
     grid_path = os.path.join(input_folder, case, cst.GRID_FILENAME)
-    dispatcher = ec.init_dispatcher_from_config(grid_path, input_folder)
+    hydro_file_path = os.path.join(input_folder, 'patterns', 'hydro_french.csv')
+    get_dispatcher = make_dispatcher_getter(grid_path, input_folder,
+                                            cache_folder=cache_folder)
+    stage_cache = make_stage_cache(cache_folder)
 
     ## Launch proper scenarios generation
     seeds_iterator = zip(seeds_for_loads, seeds_for_res, seeds_for_disp)
@@ -111,21 +126,225 @@ def main(case, n_scenarios, input_folder, output_folder, scen_names,
 
         print("================ Generating "+scenario_name+" ================")
         if 'L' in mode:
-            load, load_forecasted = gen_loads.main(scenario_folder_path, seed_load, params, loads_charac, load_weekly_pattern, write_results = True)
+            with instr.record_stage(scenario_name, 'L'):
+                load, load_forecasted = run_cached_stage(
+                    stage_cache, 'L',
+                    (seed_load, params, loads_charac, load_weekly_pattern),
+                    scenario_folder_path, LOAD_STAGE_FILES,
+                    lambda: gen_loads.main(scenario_folder_path, seed_load, params, loads_charac, load_weekly_pattern, write_results = True))
 
         if 'R' in mode:
-            prod_solar, prod_solar_forecasted, prod_wind, prod_wind_forecasted = gen_enr.main(scenario_folder_path, seed_res, params, prods_charac, solar_pattern, write_results = True)
+            with instr.record_stage(scenario_name, 'R'):
+                prod_solar, prod_solar_forecasted, prod_wind, prod_wind_forecasted = run_cached_stage(
+                    stage_cache, 'R',
+                    (seed_res, params, prods_charac, solar_pattern),
+                    scenario_folder_path, RES_STAGE_FILES,
+                    lambda: gen_enr.main(scenario_folder_path, seed_res, params, prods_charac, solar_pattern, write_results = True))
         if 'T' in mode:
-            prods = pd.concat([prod_solar, prod_wind], axis=1)
-            res_names = dict(wind=prod_wind.columns, solar=prod_solar.columns)
-            dispatcher.chronix_scenario = ec.ChroniXScenario(load, prods, res_names,
-                                                             scenario_name)
-
-            dispatch_results = gen_dispatch.main(dispatcher, scenario_folder_path,
-                                                 scenario_folder_path,
-                                                 seed_disp, params, params_opf)
+            dispatch_results = run_dispatch_stage(
+                stage_cache, get_dispatcher, scenario_name,
+                scenario_folder_path, load, prod_solar, prod_wind, seed_disp,
+                params, params_opf, grid_path, hydro_file_path)
         print('\n')
     return params, loads_charac, prods_charac
 
 
+def main_batch(case, input_folder, output_folder, scen_names, time_params,
+               scenario_ids, seeds_for_loads, seeds_for_res, seeds_for_disp,
+               mode='LRTK', cache_folder=None):
+    """
+    Batch version of main: the loads and renewables of all the scenarios of
+    scenario_ids are generated at once, vectorized across scenarios, and the
+    dispatch is then run scenario by scenario. Configuration is read and the
+    dispatcher is built only once for the whole batch.
+
+    Parameters
+    ----------
+    case (str): name of case to study (must be a folder within input_folder)
+    input_folder (str): path of folder containing inputs
+    output_folder (str): path where outputs will be written (intermediate folder case/year/scenario will be used)
+    scen_names (callable): gives the name of a scenario given its id
+    time_params (dict): as returned by chronix2grid.generation.generation_utils.time_parameters
+    scenario_ids (list): ids of the scenarios of the batch
+    seeds_for_loads (list): seeds for loads generation, one per scenario of scenario_ids
+    seeds_for_res (list): seeds for renewables generation, one per scenario of scenario_ids
+    seeds_for_disp (list): seeds for dispatch, one per scenario of scenario_ids
+    mode (str): options to launch certain parts of the generation process : L load R renewable T thermal
+    cache_folder (str): if not None, outputs of stages L, R and T are cached in this folder under a hash of their inputs
+
+    Returns
+    -------
+    dict, pandas.DataFrame, pandas.DataFrame: params, loads_charac and prods_charac
+    """
+    params, loads_charac, prods_charac, params_opf, scenarios = generate_res_load_batch(
+        case, input_folder, output_folder, scen_names, time_params,
+        scenario_ids, seeds_for_loads, seeds_for_res, mode, cache_folder)
+
+    if 'T' in mode:
+        get_dispatcher = make_dispatcher_getter(
+            os.path.join(input_folder, case, cst.GRID_FILENAME), input_folder,
+            cache_folder=cache_folder)
+        for scenario, seed_disp in zip(scenarios, seeds_for_disp):
+            dispatch_scenario(case, input_folder, output_folder, scenario,
+                              seed_disp, params, params_opf, get_dispatcher,
+                              cache_folder)
+    print('\n')
+    return params, loads_charac, prods_charac
+
+
+def generate_res_load_batch(case, input_folder, output_folder, scen_names,
+                            time_params, scenario_ids, seeds_for_loads,
+                            seeds_for_res, mode='LR', cache_folder=None):
+    """
+    Loads and renewables generation (stages L and R) of a batch of scenarios,
+    vectorized across scenarios
+
+    Parameters are the same as in main_batch
+
+    Returns
+    -------
+    dict, pandas.DataFrame, pandas.DataFrame, dict, list
+        params, loads_charac, prods_charac, params_opf and, for each scenario,
+        a dict with its name, its load, its solar and wind productions and the
+        state of its random stream at the end of the renewables generation
+    """
+    print('=====================================================================================================================================')
+    print('============================================== CHRONICS GENERATION (BATCH) ==========================================================')
+    print('=====================================================================================================================================')
+
+    (year, params, loads_charac, prods_charac, load_weekly_pattern,
+     solar_pattern, params_opf) = gu.read_all_configurations(
+        time_params['weeks'], time_params['start_date'], case, input_folder,
+        output_folder)
+    stage_cache = make_stage_cache(cache_folder)
+
+    scenario_names = [scen_names(scenario_id) for scenario_id in scenario_ids]
+    scenario_folder_paths = [os.path.join(output_folder, scenario_name)
+                             for scenario_name in scenario_names]
+    print("================ Generating " + ', '.join(scenario_names) + " ================")
+    scenarios = [dict(name=scenario_name, load=None, prod_solar=None,
+                      prod_wind=None, random_state=None)
+                 for scenario_name in scenario_names]
+
+    # Timings of a batch are recorded for the batch as a whole
+    batch_name = '+'.join(scenario_names)
+
+    if 'L' in mode:
+        load_random_states = [np.random.RandomState(seed) for seed in seeds_for_loads]
+        with instr.record_stage(batch_name, 'L'):
+            loads = run_cached_batch_stage(
+                stage_cache, 'L',
+                [(seed, params, loads_charac, load_weekly_pattern) for seed in seeds_for_loads],
+                scenario_folder_paths, LOAD_STAGE_FILES, load_random_states,
+                lambda indices: gen_loads.main_batch(
+                    [scenario_folder_paths[i] for i in indices],
+                    [load_random_states[i] for i in indices],
+                    params, loads_charac, load_weekly_pattern, write_results=True))
+        for scenario, (load, _) in zip(scenarios, loads):
+            scenario['load'] = load
+
+    if 'R' in mode:
+        res_random_states = [np.random.RandomState(seed) for seed in seeds_for_res]
+        with instr.record_stage(batch_name, 'R'):
+            prods = run_cached_batch_stage(
+                stage_cache, 'R',
+                [(seed, params, prods_charac, solar_pattern) for seed in seeds_for_res],
+                scenario_folder_paths, RES_STAGE_FILES, res_random_states,
+                lambda indices: gen_enr.main_batch(
+                    [scenario_folder_paths[i] for i in indices],
+                    [res_random_states[i] for i in indices],
+                    params, prods_charac, solar_pattern, write_results=True))
+        for scenario, (prod_solar, _, prod_wind, _), random_state in zip(
+                scenarios, prods, res_random_states):
+            scenario['prod_solar'] = prod_solar
+            scenario['prod_wind'] = prod_wind
+            # Dispatch noise is drawn from the random state left by the
+            # renewables generation of the scenario, as in main
+            scenario['random_state'] = random_state.get_state()
+
+    return params, loads_charac, prods_charac, params_opf, scenarios
+
+
+def dispatch_scenario(case, input_folder, output_folder, scenario, seed_disp,
+                      params, params_opf, get_dispatcher, cache_folder=None):
+    """
+    Dispatch (stage T) of a scenario generated by generate_res_load_batch
+
+    Parameters
+    ----------
+    case (str): name of case to study (must be a folder within input_folder)
+    input_folder (str): path of folder containing inputs
+    output_folder (str): path where outputs will be written
+    scenario (dict): as returned by generate_res_load_batch
+    seed_disp (int): seed for dispatch
+    params (dict): generation parameters
+    params_opf (dict): options for the OPF
+    get_dispatcher (callable): returns the Dispatcher to use
+    cache_folder (str): if not None, folder of the stage cache
+
+    Returns
+    -------
+    DispatchResults
+        The namedtuple return by Dispatcher.run method
+    """
+    np.random.set_state(scenario['random_state'])
+    return run_dispatch_stage(
+        make_stage_cache(cache_folder), get_dispatcher, scenario['name'],
+        os.path.join(output_folder, scenario['name']), scenario['load'],
+        scenario['prod_solar'], scenario['prod_wind'], seed_disp, params,
+        params_opf, os.path.join(input_folder, case, cst.GRID_FILENAME),
+        os.path.join(input_folder, 'patterns', 'hydro_french.csv'))
+
+
+def make_dispatcher_getter(grid_path, input_folder, dispatchers=None,
+                           cache_folder=None):
+    """
+    Returns a function building the Dispatcher on its first call only. If a
+    dict is given as dispatchers, built Dispatchers are kept in it so that
+    they can be reused by later getters (e.g. in a worker process). If
+    cache_folder is not None, Dispatchers are also cached on disk, so that
+    later runs on the same grid do not start grid2op
+    """
+    dispatchers = dispatchers if dispatchers is not None else {}
+
+    def get_dispatcher():
+        key = (grid_path, input_folder)
+        if key not in dispatchers:
+            from .dispatch import EconomicDispatch as ec
+            with instr.timed('dispatcher init'):
+                dispatchers[key] = ec.init_dispatcher_from_config(
+                    grid_path, input_folder, cache_folder)
+        return dispatchers[key]
+    return get_dispatcher
+
+
+def run_dispatch_stage(stage_cache, get_dispatcher, scenario_name,
+                       scenario_folder_path, load, prod_solar, prod_wind,
+                       seed_disp, params, params_opf, grid_path,
+                       hydro_file_path):
+    prods = pd.concat([prod_solar, prod_wind], axis=1)
+    res_names = dict(wind=prod_wind.columns, solar=prod_solar.columns)
+
+    def run_dispatch():
+        # The dispatch modules import grid2op and pypsa: they are only
+        # imported when a dispatch is actually computed
+        from .dispatch import EconomicDispatch as ec
+        from .dispatch import generate_dispatch as gen_dispatch
+
+        dispatcher = get_dispatcher()
+        dispatcher.chronix_scenario = ec.ChroniXScenario(load, prods, res_names,
+                                                         scenario_name)
+        return gen_dispatch.main(
+            dispatcher, scenario_folder_path, scenario_folder_path, seed_disp,
+            params, params_opf,
+            stage_cache.cache_folder if stage_cache is not None else None)
 
+    # The dispatch noise is drawn from the global random state left
+    # by the previous stages, hence its presence in the cache key
+    with instr.record_stage(scenario_name, 'T'):
+        return run_cached_stage(
+            stage_cache, 'T',
+            (seed_disp, params, params_opf, load, prods,
+             hash_file(grid_path), hash_file(hydro_file_path),
+             np.random.get_state()),
+            scenario_folder_path, DISPATCH_STAGE_FILES, run_dispatch)
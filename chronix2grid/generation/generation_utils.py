@@ -8,6 +8,7 @@ import pandas as pd
 from scipy.interpolate import interp1d
 
 from ..config import DispatchConfigManager, LoadsConfigManager, ResConfigManager
+from .. import instrumentation as instr
 
 
 def make_generation_input_output_directories(input_folder, case, year, output_folder):
@@ -23,7 +24,8 @@ def make_generation_input_output_directories(input_folder, case, year, output_fo
     return dispatch_input_folder, dispatch_input_folder_case, dispatch_output_folder
 
 
-def generate_coarse_noise(params, data_type):
+@instr.timed('noise synthesis')
+def generate_coarse_noise(params, data_type, random_state=np.random):
     """
     This function generates a spatially and temporally correlated noise.
     Because it may take a lot of time to compute a correlated noise on
@@ -33,6 +35,8 @@ def generate_coarse_noise(params, data_type):
     Input:
         params: (dict) Defines the mesh dimensions and
             precision. Also define the correlation scales
+        random_state: (np.random.RandomState) random stream to draw from,
+            the global numpy random state by default
 
     Output:
         (np.array) 3D autocorrelated noise
@@ -54,10 +58,11 @@ def generate_coarse_noise(params, data_type):
     Nt_comp = int(T // dt_corr + 1)
 
     # Generate gaussian noise input·
-    output = np.random.normal(0, 1, (Nx_comp, Ny_comp, Nt_comp))
+    output = random_state.normal(0, 1, (Nx_comp, Ny_comp, Nt_comp))
 
     return output
 
+@instr.timed('interpolation')
 def interpolate_noise(computation_noise, params, locations, time_scale):
     """
     This interpolates an autocarrelated noise mesh, to make it more granular.
@@ -134,6 +139,55 @@ def interpolate_noise(computation_noise, params, locations, time_scale):
 
     return output
 
+@instr.timed('interpolation')
+def interpolate_noise_batch(computation_noise, params, locations, time_scale):
+    """
+    Vectorized version of interpolate_noise, for several scenarios and
+    several locations at once.
+
+    Input:
+        computation_noise: (np.array) Autocorrelated signals computed on a coarse mesh,
+            of shape (n_scenarios, Nx_comp, Ny_comp, Nt_comp)
+        params: (dict) Defines the mesh dimensions and
+            precision. Also define the correlation scales
+        locations: (np.array) Coordinates of the points of interest, of shape (n_locations, 2)
+
+    Output:
+        (np.array) time series of shape (n_scenarios, n_locations, Nt_inter)
+    """
+    T = params['T']
+    dx_corr = params['dx_corr']
+    dy_corr = params['dy_corr']
+    Nt_comp = int(T // time_scale + 1)
+    Nt_inter = T // params['dt'] + 1
+
+    locations = np.asarray(locations, dtype=float)
+    x, y = locations[:, 0], locations[:, 1]
+    x_minus = (x // dx_corr).astype(int)
+    y_minus = (y // dy_corr).astype(int)
+
+    # 1st step : spatial interpolation, neighbors are visited in the same
+    # order as in interpolate_noise
+    output = np.zeros((computation_noise.shape[0], len(locations), Nt_comp))
+    dist_tot = np.zeros(len(locations))
+    for x_neighbor in [x_minus, x_minus + 1]:
+        for y_neighbor in [y_minus, y_minus + 1]:
+            dist = 1 / (np.sqrt((x - dx_corr * x_neighbor) ** 2 + (y - dy_corr * y_neighbor) ** 2) + 1)
+            output += dist[None, :, None] * computation_noise[:, x_neighbor, y_neighbor, :]
+            dist_tot += dist
+    output /= dist_tot[None, :, None]
+
+    # 2nd step : temporal interpolation of all the series at once
+    t_comp = np.linspace(0, int(T), int(Nt_comp), endpoint=True)
+    t_inter = np.linspace(0, int(T), int(Nt_inter), endpoint=True)
+    kinds = {2: 'linear', 3: 'quadratic'}
+    if Nt_comp >= 2:
+        f2 = interp1d(t_comp, output, kind=kinds.get(Nt_comp, 'cubic'), axis=-1)
+        output = f2(t_inter)
+
+    return output
+
+
 def natural_keys(text):
     return int([ c for c in re.split('(\d+)', text) ][1])
 
@@ -9,6 +9,7 @@ import numpy as np
 from . import solar_wind_utils as swutils
 from .. import generation_utils as utils
 import chronix2grid.constants as cst
+from chronix2grid import instrumentation as instr
 
 
 def main(scenario_destination_path, seed, params, prods_charac, solar_pattern, write_results = True):
@@ -99,6 +100,88 @@ def main(scenario_destination_path, seed, params, prods_charac, solar_pattern, w
         elif prods_charac[mask]['type'].values == 'wind':
             wind_series[name] = prods_series[name]
 
+    return save_results(scenario_destination_path, params, prods_charac,
+                        datetime_index, prods_series, solar_series,
+                        wind_series, write_results)
+
+
+def main_batch(scenario_destination_paths, random_states, params, prods_charac,
+               solar_pattern, write_results=True):
+    """
+    Batch version of main: generates the solar and wind chronics of several
+    scenarios at once, the computations being vectorized across scenarios.
+
+    Each scenario draws its noises from its own random stream, in the same
+    order as main does with the global random state, so that a scenario
+    generated in a batch is the same as a scenario generated alone.
+
+    Parameters
+    ----------
+    scenario_destination_paths (list): Path of output directory of each scenario
+    random_states (list): numpy.random.RandomState of each scenario, seeded with the seed of the scenario
+    params (dict): system params such as timestep or mesh characteristics
+    prods_charac (pandas.DataFrame): characteristics of production nodes such as Pmax and type of production
+    solar_pattern (pandas.DataFrame): hourly solar production pattern for a year
+    write_results (boolean): whether to write results or not. Default is True
+
+    Returns
+    -------
+    list: for each scenario, the tuple of DataFrames returned by main
+    """
+    smoothdist = params['smoothdist']
+    datetime_index = pd.date_range(
+        start=params['start_date'],
+        end=params['end_date'],
+        freq=str(params['dt']) + 'min')
+    solar_pattern = solar_pattern[:-1]
+
+    print('Computing global auto-correlated spatio-temporal noise for sun and wind of {} scenarios...'.format(
+        len(random_states)))
+    noises = {data_type: [] for data_type in ['solar', 'long_wind', 'medium_wind', 'short_wind']}
+    uniform_noises = []
+    res_charac = prods_charac[prods_charac['type'].isin(['solar', 'wind'])]
+    Nt_inter = int(params['T'] // params['dt'] + 1)
+    for random_state in random_states:
+        for data_type in noises:
+            noises[data_type].append(utils.generate_coarse_noise(params, data_type, random_state))
+        # One row of uniform draws per farm, in the order of prods_charac
+        uniform_noises.append(random_state.random_sample((len(res_charac), Nt_inter)))
+    noises = {data_type: np.stack(noise) for data_type, noise in noises.items()}
+    uniform_noises = np.stack(uniform_noises)
+
+    print('Generating solar and wind production chronics')
+    is_solar = (res_charac['type'] == 'solar').values
+    is_wind = (res_charac['type'] == 'wind').values
+    solar_prods = swutils.compute_solar_series_batch(
+        res_charac.loc[is_solar, ['x', 'y']].values,
+        res_charac.loc[is_solar, 'Pmax'].values,
+        noises['solar'], params, solar_pattern, smoothdist,
+        time_scale=params['solar_corr'],
+        uniform_noise=uniform_noises[:, is_solar, :])
+    wind_prods = swutils.compute_wind_series_batch(
+        res_charac.loc[is_wind, ['x', 'y']].values,
+        res_charac.loc[is_wind, 'Pmax'].values,
+        noises['long_wind'], noises['medium_wind'], noises['short_wind'],
+        params, smoothdist,
+        uniform_noise=uniform_noises[:, is_wind, :])
+
+    solar_names = res_charac.loc[is_solar, 'name'].tolist()
+    wind_names = res_charac.loc[is_wind, 'name'].tolist()
+    results = []
+    for s, (path, random_state) in enumerate(zip(scenario_destination_paths, random_states)):
+        solar_series = dict(zip(solar_names, solar_prods[s]))
+        wind_series = dict(zip(wind_names, wind_prods[s]))
+        prods_series = {name: (solar_series[name] if name in solar_series else wind_series[name])
+                        for name in res_charac['name']}
+        results.append(save_results(path, params, prods_charac, datetime_index,
+                                    prods_series, solar_series, wind_series,
+                                    write_results, random_state))
+    return results
+
+
+def save_results(scenario_destination_path, params, prods_charac, datetime_index,
+                 prods_series, solar_series, wind_series, write_results=True,
+                 random_state=np.random):
     # Time index
     prods_series['datetime'] = datetime_index
     solar_series['datetime'] = datetime_index
@@ -122,7 +205,8 @@ def main(scenario_destination_path, seed, params, prods_charac, solar_pattern, w
         os.path.join(scenario_destination_path, 'solar_p.csv.bz2'),
         reordering=True,
         noise=params['planned_std'],
-        write_results=write_results
+        write_results=write_results,
+        random_state=random_state
     )
 
     prod_wind_forecasted = swutils.create_csv(
@@ -138,14 +222,16 @@ def main(scenario_destination_path, seed, params, prods_charac, solar_pattern, w
         wind_series, os.path.join(scenario_destination_path, 'wind_p.csv.bz2'),
         reordering=True,
         noise=params['planned_std'],
-        write_results=write_results
+        write_results=write_results,
+        random_state=random_state
     )
 
     prod_p = swutils.create_csv(
         prods_series, os.path.join(scenario_destination_path, 'prod_p.csv.bz2'),
         reordering=True,
         noise=params['planned_std'],
-        write_results=write_results
+        write_results=write_results,
+        random_state=random_state
     )
 
     prod_v = prods_charac[['name', 'V']].set_index('name')
@@ -154,11 +240,11 @@ def main(scenario_destination_path, seed, params, prods_charac, solar_pattern, w
     prod_v = prod_v.reindex(range(len(prod_p)))
     prod_v = prod_v.fillna(method='ffill') * 1.04
 
-    prod_v.to_csv(
-        os.path.join(scenario_destination_path, 'prod_v.csv.bz2'),
+    instr.to_csv(
+        prod_v, os.path.join(scenario_destination_path, 'prod_v.csv.bz2'),
         sep=';',
         index=False,
         float_format=cst.FLOATING_POINT_PRECISION_FORMAT
     )
 
-    return prod_solar, prod_solar_forecasted, prod_wind, prod_wind_forecasted
\ No newline at end of file
+    return prod_solar, prod_solar_forecasted, prod_wind, prod_wind_forecasted
@@ -6,6 +6,7 @@ from scipy.interpolate import interp1d
 
 from .. import generation_utils as utils
 import chronix2grid.constants as cst
+from chronix2grid import instrumentation as instr
 
 def compute_wind_series(locations, Pmax, long_noise, medium_noise, short_noise, params, smoothdist):
     # Compute refined signals
@@ -69,6 +70,87 @@ def compute_solar_series(locations, Pmax, solar_noise, params, solar_pattern, sm
 
     return solar_series
 
+def compute_wind_series_batch(locations, Pmax, long_noise, medium_noise, short_noise,
+                              params, smoothdist, uniform_noise):
+    """
+    Vectorized version of compute_wind_series for several scenarios and
+    several wind farms at once
+
+    Input:
+        locations: (np.array) coordinates of the farms, of shape (n_farms, 2)
+        Pmax: (np.array) capacities of the farms, of shape (n_farms,)
+        long_noise, medium_noise, short_noise: (np.array) coarse noises of shape
+            (n_scenarios, Nx_comp, Ny_comp, Nt_comp)
+        params: (dict) system params such as timestep or mesh characteristics
+        smoothdist: (float) amplitude of the uniform noise
+        uniform_noise: (np.array) draws of a uniform law on [0, 1[ of shape
+            (n_scenarios, n_farms, Nt_inter)
+
+    Output:
+        (np.array) wind productions of shape (n_scenarios, n_farms, Nt_inter)
+    """
+    long_scale_signal = utils.interpolate_noise_batch(
+        long_noise, params, locations, time_scale=params['long_wind_corr'])
+    medium_scale_signal = utils.interpolate_noise_batch(
+        medium_noise, params, locations, time_scale=params['medium_wind_corr'])
+    short_scale_signal = utils.interpolate_noise_batch(
+        short_noise, params, locations, time_scale=params['short_wind_corr'])
+
+    # Compute seasonal pattern
+    Nt_inter = int(params['T'] // params['dt'] + 1)
+    t = np.linspace(0, params['T'], Nt_inter, endpoint=True)
+    start_min = int(
+        pd.Timedelta(params['start_date'] - pd.to_datetime('2018/01/01', format='%Y-%m-%d')).total_seconds() // 60)
+    seasonal_pattern = np.cos((2 * np.pi / (365 * 24 * 60)) * (t - 30 * 24 * 60 - start_min))
+
+    # Combine signals
+    std_short_wind_noise = float(params['std_short_wind_noise'])
+    std_medium_wind_noise = float(params['std_medium_wind_noise'])
+    std_long_wind_noise = float(params['std_long_wind_noise'])
+    signal = (0.7 + 0.3 * seasonal_pattern) * (0.3 + std_medium_wind_noise * medium_scale_signal + std_long_wind_noise * long_scale_signal)
+    signal += std_short_wind_noise * short_scale_signal
+    signal = 1e-1 * np.exp(4 * signal)
+    signal += smoothdist * uniform_noise
+
+    signal[signal < 0.] = 0.
+    signal = smooth(signal)
+    return np.asarray(Pmax)[None, :, None] * signal
+
+def compute_solar_series_batch(locations, Pmax, solar_noise, params, solar_pattern,
+                               smoothdist, time_scale, uniform_noise):
+    """
+    Vectorized version of compute_solar_series for several scenarios and
+    several solar farms at once
+
+    Input:
+        locations: (np.array) coordinates of the farms, of shape (n_farms, 2)
+        Pmax: (np.array) capacities of the farms, of shape (n_farms,)
+        solar_noise: (np.array) coarse noises of shape
+            (n_scenarios, Nx_comp, Ny_comp, Nt_comp)
+        params: (dict) system params such as timestep or mesh characteristics
+        solar_pattern: (np.array) hourly solar production pattern for a year
+        smoothdist: (float) amplitude of the uniform noise
+        time_scale: (float) correlation time scale of the solar noise
+        uniform_noise: (np.array) draws of a uniform law on [0, 1[ of shape
+            (n_scenarios, n_farms, Nt_inter)
+
+    Output:
+        (np.array) solar productions of shape (n_scenarios, n_farms, Nt_inter)
+    """
+    Pmax = np.asarray(Pmax)
+    final_noise = utils.interpolate_noise_batch(solar_noise, params, locations, time_scale)
+
+    # The solar pattern is computed once for all farms and scenarios
+    solar_pattern = compute_solar_pattern(params, solar_pattern)
+
+    std_solar_noise = float(params['std_solar_noise'])
+    signal = solar_pattern*(0.75+std_solar_noise*final_noise)
+    signal += (smoothdist/Pmax)[None, :, None] * uniform_noise
+    signal[signal < 0.] = 0.
+    signal = smooth(signal)
+    return Pmax[None, :, None]*signal
+
+@instr.timed('pattern building')
 def compute_solar_pattern(params, solar_pattern):
     """
     Loads a typical hourly pattern, and interpolates it to generate
@@ -142,7 +224,7 @@ def smooth(x, alpha=0.5, beta=None):
 
 
 def create_csv(dict_, path, reordering=True, noise=None, shift=False,
-               write_results=True, index=False):
+               write_results=True, index=False, random_state=np.random):
     df = pd.DataFrame.from_dict(dict_)
     df.set_index('datetime', inplace=True)
     df = df.sort_index(ascending=True)
@@ -154,13 +236,13 @@ def create_csv(dict_, path, reordering=True, noise=None, shift=False,
         new_ordering = [x for _ ,x in sorted(zip(value ,list(df)))]
         df = df[new_ordering]
     if noise is not None:
-        df *= ( 1 +noise *np.random.normal(0, 1, df.shape))
+        df *= ( 1 +noise *random_state.normal(0, 1, df.shape))
     if shift:
         df = df.shift(-1)
         df = df.fillna(0)
     if write_results:
-        df.to_csv(path, index=index, sep=';',
-                  float_format=cst.FLOATING_POINT_PRECISION_FORMAT)
+        instr.to_csv(df, path, index=index, sep=';',
+                     float_format=cst.FLOATING_POINT_PRECISION_FORMAT)
 
     return df
 
@@ -0,0 +1,274 @@
+"""
+Per-scenario, per-stage timing instrumentation.
+
+While a stage of a scenario runs inside record_stage, the time spent in each
+of its steps (noise synthesis, interpolation, CSV formatting, OPF solve...)
+is accumulated in memory by the process running it. At the end of the stage,
+one JSON line per step is appended to timings_folder/<scenario>.jsonl, with
+the total time of the stage, the bytes it wrote and the peak resident memory
+of the process during the stage. summarize aggregates these files once all
+scenarios are done.
+
+Outside of record_stage, or when no timings folder has been set, timed and
+add_bytes do nothing.
+"""
+
+import bz2
+import json
+import os
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+SUMMARY_FILE_NAME = 'summary.json'
+
+_state = dict(timings_folder=None, scenario=None, stage=None, steps=None,
+              inner_peak_rss_mb=None)
+
+
+def set_timings_folder(timings_folder):
+    """Set the folder in which the current process writes its timings"""
+    _state['timings_folder'] = timings_folder
+
+
+def peak_rss_mb():
+    """
+    Peak resident memory of the current process in MB, since the last
+    reset_peak_rss if any, None if unknown
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def reset_peak_rss():
+    """
+    Reset the peak resident memory of the current process to its current
+    resident memory, so that peak_rss_mb measures the peak from now on.
+    Only possible on Linux: returns False if it could not be reset
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        return False
+    return True
+
+
+def n_threads():
+    """
+    Number of OS threads of the current process, including the ones started
+    by BLAS or solvers, None if unknown (only available on Linux)
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('Threads:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+@contextmanager
+def record_stage(scenario_name, stage):
+    """
+    Record the steps of a stage of a scenario and write them in the timings
+    folder when the stage ends
+
+    Parameters
+    ----------
+    scenario_name: str
+        Name of the scenario (or of the batch of scenarios) being computed
+    stage: str
+        Name of the stage (L, R, T, K...)
+
+    The peak resident memory of the process is reset when the stage starts,
+    so that each stage reports its own peak. Where it cannot be reset, the
+    peak of the stage is unknown and only the one of the process, since it
+    started, is recorded
+    """
+    timings_folder = _state['timings_folder']
+    if timings_folder is None:
+        yield
+        return
+    previous = dict(_state)
+    _state.update(scenario=scenario_name, stage=stage, steps=OrderedDict(),
+                  inner_peak_rss_mb=None)
+    measured = reset_peak_rss()
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    try:
+        yield
+    finally:
+        steps = _state['steps']
+        peak = peak_rss_mb()
+        if peak is not None and _state['inner_peak_rss_mb'] is not None:
+            # The peak was reset by stages recorded within this one
+            peak = max(peak, _state['inner_peak_rss_mb'])
+        total = dict(seconds=time.perf_counter() - start,
+                     cpu_seconds=time.process_time() - cpu_start, calls=1,
+                     bytes_written=sum(step['bytes_written']
+                                       for step in steps.values()),
+                     peak_rss_mb=peak if measured else None,
+                     process_peak_rss_mb=peak, n_threads=n_threads())
+        _state.update(previous)
+        if measured and peak is not None:
+            _state['inner_peak_rss_mb'] = max(
+                _state['inner_peak_rss_mb'] or 0., peak)
+        write_records(timings_folder, scenario_name, stage, steps, total)
+
+
+def _current_step(step):
+    return _state['steps'].setdefault(
+        step, dict(seconds=0., calls=0, bytes_written=0))
+
+
+@contextmanager
+def timed(step):
+    """
+    Add the time spent in the block to a step of the current stage. Can also
+    be used as a function decorator
+    """
+    if _state['steps'] is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if _state['steps'] is not None:
+            current_step = _current_step(step)
+            current_step['seconds'] += time.perf_counter() - start
+            current_step['calls'] += 1
+
+
+def add_bytes(step, n_bytes):
+    """Count bytes written by a step of the current stage"""
+    if _state['steps'] is not None:
+        _current_step(step)['bytes_written'] += n_bytes
+
+
+def to_csv(df, path, **kwargs):
+    """
+    Write a DataFrame like DataFrame.to_csv does, timing the CSV formatting
+    and the bz2 compression separately when path ends with .bz2
+    """
+    if not path.endswith('.bz2'):
+        with timed('csv formatting'):
+            df.to_csv(path, **kwargs)
+        add_bytes('csv formatting', os.path.getsize(path))
+        return
+    with timed('csv formatting'):
+        text = df.to_csv(**kwargs)
+    with timed('compression'):
+        data = bz2.compress(text.encode())
+    with open(path, 'wb') as f:
+        f.write(data)
+    add_bytes('compression', len(data))
+
+
+def write_records(timings_folder, scenario_name, stage, steps, total):
+    os.makedirs(timings_folder, exist_ok=True)
+    lines = [json.dumps(dict(scenario=scenario_name, stage=stage, step=step,
+                             pid=os.getpid(), **values))
+             for step, values in list(steps.items()) + [('total', total)]]
+    # Stages of a scenario may be run by different processes: each of them
+    # appends its lines at once
+    with open(os.path.join(timings_folder, scenario_name + '.jsonl'), 'a') as f:
+        f.write('\n'.join(lines) + '\n')
+
+
+def read_records(timings_folder):
+    """All the records written in a timings folder"""
+    records = []
+    for file_name in sorted(os.listdir(timings_folder)):
+        if not file_name.endswith('.jsonl'):
+            continue
+        with open(os.path.join(timings_folder, file_name)) as f:
+            records += [json.loads(line) for line in f if line.strip()]
+    return records
+
+
+def clear_timings(timings_folder):
+    """Remove the records left in a timings folder by a previous run"""
+    if not os.path.isdir(timings_folder):
+        return
+    for file_name in os.listdir(timings_folder):
+        if file_name.endswith('.jsonl') or file_name == SUMMARY_FILE_NAME:
+            os.remove(os.path.join(timings_folder, file_name))
+
+
+def summarize(timings_folder, wall_time=None):
+    """
+    Aggregate the records of a timings folder by stage and step, write them
+    in summary.json and print them
+
+    Returns
+    -------
+    dict
+        The summary
+    """
+    os.makedirs(timings_folder, exist_ok=True)
+    stages = OrderedDict()
+    scenarios = set()
+    workers = {}
+    peak_rss = None
+    for record in read_records(timings_folder):
+        scenarios.add(record['scenario'])
+        step = stages.setdefault(record['stage'], OrderedDict()).setdefault(
+            record['step'], dict(seconds=0., calls=0, bytes_written=0))
+        step['seconds'] += record['seconds']
+        step['calls'] += record['calls']
+        step['bytes_written'] += record['bytes_written']
+        if 'cpu_seconds' in record:
+            step['cpu_seconds'] = step.get('cpu_seconds', 0.) + record['cpu_seconds']
+        # Peak of the process over the stage, or since it started where the
+        # peak of the stage is unknown
+        process_peak = record.get('process_peak_rss_mb', record.get('peak_rss_mb'))
+        if process_peak is not None:
+            peak_rss = max(peak_rss or 0., process_peak)
+            worker = workers.setdefault(str(record['pid']), dict(
+                peak_rss_mb=0., max_threads=None))
+            worker['peak_rss_mb'] = max(worker['peak_rss_mb'], process_peak)
+            if record['step'] == 'total' and record.get('peak_rss_mb') is not None:
+                step['peak_rss_mb'] = max(step.get('peak_rss_mb', 0.),
+                                          record['peak_rss_mb'])
+            if record.get('n_threads') is not None:
+                worker['max_threads'] = max(worker['max_threads'] or 0,
+                                            record['n_threads'])
+    summary = dict(wall_time=wall_time, n_scenarios=len(scenarios),
+                   peak_rss_mb=peak_rss, stages=stages, workers=workers)
+    with open(os.path.join(timings_folder, SUMMARY_FILE_NAME), 'w') as f:
+        json.dump(summary, f, indent=2)
+
+    print('Timings summary (seconds summed over scenarios)')
+    for stage, steps in stages.items():
+        total = steps.get('total', dict(seconds=0.))['seconds']
+        print('  {}: {:.2f}'.format(stage, total))
+        step_items = [(step, values) for step, values in steps.items()
+                      if step != 'total']
+        other = total - sum(values['seconds'] for _, values in step_items)
+        step_items.append(('other', dict(seconds=other, calls=0,
+                                         bytes_written=0)))
+        for step, values in sorted(step_items,
+                                   key=lambda item: -item[1]['seconds']):
+            print('    {:<22} {:>10.2f} {:>6.1%} {:>8} calls {:>12} bytes'.format(
+                step, values['seconds'],
+                values['seconds'] / total if total else 0.,
+                values['calls'], values['bytes_written']))
+    if peak_rss is not None:
+        print('  peak RSS: {:.0f} MB'.format(peak_rss))
+    return summary
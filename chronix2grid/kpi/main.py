@@ -8,6 +8,7 @@ from .preprocessing.pivot_KPI import pivot_format
 from .deterministic.kpis import EconomicDispatchValidator
 from ..generation import generation_utils as gu
 from .. import constants as cst
+from .. import instrumentation as instr
 from .. import utils as ut
 
 
@@ -67,20 +68,22 @@ def main(kpi_input_folder, generation_output_folder, scenario_names,
         # Read reference and synthetic chronics, but also KPI configuration, in pivot format. 2 modes: with or without full dispatch
         if wind_solar_only:
             # Get reference and synthetic dispatch and loads
-            (ref_dispatch, ref_consumption, syn_dispatch, syn_consumption,
-             paramsKPI) = pivot_format(
-                scenario_generation_output_folder, kpi_input_folder, year,
-                prods_charac, loads_charac, wind_solar_only,
-                params, case)
+            with instr.timed('kpi formatting'):
+                (ref_dispatch, ref_consumption, syn_dispatch, syn_consumption,
+                 paramsKPI) = pivot_format(
+                    scenario_generation_output_folder, kpi_input_folder, year,
+                    prods_charac, loads_charac, wind_solar_only,
+                    params, case)
             ref_prices = None
             prices = None
         else:
             # Get reference and synthetic dispatch and loads
-            (ref_dispatch, ref_consumption, syn_dispatch, syn_consumption,
-             ref_prices, prices, paramsKPI) = pivot_format(
-                scenario_generation_output_folder, kpi_input_folder, year,
-                prods_charac, loads_charac, wind_solar_only,
-                params, case)
+            with instr.timed('kpi formatting'):
+                (ref_dispatch, ref_consumption, syn_dispatch, syn_consumption,
+                 ref_prices, prices, paramsKPI) = pivot_format(
+                    scenario_generation_output_folder, kpi_input_folder, year,
+                    prods_charac, loads_charac, wind_solar_only,
+                    params, case)
 
         ## Start and Run Economic dispatch validator
         # -- + -- + -- + -- + -- + -- + --
@@ -102,42 +105,45 @@ def main(kpi_input_folder, generation_output_folder, scenario_names,
             max_col = 1
         else:
             max_col = 2
-        dispatch_validator.plot_carriers_pw(curve='reference', stacked=True, max_col_splot=max_col, save_html=True,
-                                            wind_solar_only=wind_solar_only)
-        dispatch_validator.plot_carriers_pw(curve='synthetic', stacked=True, max_col_splot=max_col, save_html=True,
-                                            wind_solar_only=wind_solar_only)
-
-        # Get Load KPI
-        dispatch_validator.load_kpi()
-
-        # Get Wind KPI
-        dispatch_validator.wind_kpi()
-
-        # Get Solar KPI
-        cloud_quantile = float(paramsKPI['cloudiness_quantile'])
-        cond_below_cloud = float(paramsKPI['cloudiness_factor'])
-        hours = paramsKPI["night_hours"]
-        monthly_pattern = paramsKPI["seasons"]
-        dispatch_validator.solar_kpi(cloud_quantile=cloud_quantile, cond_below_cloud=cond_below_cloud,
-                                     monthly_pattern=monthly_pattern, hours=hours)
-
-        # Wind - Solar KPI
-        dispatch_validator.wind_load_kpi()
-
-        # These KPI only if dispatch has been made
-        if not wind_solar_only:
-            # Get Energy Mix
-            dispatch_validator.energy_mix()
-
-            # Get Hydro KPI
-            dispatch_validator.hydro_kpi()
-
-            # Get Nuclear KPI
-            dispatch_validator.nuclear_kpi()
-
-            # Get Thermal KPI
-            dispatch_validator.thermal_kpi()
-            dispatch_validator.thermal_load_kpi()
+        with instr.timed('plotting'):
+            dispatch_validator.plot_carriers_pw(curve='reference', stacked=True, max_col_splot=max_col, save_html=True,
+                                                wind_solar_only=wind_solar_only)
+            dispatch_validator.plot_carriers_pw(curve='synthetic', stacked=True, max_col_splot=max_col, save_html=True,
+                                                wind_solar_only=wind_solar_only)
+
+        # KPI computations also save their own plots
+        with instr.timed('kpi computation'):
+            # Get Load KPI
+            dispatch_validator.load_kpi()
+
+            # Get Wind KPI
+            dispatch_validator.wind_kpi()
+
+            # Get Solar KPI
+            cloud_quantile = float(paramsKPI['cloudiness_quantile'])
+            cond_below_cloud = float(paramsKPI['cloudiness_factor'])
+            hours = paramsKPI["night_hours"]
+            monthly_pattern = paramsKPI["seasons"]
+            dispatch_validator.solar_kpi(cloud_quantile=cloud_quantile, cond_below_cloud=cond_below_cloud,
+                                         monthly_pattern=monthly_pattern, hours=hours)
+
+            # Wind - Solar KPI
+            dispatch_validator.wind_load_kpi()
+
+            # These KPI only if dispatch has been made
+            if not wind_solar_only:
+                # Get Energy Mix
+                dispatch_validator.energy_mix()
+
+                # Get Hydro KPI
+                dispatch_validator.hydro_kpi()
+
+                # Get Nuclear KPI
+                dispatch_validator.nuclear_kpi()
+
+                # Get Thermal KPI
+                dispatch_validator.thermal_kpi()
+                dispatch_validator.thermal_load_kpi()
 
 
         # Write json output file
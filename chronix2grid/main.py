@@ -1,4 +1,6 @@
+import json
 import os
+import sys
 import time
 
 import click
@@ -8,12 +10,18 @@ from functools import partial
 from chronix2grid import constants as cst
 from chronix2grid.generation import generate_chronics as gen
 from chronix2grid.generation import generation_utils as gu
-from chronix2grid.kpi import main as kpis
+from chronix2grid import instrumentation as instr
 from chronix2grid.output_processor import (
     output_processor_to_chunks, write_start_dates_for_chunks)
+from chronix2grid.pipeline import StagePipeline, parse_stage_cores
+from chronix2grid import planner
+from chronix2grid import profiling
 from chronix2grid.seed_manager import (parse_seed_arg, generate_default_seed,
                                        dump_seeds)
+from chronix2grid.stage_cache import (hash_folder, make_stage_cache,
+                                      run_cached_stage)
 from chronix2grid import utils as ut
+from chronix2grid import worker_resources as wr
 
 
 @click.command()
@@ -39,9 +47,44 @@ from chronix2grid import utils as ut
                    'in the chosen output directory.')
 @click.option('--scenario_name', default='', help='subname to add to the generated scenario output folder, as Scenario_subname_i')
 @click.option('--nb_core', default=1, help='number of cores to parallelize the number of scenarios')
+@click.option('--cache-folder', default=None,
+              help='Directory in which the outputs of each stage (L, R, T, K) '
+                   'are cached under a hash of their inputs, to be reused by '
+                   'later runs, as well as the dispatcher built from the grid. '
+                   'Disabled by default.')
+@click.option('--batch-size', default=1, type=click.IntRange(min=1, clamp=True),
+              help='number of scenarios whose loads and renewables are '
+                   'generated together, vectorized, by each process')
+@click.option('--stage-cores', default=None,
+              help='Pipeline the stages across scenarios, each stage having '
+                   'its own pool of processes, e.g. LR=4,T=2,K=1. Replaces '
+                   '--nb_core when given.')
+@click.option('--stage-queue-size', default=2,
+              help='maximum number of scenarios waiting for each stage when '
+                   'stages are pipelined')
+@click.option('--profile', default=None,
+              type=click.Choice(profiling.PROFILE_MODES),
+              help='Profile each scenario in its worker process, with cProfile '
+                   'or by sampling its stack, and merge the profiles into a '
+                   'ranked report in OUTPUT_FOLDER/profiles.')
+@click.option('--profile-interval', default=0.005,
+              help='time in seconds between two samples of the sampling profiler')
+@click.option('--blas-threads', default=None, type=int,
+              help='maximum number of BLAS threads (numpy, scipy) per worker. '
+                   'Defaults to blas_threads of params_opf.json, or to the '
+                   'number of CPUs divided by the number of workers')
+@click.option('--solver-threads', default=None, type=int,
+              help='number of threads of the LP solver of each worker. '
+                   'Defaults to solver_threads of params_opf.json, or to the '
+                   'number of CPUs divided by the number of workers')
+@click.option('--pin-workers', is_flag=True,
+              help='pin each worker process to its own set of cores (Linux '
+                   'only), also enabled by pin_workers in params_opf.json')
 def generate_mp(case, start_date, weeks, by_n_weeks, n_scenarios, mode,
              input_folder, output_folder, scenario_name,
-             seed_for_loads, seed_for_res, seed_for_dispatch, nb_core, ignore_warnings):
+             seed_for_loads, seed_for_res, seed_for_dispatch, nb_core, ignore_warnings,
+             cache_folder, batch_size, stage_cores, stage_queue_size, profile,
+             profile_interval, blas_threads, solver_threads, pin_workers):
 
     start_time = time.time()
     print(case)
@@ -57,6 +100,16 @@ def generate_mp(case, start_date, weeks, by_n_weeks, n_scenarios, mode,
     generation_output_folder, kpi_output_folder = create_directory_tree(
         case, start_date, output_folder, scenario_base_name, n_scenarios, mode,
         warn_user=not ignore_warnings)
+    timings_folder = os.path.join(
+        output_folder, cst.TIMINGS_FOLDER_NAME, case, start_date)
+    instr.clear_timings(timings_folder)
+    profile_settings = None
+    if profile is not None:
+        profile_settings = profiling.ProfileSettings(
+            os.path.join(output_folder, cst.PROFILES_FOLDER_NAME, case,
+                         start_date),
+            profile, profile_interval)
+        profiling.clear_profiles(profile_settings.folder)
 
     # seeds
     default_seed = generate_default_seed()
@@ -88,33 +141,317 @@ def generate_mp(case, start_date, weeks, by_n_weeks, n_scenarios, mode,
         seeds_for_res = [seed_for_res]
         seeds_for_disp = [seed_for_dispatch]
 
+    params_opf = read_params_opf(input_folder, case)
+    batches = [list(range(i, min(i + batch_size, n_scenarios)))
+               for i in range(0, n_scenarios, batch_size)]
+    if stage_cores is not None:
+        try:
+            n_workers = parse_stage_cores(stage_cores)
+        except ValueError as e:
+            raise click.BadParameter(str(e), param_hint='--stage-cores')
+        resources = wr.make_worker_resources(
+            sum(n for stage, n in n_workers.items()
+                if stage == 'LR' or stage in mode),
+            blas_threads, solver_threads, pin_workers, params_opf)
+        wr.report_worker_resources(resources)
+        generate_pipelined(
+            case, start_date, weeks, by_n_weeks, mode, input_folder,
+            kpi_output_folder, generation_output_folder, scen_names,
+            seeds_for_loads, seeds_for_res, seeds_for_disp, batches,
+            n_workers, stage_queue_size, cache_folder, timings_folder,
+            profile_settings, resources)
+        print('pipeline done')
+        print('Time taken = {} seconds'.format(time.time() - start_time))
+        instr.summarize(timings_folder, time.time() - start_time)
+        report_profiles(profile_settings)
+        return
+
     # multi-processing
-    pool = multiprocessing.Pool(nb_core)
-    iterable = [i for i in range(n_scenarios)]
+    resources = wr.make_worker_resources(nb_core, blas_threads, solver_threads,
+                                         pin_workers, params_opf)
+    wr.report_worker_resources(resources)
+    pool = multiprocessing.Pool(nb_core, **wr.pool_kwargs(resources))
+    if batch_size > 1:
+        iterable = batches
+        per_process_func = generate_per_batch
+    else:
+        iterable = [i for i in range(n_scenarios)]
+        per_process_func = generate_per_scenario
     multiprocessing_func = partial(
-        generate_per_scenario,
+        per_process_func,
         case, start_date, weeks, by_n_weeks, mode, input_folder,
         kpi_output_folder, generation_output_folder, scen_names,
-        seeds_for_loads, seeds_for_res, seeds_for_disp, ignore_warnings)
+        seeds_for_loads, seeds_for_res, seeds_for_disp, ignore_warnings,
+        cache_folder=cache_folder, timings_folder=timings_folder,
+        profile_settings=profile_settings)
     
     pool.map(multiprocessing_func, iterable)
     pool.close()
     print('multiprocessing done')  
     print('Time taken = {} seconds'.format(time.time() - start_time))
+    instr.summarize(timings_folder, time.time() - start_time)
+    report_profiles(profile_settings)
+
+
+@click.command()
+@click.option('--case', default='case118_l2rpn', help='case folder to base generation on')
+@click.option('--start-date', default='2012-01-01', help='Start date to generate chronics')
+@click.option('--weeks', default=4, help='Number of weeks to generate')
+@click.option('--by-n-weeks', default=4, help='Size of the output chunks in weeks')
+@click.option('--n_scenarios', default=1, help='Number of scenarios to generate')
+@click.option('--mode', default='LRTK', help='Steps to execute, as for the generation')
+@click.option('--input-folder',
+              default=os.path.join(os.path.normpath(os.getcwd()),
+                                   cst.DEFAULT_INPUT_FOLDER_NAME),
+              help='Directory to read input files from.')
+@click.option('--nb_core', default=1, help='number of cores to parallelize the number of scenarios')
+@click.option('--cost-model', default=None,
+              help='cost model calibrated with chronix2grid-benchmark '
+                   'calibrate, rough default values if not given')
+@click.option('--memory-mb', default=None, type=float,
+              help='memory available to the run in MB, read from the system '
+                   'by default')
+@click.option('--output', default=None, help='JSON file in which the plan is written')
+def plan(case, start_date, weeks, by_n_weeks, n_scenarios, mode, input_folder,
+         nb_core, cost_model, memory_mb, output):
+    """Estimate the time, memory, disk and OPF windows of a run before launching it"""
+    run_plan = planner.plan_run(input_folder, case, weeks, n_scenarios, mode,
+                                by_n_weeks, nb_core, start_date, cost_model,
+                                memory_mb)
+    print(planner.format_plan(run_plan))
+    if output is not None:
+        with open(output, 'w') as f:
+            json.dump(run_plan, f, indent=2)
+
+
+def cli():
+    """
+    Entry point of the chronix2grid command: `chronix2grid plan [OPTIONS]`
+    plans a run, any other arguments generate chronics with generate_mp
+    """
+    if len(sys.argv) > 1 and sys.argv[1] == 'plan':
+        plan(sys.argv[2:], prog_name='chronix2grid plan')
+    else:
+        generate_mp()
+
+
+def read_params_opf(input_folder, case):
+    """params_opf.json of the case, empty if the case has none"""
+    params_opf_path = os.path.join(input_folder, cst.GENERATION_FOLDER_NAME,
+                                   case, 'params_opf.json')
+    if not os.path.exists(params_opf_path):
+        return {}
+    with open(params_opf_path) as f:
+        return json.load(f)
+
+
+def report_profiles(profile_settings):
+    if profile_settings is None:
+        return
+    report_path = profiling.merge_profiles(profile_settings.folder)
+    if report_path is not None:
+        print('Profiling report written in ' + report_path)
 
 
 def generate_per_scenario(case, start_date, weeks, by_n_weeks, mode,
              input_folder, kpi_output_folder, generation_output_folder, scen_names,
-             seeds_for_loads, seeds_for_res, seeds_for_dispatch, ignore_warnings, scenario_id):
+             seeds_for_loads, seeds_for_res, seeds_for_dispatch, ignore_warnings, scenario_id,
+             cache_folder=None, timings_folder=None, profile_settings=None):
     
     n_scenarios_sub_p = 1  # one scenario to compute per process``
-    scenario_name = scen_names(scenario_id)
+    instr.set_timings_folder(timings_folder)
 
     # get scenario seeds
     seed_for_loads = seeds_for_loads[scenario_id]
     seed_for_res = seeds_for_res[scenario_id]
     seed_for_dispatch = seeds_for_dispatch[scenario_id]
     
+    dump_scenario_seeds(generation_output_folder, scen_names, scenario_id,
+                        seed_for_loads, seed_for_res, seed_for_dispatch)
+
+    # go to generate chronics
+    with profiling.profile(profile_settings, scen_names(scenario_id)):
+        generate_inner(
+            case, start_date, weeks, by_n_weeks, n_scenarios_sub_p, mode,
+            input_folder, kpi_output_folder, generation_output_folder,
+            scen_names, seed_for_loads, seed_for_res, seed_for_dispatch,
+            scenario_id, cache_folder)
+
+
+def generate_per_batch(case, start_date, weeks, by_n_weeks, mode,
+                       input_folder, kpi_output_folder, generation_output_folder,
+                       scen_names, seeds_for_loads, seeds_for_res,
+                       seeds_for_dispatch, ignore_warnings, scenario_ids,
+                       cache_folder=None, timings_folder=None,
+                       profile_settings=None):
+    """
+    Generate the scenarios of scenario_ids in one process, the loads and
+    renewables of all of them being computed together as a batch
+    """
+    instr.set_timings_folder(timings_folder)
+    with profiling.profile(profile_settings,
+                           '+'.join(scen_names(i) for i in scenario_ids)):
+        generate_batch(case, start_date, weeks, by_n_weeks, mode, input_folder,
+                       kpi_output_folder, generation_output_folder, scen_names,
+                       seeds_for_loads, seeds_for_res, seeds_for_dispatch,
+                       scenario_ids, cache_folder)
+
+
+def generate_batch(case, start_date, weeks, by_n_weeks, mode, input_folder,
+                   kpi_output_folder, generation_output_folder, scen_names,
+                   seeds_for_loads, seeds_for_res, seeds_for_dispatch,
+                   scenario_ids, cache_folder=None):
+    for scenario_id in scenario_ids:
+        dump_scenario_seeds(generation_output_folder, scen_names, scenario_id,
+                            seeds_for_loads[scenario_id],
+                            seeds_for_res[scenario_id],
+                            seeds_for_dispatch[scenario_id])
+
+    time_parameters = gu.time_parameters(weeks, start_date)
+    generation_input_folder = os.path.join(
+        input_folder, cst.GENERATION_FOLDER_NAME
+    )
+    kpi_input_folder = os.path.join(
+        input_folder, cst.KPI_FOLDER_NAME
+    )
+    year = time_parameters['year']
+    params, loads_charac, prods_charac = None, None, None
+
+    if 'L' in mode or 'R' in mode:
+        params, loads_charac, prods_charac = gen.main_batch(
+            case, generation_input_folder, generation_output_folder,
+            scen_names, time_parameters, scenario_ids,
+            [seeds_for_loads[i] for i in scenario_ids],
+            [seeds_for_res[i] for i in scenario_ids],
+            [seeds_for_dispatch[i] for i in scenario_ids],
+            mode, cache_folder)
+        for scenario_id in scenario_ids:
+            write_chunks(generation_output_folder, scen_names(scenario_id),
+                         by_n_weeks, 1, weeks, start_date, params, mode)
+
+    for scenario_id in scenario_ids:
+        run_kpi_stage(mode, kpi_input_folder, generation_output_folder,
+                      scen_names, kpi_output_folder, year, case, 1, params,
+                      loads_charac, prods_charac, scenario_id, cache_folder)
+
+
+def generate_pipelined(case, start_date, weeks, by_n_weeks, mode, input_folder,
+                       kpi_output_folder, generation_output_folder, scen_names,
+                       seeds_for_loads, seeds_for_res, seeds_for_dispatch,
+                       batches, n_workers, queue_size=2, cache_folder=None,
+                       timings_folder=None, profile_settings=None,
+                       resources=None):
+    """
+    Generate scenarios with one pool of processes per stage: loads and
+    renewables (LR), dispatch (T) and KPI (K). Generated series are handed
+    over in memory from one stage to the next
+
+    Parameters
+    ----------
+    batches (list): lists of scenario ids whose loads and renewables are generated together
+    n_workers (dict): number of processes of each stage, as returned by chronix2grid.pipeline.parse_stage_cores
+    queue_size (int): maximum number of scenarios waiting for each stage
+    resources (WorkerResources): threads and pinning policy of the workers of all stages
+    Other parameters are the same as in generate_per_batch
+    """
+    context = dict(
+        case=case, start_date=start_date, weeks=weeks, by_n_weeks=by_n_weeks,
+        mode=mode, input_folder=input_folder,
+        kpi_output_folder=kpi_output_folder,
+        generation_output_folder=generation_output_folder,
+        scen_names=scen_names, seeds_for_loads=seeds_for_loads,
+        seeds_for_res=seeds_for_res, seeds_for_dispatch=seeds_for_dispatch,
+        cache_folder=cache_folder, timings_folder=timings_folder,
+        profile_settings=profile_settings)
+    stage_functions = [('LR', generation_stage)]
+    if 'T' in mode and ('L' in mode or 'R' in mode):
+        stage_functions.append(('T', dispatch_stage))
+    if 'K' in mode:
+        stage_functions.append(('K', kpi_stage))
+    stages = [(stage, partial(run_stage, context, stage, stage_function),
+               n_workers[stage])
+              for stage, stage_function in stage_functions]
+    StagePipeline(stages, queue_size, wr.pool_kwargs(resources)).run(batches)
+
+
+def run_stage(context, stage, stage_function, item):
+    """Run a stage of the pipeline in a worker, with timings and profiling"""
+    instr.set_timings_folder(context['timings_folder'])
+    scenario_ids = item if isinstance(item, list) else [item['scenario_id']]
+    name = '+'.join(context['scen_names'](i) for i in scenario_ids)
+    with profiling.profile(context['profile_settings'], name + '_' + stage):
+        return stage_function(context, item)
+
+
+def generation_stage(context, scenario_ids):
+    """Loads and renewables generation of a batch of scenarios"""
+    for scenario_id in scenario_ids:
+        dump_scenario_seeds(context['generation_output_folder'],
+                            context['scen_names'], scenario_id,
+                            context['seeds_for_loads'][scenario_id],
+                            context['seeds_for_res'][scenario_id],
+                            context['seeds_for_dispatch'][scenario_id])
+    mode = context['mode']
+    if 'L' not in mode and 'R' not in mode:
+        return [dict(scenario_id=scenario_id, params=None, loads_charac=None,
+                     prods_charac=None) for scenario_id in scenario_ids]
+
+    params, loads_charac, prods_charac, params_opf, scenarios = \
+        gen.generate_res_load_batch(
+            context['case'],
+            os.path.join(context['input_folder'], cst.GENERATION_FOLDER_NAME),
+            context['generation_output_folder'], context['scen_names'],
+            gu.time_parameters(context['weeks'], context['start_date']),
+            scenario_ids,
+            [context['seeds_for_loads'][i] for i in scenario_ids],
+            [context['seeds_for_res'][i] for i in scenario_ids],
+            mode, context['cache_folder'])
+    return [dict(scenario_id=scenario_id, params=params,
+                 loads_charac=loads_charac, prods_charac=prods_charac,
+                 params_opf=params_opf, scenario=scenario)
+            for scenario_id, scenario in zip(scenario_ids, scenarios)]
+
+
+# Dispatchers built by a dispatch worker, reused for all its scenarios
+_dispatchers = {}
+
+
+def dispatch_stage(context, item):
+    """Dispatch and chunking of a scenario generated by generation_stage"""
+    generation_input_folder = os.path.join(context['input_folder'],
+                                           cst.GENERATION_FOLDER_NAME)
+    get_dispatcher = gen.make_dispatcher_getter(
+        os.path.join(generation_input_folder, context['case'], cst.GRID_FILENAME),
+        generation_input_folder, _dispatchers, context['cache_folder'])
+    gen.dispatch_scenario(
+        context['case'], generation_input_folder,
+        context['generation_output_folder'], item['scenario'],
+        context['seeds_for_dispatch'][item['scenario_id']], item['params'],
+        item['params_opf'], get_dispatcher, context['cache_folder'])
+    write_chunks(context['generation_output_folder'],
+                 context['scen_names'](item['scenario_id']),
+                 context['by_n_weeks'], 1, context['weeks'],
+                 context['start_date'], item['params'], context['mode'])
+    # Generated series are not needed anymore by the KPI stage
+    return [{key: value for key, value in item.items() if key != 'scenario'}]
+
+
+def kpi_stage(context, item):
+    """KPI computation of a generated scenario"""
+    run_kpi_stage(
+        context['mode'],
+        os.path.join(context['input_folder'], cst.KPI_FOLDER_NAME),
+        context['generation_output_folder'], context['scen_names'],
+        context['kpi_output_folder'],
+        gu.time_parameters(context['weeks'], context['start_date'])['year'],
+        context['case'], 1, item['params'], item['loads_charac'],
+        item['prods_charac'], item['scenario_id'], context['cache_folder'])
+    return []
+
+
+def dump_scenario_seeds(generation_output_folder, scen_names, scenario_id,
+                        seed_for_loads, seed_for_res, seed_for_dispatch):
+    scenario_name = scen_names(scenario_id)
     scenario_seeds = dict(
         loads=seed_for_loads,
         renewables=seed_for_res,
@@ -122,28 +459,16 @@ def generate_per_scenario(case, start_date, weeks, by_n_weeks, mode,
     )
     print('seeds for scenario: '+scenario_name)
     print(scenario_seeds)
-    
-    # dump scenario seeds
-    # noScenarioDirectoryHere=''
-    # generation_output_folder, kpi_output_folder = create_directory_tree(
-    #    case, start_date, output_folder, noScenarioDirectoryHere,
-    #    n_scenarios_sub_p, mode, warn_user=not ignore_warnings)
 
     scenario_path = os.path.join(generation_output_folder, scenario_name)
     print('scenarion_path: '+scenario_path)
     dump_seeds(scenario_path, scenario_seeds)
 
-    # go to generate chronics
-    generate_inner(
-        case, start_date, weeks, by_n_weeks, n_scenarios_sub_p, mode,
-        input_folder, kpi_output_folder, generation_output_folder,
-        scen_names, seed_for_loads, seed_for_res, seed_for_dispatch, scenario_id)
-    
 
 def generate_inner(case, start_date, weeks, by_n_weeks, n_scenarios, mode,
                    input_folder, kpi_output_folder, generation_output_folder,
                    scen_names, seed_for_loads, seed_for_res,
-                   seed_for_dispatch, scenario_id=None):
+                   seed_for_dispatch, scenario_id=None, cache_folder=None):
 
     ut.check_scenario(n_scenarios, scenario_id)
     time_parameters = gu.time_parameters(weeks, start_date)
@@ -156,15 +481,30 @@ def generate_inner(case, start_date, weeks, by_n_weeks, n_scenarios, mode,
     )
 
     year = time_parameters['year']
+    params, loads_charac, prods_charac = None, None, None
 
     # Chronic generation
     if 'L' in mode or 'R' in mode:
         params, loads_charac, prods_charac = gen.main(
             case, n_scenarios, generation_input_folder,
             generation_output_folder, scen_names, time_parameters,
-            mode, scenario_id, seed_for_loads, seed_for_res, seed_for_dispatch)
+            mode, scenario_id, seed_for_loads, seed_for_res, seed_for_dispatch,
+            cache_folder)
         scenario_name = scen_names(scenario_id)
-        if by_n_weeks is not None and 'T' in mode:
+        write_chunks(generation_output_folder, scenario_name, by_n_weeks,
+                     n_scenarios, weeks, start_date, params, mode)
+
+    # KPI formatting and computing
+    run_kpi_stage(mode, kpi_input_folder, generation_output_folder,
+                  scen_names, kpi_output_folder, year, case, n_scenarios,
+                  params, loads_charac, prods_charac, scenario_id,
+                  cache_folder)
+
+
+def write_chunks(generation_output_folder, scenario_name, by_n_weeks,
+                 n_scenarios, weeks, start_date, params, mode):
+    if by_n_weeks is not None and 'T' in mode:
+        with instr.record_stage(scenario_name, 'chunking'):
             output_processor_to_chunks(
                 generation_output_folder, scenario_name, by_n_weeks,
                 n_scenarios, weeks)
@@ -172,20 +512,66 @@ def generate_inner(case, start_date, weeks, by_n_weeks, n_scenarios, mode,
                 generation_output_folder, scenario_name, weeks, by_n_weeks,
                 n_scenarios, start_date, int(params['dt']))
 
-    # KPI formatting and computing
+
+def run_kpi_stage(mode, kpi_input_folder, generation_output_folder, scen_names,
+                  kpi_output_folder, year, case, n_scenarios, params,
+                  loads_charac, prods_charac, scenario_id, cache_folder=None):
     if 'R' in mode and 'K' in mode and 'T' not in mode:
         # Get and format solar and wind on all timescale, then compute KPI and save plots
         wind_solar_only = True
-        kpis.main(kpi_input_folder, generation_output_folder, scen_names,
-                  kpi_output_folder, year, case, n_scenarios, wind_solar_only,
-                  params, loads_charac, prods_charac, scenario_id)
+        compute_kpis(kpi_input_folder, generation_output_folder, scen_names,
+                     kpi_output_folder, year, case, n_scenarios,
+                     wind_solar_only, params, loads_charac, prods_charac,
+                     scenario_id, cache_folder)
 
     elif 'T' in mode and 'K' in mode:
         # Get and format dispatched chronics, then compute KPI and save plots
         wind_solar_only = False
+        compute_kpis(kpi_input_folder, generation_output_folder, scen_names,
+                     kpi_output_folder, year, case, n_scenarios,
+                     wind_solar_only, params, loads_charac, prods_charac,
+                     scenario_id, cache_folder)
+
+
+def compute_kpis(kpi_input_folder, generation_output_folder, scen_names,
+                 kpi_output_folder, year, case, n_scenarios, wind_solar_only,
+                 params, loads_charac, prods_charac, scenario_id,
+                 cache_folder=None):
+    scenario_name = scen_names(scenario_id) if n_scenarios == 1 else 'all'
+    with instr.record_stage(scenario_name, 'K'):
+        compute_cached_kpis(
+            kpi_input_folder, generation_output_folder, scen_names,
+            kpi_output_folder, year, case, n_scenarios, wind_solar_only,
+            params, loads_charac, prods_charac, scenario_id, cache_folder)
+
+
+def compute_cached_kpis(kpi_input_folder, generation_output_folder, scen_names,
+                        kpi_output_folder, year, case, n_scenarios,
+                        wind_solar_only, params, loads_charac, prods_charac,
+                        scenario_id, cache_folder=None):
+    # Imported here as the KPI pull in matplotlib and plotly, slow to import
+    # and not needed by the other stages
+    from chronix2grid.kpi import main as kpis
+
+    stage_cache = make_stage_cache(cache_folder)
+    if stage_cache is None or n_scenarios > 1:
         kpis.main(kpi_input_folder, generation_output_folder, scen_names,
                   kpi_output_folder, year, case, n_scenarios, wind_solar_only,
                   params, loads_charac, prods_charac, scenario_id)
+        return
+
+    scenario_name = scen_names(scenario_id)
+    key_inputs = (
+        hash_folder(os.path.join(generation_output_folder, scenario_name)),
+        hash_folder(os.path.join(kpi_input_folder, case)),
+        year, case, wind_solar_only, params, loads_charac, prods_charac)
+    run_cached_stage(
+        stage_cache, 'K', key_inputs,
+        os.path.join(kpi_output_folder, scenario_name), None,
+        lambda: kpis.main(kpi_input_folder, generation_output_folder,
+                          scen_names, kpi_output_folder, year, case,
+                          n_scenarios, wind_solar_only, params, loads_charac,
+                          prods_charac, scenario_id))
 
 
 def create_directory_tree(case, start_date, output_directory, scenario_name,
@@ -0,0 +1,137 @@
+"""
+Pipelined execution of the generation stages across scenarios.
+
+Each stage (e.g. loads and renewables generation, dispatch, KPI) has its own
+pool of worker processes, sized according to its cost. The items produced by
+a stage are handed over to the pool of the next stage as soon as they are
+ready, so that scenario i can be dispatched while scenario i+1 is generated
+and scenario i-1 is analysed. The number of items waiting for, or being
+processed by, each stage is bounded: an upstream stage is throttled when its
+downstream stage falls behind, which bounds the memory held by the items in
+flight.
+"""
+
+import multiprocessing
+import threading
+
+STAGE_NAMES = ['LR', 'T', 'K']
+
+
+def parse_stage_cores(stage_cores):
+    """
+    Parse a specification of the number of workers of each stage
+
+    Parameters
+    ----------
+    stage_cores: str
+        Comma separated assignments such as 'LR=4,T=2,K=1'. Stages not
+        mentioned get one worker
+
+    Returns
+    -------
+    dict
+        Number of workers of each stage of STAGE_NAMES
+    """
+    n_workers = {stage: 1 for stage in STAGE_NAMES}
+    for assignment in stage_cores.split(','):
+        if not assignment.strip():
+            continue
+        stage, _, value = assignment.partition('=')
+        stage = stage.strip().upper()
+        if stage not in STAGE_NAMES:
+            raise ValueError(f'Unknown stage {stage}, expected one of {STAGE_NAMES}')
+        try:
+            n_workers[stage] = int(value)
+        except ValueError:
+            raise ValueError(f'Invalid number of workers for stage {stage}: {value}')
+        if n_workers[stage] < 1:
+            raise ValueError(f'Stage {stage} needs at least one worker')
+    return n_workers
+
+
+class StagePipeline:
+    """
+    Chain of process pools, one per stage
+
+    Parameters
+    ----------
+    stages: list
+        (name, function, n_workers) for each stage, in order. function must be
+        picklable, takes one item and returns the list of items to hand over
+        to the next stage (the return of the last stage is ignored)
+    queue_size: int
+        Maximum number of items waiting for a free worker of each stage
+    pool_kwargs: dict or None
+        Keyword arguments of the pools, e.g. an initializer of the workers
+    """
+    def __init__(self, stages, queue_size=2, pool_kwargs=None):
+        if queue_size < 1:
+            raise ValueError('queue_size must be at least 1')
+        self.stages = stages
+        self.queue_size = queue_size
+        self.pool_kwargs = pool_kwargs or {}
+
+    def run(self, items):
+        """
+        Push items through all the stages and wait until they are processed.
+        The first exception raised by a stage is raised again here, after
+        the pools have been terminated
+        """
+        pools = [multiprocessing.Pool(n_workers, **self.pool_kwargs)
+                 for _, _, n_workers in self.stages]
+        slots = [threading.BoundedSemaphore(n_workers + self.queue_size)
+                 for _, _, n_workers in self.stages]
+        pending = [0]
+        errors = []
+        condition = threading.Condition()
+
+        def submit(k, item):
+            slots[k].acquire()
+            with condition:
+                if errors:
+                    slots[k].release()
+                    return
+                pending[0] += 1
+            pools[k].apply_async(
+                self.stages[k][1], (item,),
+                callback=lambda results: on_result(k, results),
+                error_callback=lambda error: on_error(k, error))
+
+        def on_result(k, results):
+            # Runs in the result handler thread of pool k: blocking there
+            # while the next stage is full throttles stage k
+            if k + 1 < len(self.stages):
+                for result in results:
+                    submit(k + 1, result)
+            finish(k)
+
+        def on_error(k, error):
+            with condition:
+                errors.append((self.stages[k][0], error))
+            finish(k)
+
+        def finish(k):
+            slots[k].release()
+            with condition:
+                pending[0] -= 1
+                condition.notify_all()
+
+        try:
+            for item in items:
+                if errors:
+                    break
+                submit(0, item)
+            with condition:
+                condition.wait_for(lambda: pending[0] == 0)
+        finally:
+            for pool in pools:
+                if errors:
+                    pool.terminate()
+                else:
+                    pool.close()
+                pool.join()
+
+        if errors:
+            stage_name, error = errors[0]
+            print(f'Stage {stage_name} failed')
+            raise error
@@ -0,0 +1,324 @@
+"""
+Planning of generation runs.
+
+Before launching a run, plan estimates its wall time, the peak memory of each
+worker, the size of its outputs and the number of OPF windows of the
+dispatch, from the sizes of the case and a cost model, and recommends a
+number of cores and a chunk size.
+
+The cost model gives, for each stage, the time per scenario as an affine
+function of the number of values (series x time steps) the stage handles,
+plus a time per OPF window for the dispatch. DEFAULT_COST_MODEL holds rough
+values, a model calibrated on the machine running the generation is written
+by `chronix2grid-benchmark calibrate` (see chronix2grid.benchmark.calibration).
+"""
+
+import json
+import math
+import os
+
+import pandas as pd
+
+from . import constants as cst
+from .generation.dispatch.utils import iso_week
+from .worker_resources import available_cpus
+
+# L, R, memory and output sizes were calibrated on synthetic cases of 118 and
+# 1000 nodes on a single core VM, T and K are rough values for case118
+DEFAULT_COST_MODEL = {
+    # Seconds per scenario: seconds + seconds_per_value * values of the stage,
+    # plus seconds_per_window * OPF windows for the dispatch
+    'stages': {
+        'L': dict(seconds=0., seconds_per_value=8.6e-6),
+        'R': dict(seconds=0., seconds_per_value=1.4e-5),
+        'T': dict(seconds=5., seconds_per_value=2.e-6, seconds_per_window=2.),
+        'K': dict(seconds=15., seconds_per_value=1.e-6),
+    },
+    # Peak memory of a worker: base_rss_mb + mb_per_value * values of a scenario
+    'base_rss_mb': 100.,
+    'mb_per_value': 3.2e-5,
+    # Bytes per value of the output files
+    'bytes_per_value': {'csv': 5.3, 'bz2': 1.2},
+    # Efficiency of the workers when they all run at the same time
+    'parallel_efficiency': 0.9,
+}
+# Size in memory of a chunk read by grid2op, used to recommend a chunk size
+CHUNK_TARGET_MB = 32.
+# Share of the available memory the workers may use
+MEMORY_SHARE = 0.8
+BYTES_PER_FLOAT = 8
+
+
+def read_cost_model(path=None):
+    """Cost model of a JSON file, completed with DEFAULT_COST_MODEL"""
+    cost_model = json.loads(json.dumps(DEFAULT_COST_MODEL))
+    if path is None:
+        return cost_model
+    with open(path) as f:
+        calibrated = json.load(f)
+    for stage, coefficients in calibrated.get('stages', {}).items():
+        cost_model['stages'].setdefault(stage, {}).update(coefficients)
+    cost_model['bytes_per_value'].update(calibrated.get('bytes_per_value', {}))
+    for key in ['base_rss_mb', 'mb_per_value', 'parallel_efficiency']:
+        if calibrated.get(key) is not None:
+            cost_model[key] = calibrated[key]
+    return cost_model
+
+
+def case_sizes(input_folder, case):
+    """
+    Sizes of a case: numbers of loads and generators of each type, time step
+    and OPF parameters
+
+    Parameters
+    ----------
+    input_folder: str
+        Input folder of chronix2grid (containing generation/case)
+    case: str
+        Name of the case
+    """
+    case_folder = os.path.join(input_folder, cst.GENERATION_FOLDER_NAME, case)
+    loads_charac = pd.read_csv(os.path.join(case_folder, 'loads_charac.csv'))
+    prods_charac = pd.read_csv(os.path.join(case_folder, 'prods_charac.csv'))
+    with open(os.path.join(case_folder, 'params.json')) as f:
+        params = json.load(f)
+    params_opf = {}
+    params_opf_path = os.path.join(case_folder, 'params_opf.json')
+    if os.path.exists(params_opf_path):
+        with open(params_opf_path) as f:
+            params_opf = json.load(f)
+    gen_types = prods_charac['type'].value_counts()
+    return dict(
+        n_loads=len(loads_charac), n_prods=len(prods_charac),
+        n_solar=int(gen_types.get('solar', 0)),
+        n_wind=int(gen_types.get('wind', 0)),
+        dt=int(float(params['dt'])),
+        mode_opf=params_opf.get('mode_opf') or None,
+        step_opf_min=int(params_opf.get('step_opf_min', 5)))
+
+
+def n_time_steps(weeks, dt):
+    return int(weeks * 7 * 24 * 60 // dt)
+
+
+def count_opf_windows(start_date, weeks, mode_opf, step_opf_min=5):
+    """
+    Number of OPF problems solved by the dispatch of a scenario: as in
+    run_economic_dispatch, the horizon is split by month, then each month by
+    day (of the month), week or month according to mode_opf. The whole
+    horizon is a single problem if mode_opf is None
+    """
+    if mode_opf is None:
+        return 1
+    snapshots = pd.date_range(start=start_date, periods=n_time_steps(weeks, 5),
+                              freq='5min')[::max(step_opf_min // 5, 1)]
+    attribute = dict(day=snapshots.day, week=iso_week(snapshots),
+                     month=snapshots.month)[mode_opf.lower()]
+    return len(set(zip(snapshots.month, attribute)))
+
+
+def stage_values(sizes, weeks, mode):
+    """Number of values (series x time steps) handled by each stage of a scenario"""
+    n_steps = n_time_steps(weeks, sizes['dt'])
+    n_opf_steps = n_time_steps(weeks, sizes['step_opf_min'])
+    values = {}
+    if 'L' in mode:
+        values['L'] = sizes['n_loads'] * n_steps
+    if 'R' in mode:
+        values['R'] = (sizes['n_solar'] + sizes['n_wind']) * n_steps
+    if 'T' in mode:
+        values['T'] = sizes['n_prods'] * n_opf_steps
+    if 'K' in mode:
+        values['K'] = (sizes['n_loads'] + sizes['n_prods']) * n_steps
+    return values
+
+
+def written_values(sizes, weeks, mode):
+    """Number of values written in the output files of a scenario"""
+    n_steps = n_time_steps(weeks, sizes['dt'])
+    n_res = sizes['n_solar'] + sizes['n_wind']
+    n_series = 0
+    if 'L' in mode:
+        # load_p, load_q and their forecasts
+        n_series += 4 * sizes['n_loads']
+    if 'R' in mode:
+        # solar_p, wind_p and their forecasts
+        n_series += 2 * n_res
+    if 'T' in mode:
+        # prod_p and its forecast with all generators, prices
+        n_series += 2 * sizes['n_prods'] + 1
+    elif 'R' in mode:
+        # prod_p and prod_v of renewables
+        n_series += 2 * n_res
+    return n_series * n_steps
+
+
+def estimate(sizes, weeks, n_scenarios, mode, by_n_weeks, nb_core,
+             start_date='2012-01-01', cost_model=None):
+    """
+    Estimate the wall time, peak memory per worker, output size and OPF
+    windows of a run
+
+    Parameters
+    ----------
+    sizes: dict
+        As returned by case_sizes
+    weeks, n_scenarios, mode, by_n_weeks, nb_core, start_date:
+        As the options of the chronix2grid command
+    cost_model: dict or None
+        As returned by read_cost_model, DEFAULT_COST_MODEL if None
+
+    Returns
+    -------
+    dict
+    """
+    cost_model = cost_model or DEFAULT_COST_MODEL
+    values = stage_values(sizes, weeks, mode)
+    n_windows = (count_opf_windows(start_date, weeks, sizes['mode_opf'],
+                                   sizes['step_opf_min'])
+                 if 'T' in mode else 0)
+    stage_seconds = {}
+    for stage, n_values in values.items():
+        coefficients = cost_model['stages'][stage]
+        stage_seconds[stage] = (
+            coefficients.get('seconds', 0.)
+            + coefficients.get('seconds_per_value', 0.) * n_values
+            + coefficients.get('seconds_per_window', 0.) * (n_windows if stage == 'T' else 0))
+    scenario_seconds = sum(stage_seconds.values())
+    nb_core = max(min(nb_core, n_scenarios), 1)
+    efficiency = cost_model['parallel_efficiency'] if nb_core > 1 else 1.
+    wall_time = math.ceil(n_scenarios / nb_core) * scenario_seconds / efficiency
+
+    n_steps = n_time_steps(weeks, sizes['dt'])
+    peak_rss_mb = cost_model['base_rss_mb'] + cost_model['mb_per_value'] * (
+        sizes['n_loads'] + sizes['n_prods']) * n_steps
+
+    scenario_values = written_values(sizes, weeks, mode)
+    # Chunks are a copy of the scenario files, written as uncompressed csv
+    chunked = 'T' in mode and by_n_weeks is not None and weeks > by_n_weeks
+    output_bytes = {}
+    for codec, bytes_per_value in cost_model['bytes_per_value'].items():
+        scenario_bytes = scenario_values * bytes_per_value
+        if chunked:
+            scenario_bytes += scenario_values * cost_model['bytes_per_value']['csv']
+        output_bytes[codec] = n_scenarios * scenario_bytes
+
+    return dict(
+        n_time_steps=n_steps, n_opf_windows=n_windows,
+        stage_seconds_per_scenario=stage_seconds,
+        scenario_seconds=scenario_seconds, wall_time=wall_time,
+        nb_core=nb_core, peak_rss_mb_per_worker=peak_rss_mb,
+        total_peak_rss_mb=nb_core * peak_rss_mb, output_bytes=output_bytes,
+        n_chunks=math.ceil(weeks / by_n_weeks) if chunked else 0)
+
+
+def available_memory_mb():
+    """Memory available on the machine in MB, None if unknown (Linux only)"""
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def recommend_nb_core(n_scenarios, peak_rss_mb, n_cpus=None, memory_mb=None):
+    """
+    Largest number of workers that the CPUs and the memory allow, reduced to
+    the fewest workers running the scenarios in the same number of rounds
+    """
+    n_cpus = n_cpus or len(available_cpus())
+    nb_core = min(n_cpus, n_scenarios)
+    if memory_mb is not None:
+        nb_core = min(nb_core, int(MEMORY_SHARE * memory_mb // peak_rss_mb))
+    nb_core = max(nb_core, 1)
+    n_rounds = math.ceil(n_scenarios / nb_core)
+    return math.ceil(n_scenarios / n_rounds)
+
+
+def recommend_chunk_weeks(sizes, weeks):
+    """Largest number of weeks whose chunk stays under CHUNK_TARGET_MB in memory"""
+    week_mb = ((sizes['n_loads'] + sizes['n_prods']) * n_time_steps(1, sizes['dt'])
+               * BYTES_PER_FLOAT / 1024 ** 2)
+    return int(max(min(weeks, CHUNK_TARGET_MB // week_mb), 1))
+
+
+def plan_run(input_folder, case, weeks, n_scenarios, mode, by_n_weeks, nb_core,
+             start_date='2012-01-01', cost_model_path=None, memory_mb=None):
+    """
+    Estimate a run and recommend nb_core and by_n_weeks
+
+    Returns
+    -------
+    dict
+        The sizes of the case, the estimates of the run as given, the
+        recommendations and the estimates of the run with them
+    """
+    cost_model = read_cost_model(cost_model_path)
+    sizes = case_sizes(input_folder, case)
+    memory_mb = memory_mb or available_memory_mb()
+    run = estimate(sizes, weeks, n_scenarios, mode, by_n_weeks, nb_core,
+                   start_date, cost_model)
+    recommended = dict(
+        nb_core=recommend_nb_core(n_scenarios, run['peak_rss_mb_per_worker'],
+                                  memory_mb=memory_mb),
+        by_n_weeks=recommend_chunk_weeks(sizes, weeks))
+    return dict(sizes=sizes, memory_mb=memory_mb, n_cpus=len(available_cpus()),
+                cost_model=cost_model_path or 'default', estimate=run,
+                recommended=recommended,
+                recommended_estimate=estimate(
+                    sizes, weeks, n_scenarios, mode, recommended['by_n_weeks'],
+                    recommended['nb_core'], start_date, cost_model))
+
+
+def _format_duration(seconds):
+    hours, remainder = divmod(int(round(seconds)), 3600)
+    minutes, seconds = divmod(remainder, 60)
+    return f'{hours}h{minutes:02d}m{seconds:02d}s'
+
+
+def _format_bytes(n_bytes):
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if n_bytes < 1024:
+            return f'{n_bytes:.1f} {unit}'
+        n_bytes /= 1024
+    return f'{n_bytes:.1f} TB'
+
+
+def format_plan(plan):
+    """Human readable report of a plan"""
+    sizes, run = plan['sizes'], plan['estimate']
+    recommended, recommended_run = plan['recommended'], plan['recommended_estimate']
+    lines = [
+        'Case: {n_loads} loads, {n_prods} generators ({n_solar} solar, {n_wind} wind), '
+        'time step {dt} min'.format(**sizes),
+        'Machine: {} CPUs, {} MB of memory available'.format(
+            plan['n_cpus'], 'unknown' if plan['memory_mb'] is None
+            else int(plan['memory_mb'])),
+        'Cost model: ' + plan['cost_model'],
+        '',
+        'Time steps per scenario: {}'.format(run['n_time_steps']),
+        'OPF windows per scenario: {} (mode_opf={}, step_opf_min={})'.format(
+            run['n_opf_windows'], sizes['mode_opf'], sizes['step_opf_min']),
+        'Time per scenario: {} ({})'.format(
+            _format_duration(run['scenario_seconds']),
+            ', '.join('{} {}'.format(stage, _format_duration(seconds))
+                      for stage, seconds in run['stage_seconds_per_scenario'].items())),
+        'Wall time with {} cores: {}'.format(run['nb_core'],
+                                             _format_duration(run['wall_time'])),
+        'Peak memory per worker: {:.0f} MB ({:.0f} MB for all workers)'.format(
+            run['peak_rss_mb_per_worker'], run['total_peak_rss_mb']),
+        'Output size: ' + ', '.join(
+            '{} {}'.format(codec, _format_bytes(n_bytes))
+            for codec, n_bytes in run['output_bytes'].items()),
+        '',
+        'Recommended: --nb_core {} --by-n-weeks {} (wall time {}, {:.0f} MB for all workers)'.format(
+            recommended['nb_core'], recommended['by_n_weeks'],
+            _format_duration(recommended_run['wall_time']),
+            recommended_run['total_peak_rss_mb']),
+    ]
+    if plan['memory_mb'] is not None and run['total_peak_rss_mb'] > plan['memory_mb']:
+        lines.append('WARNING: the workers need more memory than available')
+    return '\n'.join(lines)
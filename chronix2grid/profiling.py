@@ -0,0 +1,170 @@
+"""
+Profiling of the generation workers.
+
+Each scenario (or batch of scenarios, or stage of a scenario when stages are
+pipelined) is profiled in the worker process running it, and its profile is
+written to profile_folder/<name>.prof. Two modes are available:
+
+- cprofile: deterministic profiling with cProfile
+- sampling: the stack of the worker is sampled at a fixed interval by a
+  background thread. This has a much lower overhead on code making many
+  small python calls, at the cost of statistical timings
+
+Both modes write files readable by pstats, so that merge_profiles can merge
+the profiles of all scenarios into a single ranked report.
+"""
+
+import cProfile
+import marshal
+import os
+import pstats
+import sys
+import threading
+from collections import Counter, namedtuple
+from contextlib import contextmanager
+
+PROFILE_MODES = ['cprofile', 'sampling']
+MERGED_PROFILE_FILE_NAME = 'merged.prof'
+REPORT_FILE_NAME = 'report.txt'
+
+ProfileSettings = namedtuple('ProfileSettings', ['folder', 'mode', 'interval'])
+
+
+@contextmanager
+def profile(settings, name):
+    """
+    Profile the block and write its profile in settings.folder/name.prof
+
+    Parameters
+    ----------
+    settings: ProfileSettings or None
+        Where and how to profile. Nothing is done if None
+    name: str
+        Name of the profile, e.g. the name of the scenario
+    """
+    if settings is None:
+        yield
+        return
+    os.makedirs(settings.folder, exist_ok=True)
+    path = os.path.join(settings.folder, name + '.prof')
+    if settings.mode == 'cprofile':
+        profiler = cProfile.Profile()
+    elif settings.mode == 'sampling':
+        profiler = SamplingProfiler(settings.interval)
+    else:
+        raise ValueError(f'Unknown profile mode {settings.mode}, expected one of {PROFILE_MODES}')
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
+
+
+def _function_key(code):
+    return code.co_filename, code.co_firstlineno, code.co_name
+
+
+class SamplingProfiler:
+    """
+    Statistical profiler sampling the stack of the thread that enables it
+
+    Parameters
+    ----------
+    interval: float
+        Time between two samples, in seconds
+    """
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.n_samples = 0
+        self.self_counts = Counter()
+        self.cumulative_counts = Counter()
+        self.call_counts = Counter()
+        self._thread_id = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    def enable(self):
+        self._thread_id = threading.get_ident()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def disable(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is not None:
+                self.sample(frame)
+
+    def sample(self, frame):
+        """Record the stack ending at frame, innermost function first"""
+        stack = []
+        while frame is not None:
+            stack.append(_function_key(frame.f_code))
+            frame = frame.f_back
+        self.n_samples += 1
+        self.self_counts[stack[0]] += 1
+        # Recursive functions are counted once per sample
+        self.cumulative_counts.update(set(stack))
+        self.call_counts.update(set(zip(stack[1:], stack[:-1])))
+
+    def stats(self):
+        """
+        The samples in the format of pstats: for each function, (number of
+        samples, number of samples, self time, cumulative time, callers)
+        """
+        callers = {}
+        for (caller, callee), count in self.call_counts.items():
+            time = count * self.interval
+            callers.setdefault(callee, {})[caller] = (count, count, time, time)
+        return {
+            function: (count, count,
+                       self.self_counts[function] * self.interval,
+                       count * self.interval, callers.get(function, {}))
+            for function, count in self.cumulative_counts.items()
+        }
+
+    def dump_stats(self, path):
+        with open(path, 'wb') as f:
+            marshal.dump(self.stats(), f)
+
+
+def merge_profiles(profile_folder, n_lines=40):
+    """
+    Merge the profiles of a folder into merged.prof and write a report ranked
+    by cumulative and by own time in report.txt
+
+    Returns
+    -------
+    str or None
+        Path of the report, None if no profile was found
+    """
+    paths = sorted(
+        os.path.join(profile_folder, file_name)
+        for file_name in os.listdir(profile_folder)
+        if file_name.endswith('.prof') and file_name != MERGED_PROFILE_FILE_NAME)
+    if not paths:
+        return None
+    report_path = os.path.join(profile_folder, REPORT_FILE_NAME)
+    with open(report_path, 'w') as report:
+        stats = pstats.Stats(*paths, stream=report)
+        stats.dump_stats(os.path.join(profile_folder, MERGED_PROFILE_FILE_NAME))
+        report.write(f'Merged profiles of {len(paths)} scenarios\n')
+        stats.strip_dirs()
+        for sort_key in ['cumulative', 'tottime']:
+            report.write(f'\n===== Sorted by {sort_key} =====\n')
+            stats.sort_stats(sort_key).print_stats(n_lines)
+    return report_path
+
+
+def clear_profiles(profile_folder):
+    """Remove the profiles left in a folder by a previous run"""
+    if not os.path.isdir(profile_folder):
+        return
+    for file_name in os.listdir(profile_folder):
+        if file_name.endswith('.prof') or file_name == REPORT_FILE_NAME:
+            os.remove(os.path.join(profile_folder, file_name))
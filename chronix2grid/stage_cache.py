@@ -0,0 +1,373 @@
+"""
+Content-addressed cache for the outputs of the generation stages (L, R, T, K).
+
+Each stage output is stored under a hash of everything that determines it
+(seed, parameters, characteristics, upstream outputs...). When a scenario is
+run again with the same inputs for a stage, the files written by this stage
+are copied back to the scenario folder and the objects it returned are
+restored without computing anything.
+"""
+
+import hashlib
+import os
+import pickle
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from . import instrumentation as instr
+
+RESULTS_FILE_NAME = 'results.pkl'
+FILES_FOLDER_NAME = 'files'
+
+
+def _update_hash(hasher, obj):
+    """
+    Feed a python object into a hashlib hasher in a deterministic way
+
+    Parameters
+    ----------
+    hasher: hashlib hash object
+        The hasher to update
+    obj: object
+        Any combination of dict, list, tuple, numpy.ndarray, pandas.DataFrame,
+        pandas.Series and scalars
+    """
+    hasher.update(type(obj).__name__.encode())
+    if isinstance(obj, (pd.DataFrame, pd.Series)):
+        hasher.update(repr(obj.shape).encode())
+        if isinstance(obj, pd.DataFrame):
+            hasher.update(repr(list(obj.columns)).encode())
+        hasher.update(
+            pd.util.hash_pandas_object(obj, index=True).values.tobytes())
+    elif isinstance(obj, np.ndarray):
+        hasher.update(str(obj.dtype).encode())
+        hasher.update(repr(obj.shape).encode())
+        hasher.update(np.ascontiguousarray(obj).tobytes())
+    elif isinstance(obj, dict):
+        for key in sorted(obj, key=str):
+            _update_hash(hasher, str(key))
+            _update_hash(hasher, obj[key])
+    elif isinstance(obj, (list, tuple)):
+        hasher.update(str(len(obj)).encode())
+        for item in obj:
+            _update_hash(hasher, item)
+    elif isinstance(obj, bytes):
+        hasher.update(obj)
+    else:
+        hasher.update(repr(obj).encode())
+
+
+def hash_inputs(*inputs):
+    """
+    Compute the hex digest of a sequence of python objects
+
+    Returns
+    -------
+    str
+        The sha256 hex digest of the inputs
+    """
+    hasher = hashlib.sha256()
+    for obj in inputs:
+        _update_hash(hasher, obj)
+    return hasher.hexdigest()
+
+
+def hash_file(file_path):
+    """
+    Compute the hex digest of the content of a file, or of None if the file
+    does not exist
+    """
+    hasher = hashlib.sha256()
+    if not os.path.isfile(file_path):
+        _update_hash(hasher, None)
+        return hasher.hexdigest()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+def hash_folder(folder_path):
+    """
+    Compute the hex digest of all the files found (recursively) in a folder,
+    taking their relative paths into account
+    """
+    hasher = hashlib.sha256()
+    for relative_path in list_files(folder_path):
+        hasher.update(relative_path.encode())
+        hasher.update(
+            hash_file(os.path.join(folder_path, relative_path)).encode())
+    return hasher.hexdigest()
+
+
+def list_files(folder_path):
+    """Sorted relative paths of all the files found recursively in a folder"""
+    relative_paths = []
+    for root, _, file_names in os.walk(folder_path):
+        for file_name in file_names:
+            relative_paths.append(os.path.relpath(
+                os.path.join(root, file_name), folder_path))
+    return sorted(relative_paths)
+
+
+class StageCache:
+    """
+    On-disk cache of stage outputs, organised as
+    cache_folder/stage/key/{results.pkl, files/...}
+
+    Parameters
+    ----------
+    cache_folder: str
+        Root directory of the cache. It is created if it does not exist
+    """
+    def __init__(self, cache_folder):
+        self.cache_folder = cache_folder
+        os.makedirs(cache_folder, exist_ok=True)
+
+    def key(self, stage, *inputs):
+        return hash_inputs(stage, *inputs)
+
+    def entry_path(self, stage, key):
+        return os.path.join(self.cache_folder, stage, key)
+
+    def contains(self, stage, key):
+        return os.path.isfile(
+            os.path.join(self.entry_path(stage, key), RESULTS_FILE_NAME))
+
+    def store(self, stage, key, results, source_folder, file_names=None,
+              random_state=None):
+        """
+        Store the outputs of a stage
+
+        Parameters
+        ----------
+        stage: str
+            Name of the stage (L, R, T or K)
+        key: str
+            Hash of the stage inputs, as returned by StageCache.key
+        results: object
+            Picklable objects returned by the stage
+        source_folder: str
+            Folder in which the stage wrote its files
+        file_names: list or None
+            Names (relative to source_folder) of the files written by the
+            stage. If None, every file found in source_folder is stored
+        random_state: numpy.random.RandomState or None
+            Random stream used by the stage, whose state is stored with the
+            outputs. The global numpy random state is used if None
+        """
+        if random_state is None:
+            random_state = np.random
+        if file_names is None:
+            file_names = list_files(source_folder)
+        stage_folder = os.path.join(self.cache_folder, stage)
+        os.makedirs(stage_folder, exist_ok=True)
+        # Entries are built in a temporary folder and then renamed, so that
+        # concurrent workers never see a partially written entry
+        tmp_folder = tempfile.mkdtemp(dir=stage_folder)
+        for file_name in file_names:
+            source_path = os.path.join(source_folder, file_name)
+            if not os.path.isfile(source_path):
+                continue
+            destination_path = os.path.join(tmp_folder, FILES_FOLDER_NAME, file_name)
+            os.makedirs(os.path.dirname(destination_path), exist_ok=True)
+            shutil.copy2(source_path, destination_path)
+        with open(os.path.join(tmp_folder, RESULTS_FILE_NAME), 'wb') as f:
+            pickle.dump({'results': results,
+                         'random_state': random_state.get_state()}, f)
+        try:
+            os.rename(tmp_folder, self.entry_path(stage, key))
+        except OSError:
+            # Another worker stored the same entry in the meantime
+            shutil.rmtree(tmp_folder, ignore_errors=True)
+
+    def restore(self, stage, key, destination_folder, random_state=None):
+        """
+        Copy the files of a cached stage into destination_folder, restore the
+        random state (the global numpy one if random_state is None) as it was
+        at the end of the stage and return the objects the stage returned
+        """
+        if random_state is None:
+            random_state = np.random
+        entry_path = self.entry_path(stage, key)
+        files_folder = os.path.join(entry_path, FILES_FOLDER_NAME)
+        for file_name in list_files(files_folder):
+            destination_path = os.path.join(destination_folder, file_name)
+            os.makedirs(os.path.dirname(destination_path), exist_ok=True)
+            shutil.copy2(os.path.join(files_folder, file_name), destination_path)
+        with open(os.path.join(entry_path, RESULTS_FILE_NAME), 'rb') as f:
+            entry = pickle.load(f)
+        random_state.set_state(entry['random_state'])
+        return entry['results']
+
+
+def run_cached_stage(stage_cache, stage, key_inputs, folder, file_names,
+                     stage_function):
+    """
+    Run stage_function, or restore its outputs from stage_cache if a stage
+    with the same inputs has already been computed
+
+    Parameters
+    ----------
+    stage_cache: StageCache or None
+        The cache to use. If None, stage_function is simply called
+    stage: str
+        Name of the stage (L, R, T or K)
+    key_inputs: tuple
+        Every input that determines the outputs of the stage
+    folder: str
+        Folder in which the stage writes its files
+    file_names: list or None
+        Files written by the stage in folder (None for all files of folder)
+    stage_function: callable
+        Function without arguments running the stage
+
+    Returns
+    -------
+    object
+        What stage_function returns
+    """
+    if stage_cache is None:
+        return stage_function()
+    key = stage_cache.key(stage, *key_inputs)
+    if stage_cache.contains(stage, key):
+        print(f'Restoring outputs of stage {stage} from cache ({key[:12]})')
+        with instr.timed('cache restore'):
+            return stage_cache.restore(stage, key, folder)
+    results = stage_function()
+    stage_cache.store(stage, key, results, folder, file_names)
+    return results
+
+
+def run_cached_batch_stage(stage_cache, stage, key_inputs, folders, file_names,
+                           random_states, batch_function):
+    """
+    Batch version of run_cached_stage: scenarios whose outputs are in the cache
+    are restored, and the others are computed together by batch_function
+
+    Parameters
+    ----------
+    stage_cache: StageCache or None
+        The cache to use. If None, every scenario is computed
+    stage: str
+        Name of the stage (L, R, T or K)
+    key_inputs: list
+        For each scenario, every input that determines its outputs
+    folders: list
+        For each scenario, folder in which the stage writes its files
+    file_names: list or None
+        Files written by the stage in each folder (None for all files)
+    random_states: list
+        For each scenario, the numpy.random.RandomState used by the stage
+    batch_function: callable
+        Function computing the stage for a list of indices of scenarios and
+        returning the list of their results
+
+    Returns
+    -------
+    list
+        The results of the stage for each scenario
+    """
+    results = [None] * len(folders)
+    missing = list(range(len(folders)))
+    if stage_cache is not None:
+        keys = [stage_cache.key(stage, *inputs) for inputs in key_inputs]
+        missing = []
+        for i, key in enumerate(keys):
+            if stage_cache.contains(stage, key):
+                print(f'Restoring outputs of stage {stage} from cache ({key[:12]})')
+                with instr.timed('cache restore'):
+                    results[i] = stage_cache.restore(stage, key, folders[i],
+                                                     random_states[i])
+            else:
+                missing.append(i)
+    if missing:
+        for i, result in zip(missing, batch_function(missing)):
+            results[i] = result
+            if stage_cache is not None:
+                stage_cache.store(stage, keys[i], result, folders[i],
+                                  file_names, random_states[i])
+    return results
+
+
+class BoundedCache:
+    """
+    On-disk cache of picklable objects, one file per key in cache_folder,
+    holding at most max_entries entries and max_mb megabytes. When it is
+    full, the least recently used entries are removed
+
+    Parameters
+    ----------
+    cache_folder: str
+        Directory of the entries. It is created if it does not exist
+    max_entries: int or None
+        Maximum number of entries, unbounded if None
+    max_mb: float or None
+        Maximum total size of the entries in MB, unbounded if None
+    """
+    def __init__(self, cache_folder, max_entries=None, max_mb=None):
+        self.cache_folder = cache_folder
+        self.max_entries = max_entries
+        self.max_mb = max_mb
+        os.makedirs(cache_folder, exist_ok=True)
+
+    def entry_path(self, key):
+        return os.path.join(self.cache_folder, key + '.pkl')
+
+    def get(self, key):
+        """The object stored under key, or None if there is none"""
+        entry_path = self.entry_path(key)
+        try:
+            with open(entry_path, 'rb') as f:
+                value = pickle.load(f)
+            # Marks the entry as recently used
+            os.utime(entry_path)
+        except FileNotFoundError:
+            # Missing, or removed by another worker in the meantime
+            return None
+        return value
+
+    def put(self, key, value):
+        """Store value under key, removing old entries if the cache is full"""
+        # Written in a temporary file and then renamed, so that concurrent
+        # workers never read a partially written entry
+        file_descriptor, tmp_path = tempfile.mkstemp(dir=self.cache_folder,
+                                                     suffix='.tmp')
+        with os.fdopen(file_descriptor, 'wb') as f:
+            pickle.dump(value, f)
+        os.replace(tmp_path, self.entry_path(key))
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries exceeding the bounds"""
+        entries = []
+        for file_name in os.listdir(self.cache_folder):
+            if not file_name.endswith('.pkl'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.cache_folder, file_name))
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, file_name))
+        entries.sort(reverse=True)
+        n_entries, total_bytes = 0, 0
+        for _, size, file_name in entries:
+            n_entries += 1
+            total_bytes += size
+            if ((self.max_entries is not None and n_entries > self.max_entries)
+                    or (self.max_mb is not None
+                        and total_bytes > self.max_mb * 1e6 and n_entries > 1)):
+                try:
+                    os.remove(os.path.join(self.cache_folder, file_name))
+                except FileNotFoundError:
+                    pass
+
+
+def make_stage_cache(cache_folder):
+    """Build a StageCache, or return None if caching is disabled"""
+    if cache_folder is None:
+        return None
+    return StageCache(cache_folder)
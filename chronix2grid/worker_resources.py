@@ -0,0 +1,183 @@
+"""
+Resource policy of the worker processes.
+
+Each worker process of the generation may start its own pool of BLAS threads
+(numpy, scipy) and the LP solver of the dispatch may start more threads. With
+many workers, this runs many more threads than the machine has cores. The
+policy caps, in every worker, the number of BLAS threads and of solver
+threads, and can pin each worker to its own set of cores. By default, the
+CPUs available to the process are shared evenly among the workers, so that
+the total number of threads matches the hardware.
+
+BLAS threads are capped with threadpoolctl when it is installed, which also
+works for libraries loaded before the worker started. The corresponding
+environment variables are always set, for libraries loaded later and for
+solver subprocesses.
+"""
+
+import multiprocessing
+import os
+from collections import namedtuple
+
+THREADS_ENV_VARIABLES = ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS',
+                         'MKL_NUM_THREADS', 'NUMEXPR_NUM_THREADS',
+                         'VECLIB_MAXIMUM_THREADS']
+# Option setting the number of threads of each solver, glpk being single
+# threaded
+SOLVER_THREADS_OPTIONS = {'cbc': 'threads', 'gurobi': 'Threads',
+                          'cplex': 'threads', 'highs': 'threads'}
+# Solvers pypsa runs as a command without pyomo, their options being given as
+# a string appended to the command line
+COMMAND_LINE_SOLVERS = ['cbc', 'glpk']
+# Option of HiGHS, solving the native and persistent LP dispatch
+HIGHS_THREADS_OPTION = 'threads'
+
+WorkerResources = namedtuple('WorkerResources', [
+    'n_workers', 'blas_threads', 'solver_threads', 'pin_workers'])
+
+# Resources of the current worker process, None outside of a worker
+_state = dict(resources=None)
+
+
+def available_cpus():
+    """CPUs the current process may run on"""
+    try:
+        return sorted(os.sched_getaffinity(0))
+    except AttributeError:  # Not available on macOS and Windows
+        return list(range(os.cpu_count() or 1))
+
+
+def make_worker_resources(n_workers, blas_threads=None, solver_threads=None,
+                          pin_workers=False, params_opf=None):
+    """
+    Resource policy of n_workers workers. Values given as arguments (from
+    the command line) take precedence over the ones of params_opf, and the
+    numbers of threads default to the CPUs available divided by n_workers
+
+    Parameters
+    ----------
+    n_workers: int
+        Total number of worker processes
+    blas_threads: int or None
+        Maximum number of BLAS threads per worker
+    solver_threads: int or None
+        Number of threads of the LP solver of each worker
+    pin_workers: bool
+        Pin each worker to its own set of cores
+    params_opf: dict or None
+        Content of params_opf.json, which may define blas_threads,
+        solver_threads and pin_workers
+
+    Returns
+    -------
+    WorkerResources
+    """
+    params_opf = params_opf or {}
+    n_workers = max(n_workers, 1)
+    share = max(len(available_cpus()) // n_workers, 1)
+    return WorkerResources(
+        n_workers=n_workers,
+        blas_threads=int(blas_threads or params_opf.get('blas_threads') or share),
+        solver_threads=int(solver_threads or params_opf.get('solver_threads') or share),
+        pin_workers=bool(pin_workers or params_opf.get('pin_workers', False)))
+
+
+def threads_env(resources):
+    return {name: str(resources.blas_threads) for name in THREADS_ENV_VARIABLES}
+
+
+def worker_cpus(worker_index, resources, cpus=None):
+    """CPUs a worker is pinned to: consecutive blocks of blas_threads CPUs"""
+    cpus = available_cpus() if cpus is None else cpus
+    n_cpus = min(resources.blas_threads, len(cpus))
+    start = (worker_index * n_cpus) % len(cpus)
+    return [cpus[(start + i) % len(cpus)] for i in range(n_cpus)]
+
+
+def apply_worker_resources(resources, worker_index=None):
+    """
+    Apply the policy to the current process
+
+    Returns
+    -------
+    dict
+        The effective settings
+    """
+    _state['resources'] = resources
+    os.environ.update(threads_env(resources))
+    try:
+        from threadpoolctl import threadpool_limits
+        threadpool_limits(limits=resources.blas_threads)
+        blas_limit = 'threadpoolctl'
+    except ImportError:
+        blas_limit = 'environment'
+    cpus = None
+    if (resources.pin_workers and worker_index is not None
+            and hasattr(os, 'sched_setaffinity')):
+        cpus = worker_cpus(worker_index, resources)
+        os.sched_setaffinity(0, cpus)
+    return dict(pid=os.getpid(), worker_index=worker_index,
+                blas_threads=resources.blas_threads, blas_limit=blas_limit,
+                solver_threads=resources.solver_threads, cpus=cpus)
+
+
+def init_worker(resources, counter):
+    """Initializer of the pools of worker processes"""
+    with counter.get_lock():
+        worker_index = counter.value
+        counter.value += 1
+    settings = apply_worker_resources(resources, worker_index)
+    print('Worker {pid}: {blas_threads} BLAS threads (limited through {blas_limit}), '
+          '{solver_threads} solver threads, CPUs {cpus}'.format(**settings))
+
+
+def pool_kwargs(resources):
+    """
+    Keyword arguments of multiprocessing.Pool applying the policy in every
+    worker. The same dict can be given to several pools: worker indices, and
+    thus pinned cores, are shared among them
+    """
+    if resources is None:
+        return {}
+    return dict(initializer=init_worker,
+                initargs=(resources, multiprocessing.Value('i', 0)))
+
+
+def report_worker_resources(resources):
+    """Print the policy and warn when it runs more threads than CPUs"""
+    n_cpus = len(available_cpus())
+    print('Worker resources: {} workers, {} BLAS threads and {} solver threads '
+          'per worker, pinning {}, {} CPUs available'.format(
+              resources.n_workers, resources.blas_threads,
+              resources.solver_threads,
+              'on' if resources.pin_workers else 'off', n_cpus))
+    n_threads = resources.n_workers * max(resources.blas_threads,
+                                          resources.solver_threads)
+    if n_threads > n_cpus:
+        print(f'WARNING: up to {n_threads} threads will run on {n_cpus} CPUs')
+
+
+def solver_options(solver_name, params_opf=None):
+    """
+    Options of the LP solver limiting its threads, following the policy of
+    the current worker or, outside of a worker, solver_threads of params_opf.
+
+    They take the form the dispatch backend of params_opf expects: a dict of
+    HiGHS options for the native and persistent LP dispatch, a command line
+    string for cbc and glpk run by pypsa without pyomo, a dict otherwise
+    """
+    params_opf = params_opf or {}
+    resources = _state['resources']
+    n_threads = (resources.solver_threads if resources is not None
+                 else params_opf.get('solver_threads'))
+    if n_threads is None:
+        return {}
+    if solver_name == 'highs' or params_opf.get('persistent_lp', False):
+        return {HIGHS_THREADS_OPTION: int(n_threads)}
+    option = SOLVER_THREADS_OPTIONS.get(solver_name)
+    if option is None:
+        return {}
+    if solver_name in COMMAND_LINE_SOLVERS and not params_opf.get('pyomo', True):
+        # Followed by the rest of the command, hence the trailing space
+        return f'-{option} {int(n_threads)} '
+    return {option: int(n_threads)}
@@ -7,7 +7,6 @@ setup(name='Chronix2Grid',
       long_description='TODO',
       classifiers=[
           'Development Status :: 3 - Alpha',
-          'Programming Language :: Python :: 3.6',
           'Programming Language :: Python :: 3.7',
           "License :: OSI Approved :: Mozilla Public License 2.0 (MPL 2.0)",
           "Intended Audience :: Developers",
@@ -22,6 +21,7 @@ setup(name='Chronix2Grid',
       license='Mozilla Public License 2.0 (MPL 2.0)',
       packages=find_packages(),
       include_package_data=True,
+      python_requires='>=3.7',
       install_requires=["appdirs==1.4.3",
                         "attrs==19.3.0",
                         "backcall==0.1.0",
@@ -93,7 +93,7 @@ setup(name='Chronix2Grid',
                         "QtPy==1.9.0",
                         "requests==2.23.0",
                         "retrying==1.3.3",
-                        "scipy==1.4.1",
+                        "scipy==1.7.3",
                         "seaborn==0.10.0",
                         "Send2Trash==1.5.0",
                         "six==1.14.0",
@@ -109,6 +109,8 @@ setup(name='Chronix2Grid',
                         "xlrd==1.2.0",
                         "zipp==3.1.0"
                         ],
+      extras_require={'highs': ['highspy>=1.5.3']},
       zip_safe=False,
-      entry_points={'console_scripts': ['chronix2grid=chronix2grid.main:generate_mp']}
+      entry_points={'console_scripts': ['chronix2grid=chronix2grid.main:cli',
+                                       'chronix2grid-benchmark=chronix2grid.benchmark.cli:benchmark']}
 )
\ No newline at end of file
@@ -3,12 +3,15 @@ import json
 import os
 import tempfile
 import unittest
+from unittest import mock
 
 import pandas as pd
 import pathlib
 
 from chronix2grid.generation.dispatch.EconomicDispatch import (
-    ChroniXScenario, init_dispatcher_from_config, Dispatcher)
+    ChroniXScenario, init_dispatcher_from_config, Dispatcher,
+    make_dispatch_result_cache)
+from chronix2grid.generation.dispatch.utils import RampMode
 import chronix2grid.constants as cst
 import grid2op
 from grid2op.Chronics import ChangeNothing
@@ -42,10 +45,84 @@ class TestDispatch(unittest.TestCase):
         dispatcher = Dispatcher.from_gri2op_env(grid2op_env)
         self.assertTrue(isinstance(dispatcher, Dispatcher))
 
+    def test_dispatcher_cache(self):
+        cache_folder = tempfile.mkdtemp()
+        input_folder = os.path.join(self.input_folder, cst.GENERATION_FOLDER_NAME)
+        dispatcher = init_dispatcher_from_config(self.grid_path, input_folder,
+                                                 cache_folder)
+        # Restored without starting grid2op
+        with mock.patch('grid2op.make', side_effect=AssertionError):
+            restored = init_dispatcher_from_config(self.grid_path, input_folder,
+                                                   cache_folder)
+        pd.testing.assert_frame_equal(restored.generators, dispatcher.generators)
+        pd.testing.assert_frame_equal(restored._gen_table, dispatcher._gen_table)
+        pd.testing.assert_frame_equal(restored._max_hydro_pu,
+                                      dispatcher._max_hydro_pu)
+
+    def test_dispatch_result_cache(self):
+        index = pd.date_range('2012-01-01', periods=12, freq='5min')
+        net_load = pd.DataFrame(index=index, data={'net_load': 1000.})
+        prods_dispatch = pd.DataFrame(index=index, data=1.,
+                                      columns=self.dispatcher.generators.index)
+        prices = pd.DataFrame(index=index, data={'price': 10.})
+        params = {'step_opf_min': 5, 'mode_opf': 'day', 'solver_threads': 1}
+        result_cache = make_dispatch_result_cache(tempfile.mkdtemp(), params)
+
+        def run(load, params):
+            self.dispatcher._chronix_scenario = ChroniXScenario(
+                pd.DataFrame(index=index, data={'load': 1.}),
+                pd.DataFrame(index=index, data={'wind': 0., 'solar': 0.}),
+                dict(wind=['wind'], solar=['solar']), 'Scenario_0')
+            return self.dispatcher.run(load, params, ramp_mode=RampMode.easy,
+                                       result_cache=result_cache)
+
+        with mock.patch(
+                'chronix2grid.generation.dispatch.EconomicDispatch.main_run_disptach',
+                return_value=(prods_dispatch, ['optimal'], prices)) as solve:
+            run(net_load, params)
+            # Same net load: restored, whatever the number of solver threads
+            results = run(net_load.copy(), dict(params, solver_threads=4))
+            self.assertEqual(solve.call_count, 1)
+            pd.testing.assert_frame_equal(results.chronix.prods_dispatch,
+                                          prods_dispatch)
+            pd.testing.assert_frame_equal(results.chronix.marginal_prices, prices)
+            self.assertEqual(results.terminal_conditions, ['optimal'])
+
+            # Nor the worker resources or a screen only flagging windows
+            run(net_load, dict(params, blas_threads=2, pin_workers=True,
+                               feasibility_screen='flag'))
+            self.assertEqual(solve.call_count, 1)
+
+            run(net_load + 1., params)
+            run(net_load, dict(params, mode_opf='week'))
+            run(net_load, dict(params, feasibility_screen='relax'))
+            self.assertEqual(solve.call_count, 4)
+
     def test_read_hydro_guide_curves(self):
         self.dispatcher.read_hydro_guide_curves(self.hydro_file_path)
         self.assertAlmostEqual(self.dispatcher._max_hydro_pu.iloc[0, 0],
                                0.482099426, places=5)
+        hydro_names = self.dispatcher.generators.index[
+            self.dispatcher.generators.carrier == 'hydro']
+        self.assertListEqual(list(self.dispatcher._max_hydro_pu.columns),
+                             list(hydro_names))
+
+    def test_hydro_constraints(self):
+        self.dispatcher.read_hydro_guide_curves(self.hydro_file_path)
+        index = pd.date_range('2012-02-28 23:00', periods=36, freq='5min')
+        self.dispatcher._chronix_scenario = ChroniXScenario(
+            pd.DataFrame(index=index, data={'load': 1.}),
+            pd.DataFrame(index=index, data={'wind': 0., 'solar': 0.}),
+            dict(wind=['wind'], solar=['solar']), 'Scenario_0')
+        constraints = self.dispatcher.make_hydro_constraints_from_res_load_scenario()
+        p_max_pu = constraints['p_max_pu']
+        self.assertEqual(p_max_pu.shape,
+                         (len(index), self.dispatcher._max_hydro_pu.shape[1]))
+        self.assertFalse(p_max_pu.isna().any().any())
+        # The window is cached, and the constraints given are copies of it
+        p_max_pu.iloc[:, :] = -1.
+        constraints = self.dispatcher.make_hydro_constraints_from_res_load_scenario()
+        self.assertTrue((constraints['p_max_pu'].values >= 0.).all())
 
 
 class TestChronixScenario(unittest.TestCase):
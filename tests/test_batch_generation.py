@@ -0,0 +1,82 @@
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+import chronix2grid.generation.generation_utils as gu
+from chronix2grid.generation.consumption import generate_load as gen_loads
+from chronix2grid.generation.renewable import generate_solar_wind as gen_enr
+
+
+class TestBatchGeneration(unittest.TestCase):
+    def setUp(self):
+        params = {
+            'Lx': 1000., 'Ly': 1000., 'dx_corr': 250., 'dy_corr': 250.,
+            'dt': 5., 'temperature_corr': 400., 'solar_corr': 100.,
+            'long_wind_corr': 20160., 'medium_wind_corr': 1440.,
+            'short_wind_corr': 300., 'std_temperature_noise': 0.06,
+            'std_solar_noise': 0.1, 'std_short_wind_noise': 0.04,
+            'std_medium_wind_noise': 0.3, 'std_long_wind_noise': 0.3,
+            'smoothdist': 0.001, 'planned_std': 0.01
+        }
+        params.update(gu.time_parameters(1, '2012-01-01'))
+        self.params = gu.updated_time_parameters_with_timestep(params, params['dt'])
+        self.loads_charac = pd.DataFrame({
+            'name': ['load_0_0', 'load_1_1', 'load_2_2'],
+            'type': ['residential'] * 3,
+            'x': [30., 86., 570.], 'y': [-29., 310., 75.],
+            'Pmax': [56.4, 22.1, 43.1]})
+        self.prods_charac = pd.DataFrame({
+            'name': ['gen_0_0', 'gen_1_1', 'gen_2_2', 'gen_3_3'],
+            'type': ['wind', 'solar', 'thermal', 'solar'],
+            'x': [62., 74., 74., 300.], 'y': [-101., -293., -390., 12.],
+            'Pmax': [33.6, 40., 300., 25.], 'V': [142.1, 142.1, 355.4, 142.1]})
+        rng = np.random.RandomState(0)
+        self.load_weekly_pattern = pd.DataFrame(
+            {'test': 1 + 0.1 * rng.rand(3 * 12 * 24 * 7)})
+        self.solar_pattern = np.clip(
+            np.sin(np.linspace(0, 365 * 2 * np.pi, 8761)), 0, None)
+        self.seeds = [3, 7]
+
+    def test_interpolate_noise_batch(self):
+        noise = np.random.RandomState(1).normal(0, 1, (2, 5, 5, 26))
+        locations = np.array([[30., -29.], [570., 75.]])
+        batch = gu.interpolate_noise_batch(noise, self.params, locations,
+                                           time_scale=400.)
+        for s in range(2):
+            for j, location in enumerate(locations):
+                expected = gu.interpolate_noise(noise[s], self.params,
+                                                location, time_scale=400.)
+                np.testing.assert_allclose(batch[s, j], expected, rtol=1e-12)
+
+    def test_loads_batch(self):
+        paths = [tempfile.mkdtemp() for _ in self.seeds]
+        batch_results = gen_loads.main_batch(
+            paths, [np.random.RandomState(seed) for seed in self.seeds],
+            self.params, self.loads_charac, self.load_weekly_pattern.copy(),
+            write_results=False)
+        for seed, path, (load_p, load_p_forecasted) in zip(self.seeds, paths, batch_results):
+            expected_load_p, expected_load_p_forecasted = gen_loads.main(
+                path, seed, self.params, self.loads_charac,
+                self.load_weekly_pattern.copy(), write_results=False)
+            pd.testing.assert_frame_equal(load_p, expected_load_p, rtol=1e-10)
+            pd.testing.assert_frame_equal(load_p_forecasted,
+                                          expected_load_p_forecasted, rtol=1e-10)
+
+    def test_renewables_batch(self):
+        paths = [tempfile.mkdtemp() for _ in self.seeds]
+        batch_results = gen_enr.main_batch(
+            paths, [np.random.RandomState(seed) for seed in self.seeds],
+            self.params, self.prods_charac, self.solar_pattern,
+            write_results=False)
+        for seed, path, results in zip(self.seeds, paths, batch_results):
+            expected_results = gen_enr.main(
+                path, seed, self.params, self.prods_charac,
+                self.solar_pattern, write_results=False)
+            for df, expected_df in zip(results, expected_results):
+                pd.testing.assert_frame_equal(df, expected_df, rtol=1e-10)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,179 @@
+import os
+import tempfile
+import unittest
+
+from chronix2grid.benchmark.calibration import fit_cost_model
+from chronix2grid.benchmark.gate import (RUN_ENTRY, compare,
+                                         default_baseline_path, failed,
+                                         format_diff, read_baseline,
+                                         stage_metrics, write_baseline)
+from chronix2grid.benchmark.hot_paths import BENCHMARKS, run_hot_paths
+from chronix2grid.benchmark.scaling import add_efficiencies, analyse_run
+from chronix2grid.benchmark.synthetic_case import (make_synthetic_case,
+                                                   write_synthetic_case)
+from chronix2grid.config import LoadsConfigManager, ResConfigManager
+
+
+class TestSyntheticCase(unittest.TestCase):
+    def test_make_synthetic_case(self):
+        params, loads_charac, prods_charac = make_synthetic_case(1000)
+        self.assertEqual(len(loads_charac), 840)
+        self.assertEqual(prods_charac['type'].value_counts()['thermal'], 186)
+        self.assertTrue(loads_charac['name'].is_unique)
+        self.assertTrue(prods_charac['name'].is_unique)
+        self.assertTrue(((loads_charac['x'] >= 0) & (loads_charac['x'] < params['Lx'])).all())
+        self.assertTrue(((prods_charac['y'] <= 0) & (prods_charac['y'] > -params['Ly'])).all())
+
+    def test_write_synthetic_case(self):
+        input_folder = tempfile.mkdtemp()
+        write_synthetic_case(input_folder, 'synthetic_50', 50)
+        generation_folder = os.path.join(input_folder, 'generation')
+        input_directories = dict(case='synthetic_50', patterns='patterns')
+        params, loads_charac, load_weekly_pattern = LoadsConfigManager(
+            'Loads', generation_folder, input_directories,
+            tempfile.mkdtemp()).read_configuration()
+        _, prods_charac, solar_pattern = ResConfigManager(
+            'Renewables', generation_folder, input_directories,
+            tempfile.mkdtemp()).read_configuration()
+        self.assertEqual(len(loads_charac), 42)
+        self.assertIn('test', load_weekly_pattern.columns)
+        self.assertEqual(solar_pattern.shape, (8761,))
+        self.assertEqual(params['dt'], 5.)
+
+
+class TestHotPaths(unittest.TestCase):
+    def test_run_hot_paths(self):
+        results = run_hot_paths([20], [2], repeat=1)
+        self.assertEqual([result['name'] for result in results['results']],
+                         list(BENCHMARKS))
+        for result in results['results']:
+            self.assertGreater(result['best'], 0.)
+        self.assertIn('cpu_count', results['machine'])
+
+    def test_unknown_benchmark(self):
+        with self.assertRaises(ValueError):
+            run_hot_paths([20], [1], names=['unknown'])
+
+
+class TestScaling(unittest.TestCase):
+    @staticmethod
+    def summary(cpu_l, cpu_r, max_threads):
+        return dict(
+            stages={'L': {'total': dict(seconds=cpu_l, cpu_seconds=cpu_l)},
+                    'R': {'total': dict(seconds=cpu_r, cpu_seconds=cpu_r)}},
+            workers={'1': dict(peak_rss_mb=100., max_threads=max_threads),
+                     '2': dict(peak_rss_mb=150., max_threads=max_threads)})
+
+    def test_analyse_run(self):
+        run = analyse_run(self.summary(3., 1., 1), wall_time=2.5, nb_core=2,
+                          cpu_count=8)
+        self.assertAlmostEqual(run['stage_cpu_share']['L'], 0.75)
+        self.assertAlmostEqual(run['cpu_utilization'], 0.8)
+        self.assertEqual(run['peak_rss_mb_per_worker'], 150.)
+        self.assertEqual(run['n_workers'], 2)
+        self.assertFalse(run['oversubscribed'])
+
+    def test_oversubscription(self):
+        # Workers using more CPU than wall time x cores
+        run = analyse_run(self.summary(6., 2., 1), wall_time=2., nb_core=2,
+                          cpu_count=8)
+        self.assertTrue(run['oversubscribed'])
+        # Workers with more threads than the machine can run
+        run = analyse_run(self.summary(3., 1., 8), wall_time=2.5, nb_core=2,
+                          cpu_count=8)
+        self.assertTrue(run['oversubscribed'])
+
+    def test_add_efficiencies(self):
+        runs = add_efficiencies([
+            dict(mode='LR', nb_core=1, wall_time=8.),
+            dict(mode='LR', nb_core=4, wall_time=4.),
+            dict(mode='LRK', nb_core=2, wall_time=10.),
+            dict(mode='LRK', nb_core=4, wall_time=5.)])
+        self.assertEqual([run['speedup'] for run in runs], [1., 2., 1., 2.])
+        self.assertEqual([run['efficiency'] for run in runs], [1., .5, 1., 1.])
+
+
+class TestGate(unittest.TestCase):
+    baseline = {'L': dict(seconds=10., peak_rss_mb=200., bytes_written=1000),
+                'R': dict(seconds=0.2, peak_rss_mb=200., bytes_written=1000)}
+
+    def test_stage_metrics(self):
+        summary = dict(wall_time=5., peak_rss_mb=300., stages={
+            'L': {'noise synthesis': dict(seconds=1., calls=1, bytes_written=0),
+                  'total': dict(seconds=3., calls=2, bytes_written=100,
+                                peak_rss_mb=250.)},
+            'R': {'total': dict(seconds=1., calls=2, bytes_written=50,
+                                peak_rss_mb=300.)}})
+        metrics = stage_metrics(summary)
+        self.assertEqual(metrics['L'], dict(seconds=3., peak_rss_mb=250.,
+                                            bytes_written=100))
+        self.assertEqual(metrics['run'], dict(seconds=5., peak_rss_mb=300.,
+                                              bytes_written=150))
+
+    def test_compare(self):
+        current = {'L': dict(seconds=14., peak_rss_mb=205., bytes_written=500),
+                   # Slower, but by less than the minimum difference
+                   'R': dict(seconds=0.6, peak_rss_mb=200., bytes_written=1000)}
+        rows = compare(self.baseline, current)
+        statuses = {(row['stage'], row['metric']): row['status'] for row in rows}
+        self.assertEqual(statuses[('L', 'seconds')], 'REGRESSION')
+        self.assertEqual(statuses[('L', 'peak_rss_mb')], 'ok')
+        self.assertEqual(statuses[('L', 'bytes_written')], 'improved')
+        self.assertEqual(statuses[('R', 'seconds')], 'ok')
+        self.assertEqual(len(failed(rows)), 1)
+        self.assertIn('REGRESSION', format_diff(rows))
+
+        rows = compare(self.baseline, current, thresholds=dict(seconds=0.5))
+        self.assertEqual(failed(rows), [])
+
+    def test_missing_stage(self):
+        rows = compare(self.baseline, {'L': self.baseline['L'],
+                                       'K': self.baseline['L']})
+        self.assertEqual({row['stage'] for row in failed(rows)}, {'R'})
+        self.assertIn('new', {row['status'] for row in rows if row['stage'] == 'K'})
+
+    def test_baseline_profile(self):
+        path = os.path.join(tempfile.mkdtemp(), 'baselines', 'lr-small.json')
+        write_baseline(path, 'lr-small', self.baseline)
+        self.assertEqual(read_baseline(path, 'lr-small')['metrics'], self.baseline)
+        with self.assertRaises(ValueError):
+            read_baseline(path, 'lr-large')
+
+    def test_committed_baselines(self):
+        for profile_name in ['lr-small', 'lr-large']:
+            baseline = read_baseline(default_baseline_path(profile_name), profile_name)
+            self.assertIn(RUN_ENTRY, baseline['metrics'])
+
+
+class TestCalibration(unittest.TestCase):
+    @staticmethod
+    def observation(n_values, n_windows):
+        return dict(
+            values=dict(L=n_values, T=n_values), n_windows=n_windows,
+            stage_seconds=dict(L=1. + 2e-6 * n_values,
+                               T=3. * n_windows + 1e-6 * n_values),
+            scenario_values=2 * n_values, peak_rss_mb=100. + 1e-5 * n_values,
+            bytes_per_value=dict(csv=5., bz2=float(n_values)))
+
+    def test_fit_cost_model(self):
+        cost_model = fit_cost_model(
+            [self.observation(1e5, 7), self.observation(1e6, 28),
+             self.observation(4e6, 12)], efficiencies=[0.8, 0.9, 0.7])
+        self.assertAlmostEqual(cost_model['stages']['L']['seconds'], 1.)
+        self.assertAlmostEqual(cost_model['stages']['L']['seconds_per_value'], 2e-6)
+        self.assertAlmostEqual(cost_model['stages']['T']['seconds_per_window'], 3.)
+        self.assertAlmostEqual(cost_model['stages']['T']['seconds_per_value'], 1e-6)
+        self.assertAlmostEqual(cost_model['base_rss_mb'], 100.)
+        self.assertAlmostEqual(cost_model['mb_per_value'], 5e-6)
+        self.assertEqual(cost_model['bytes_per_value']['bz2'], 4e6)
+        self.assertAlmostEqual(cost_model['parallel_efficiency'], 0.8)
+
+    def test_single_run(self):
+        cost_model = fit_cost_model([self.observation(1e6, 28)])
+        self.assertEqual(set(cost_model['stages']['L']), {'seconds_per_value'})
+        self.assertIsNone(cost_model['base_rss_mb'])
+        self.assertIsNone(cost_model['parallel_efficiency'])
+
+
+if __name__ == '__main__':
+    unittest.main()
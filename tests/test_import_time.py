@@ -0,0 +1,46 @@
+import json
+import subprocess
+import sys
+import unittest
+
+# Dependencies only needed by the dispatch (T) and KPI (K) stages
+HEAVY_MODULES = ['grid2op', 'pypsa', 'matplotlib', 'plotly', 'seaborn']
+# Generous budget in seconds: numpy, pandas and scipy alone take about 0.5s
+IMPORT_TIME_BUDGET = 3.
+
+LOADED_HEAVY_MODULES = """
+import json, sys, time
+start = time.perf_counter()
+import chronix2grid.main
+import_time = time.perf_counter() - start
+{}
+print(json.dumps(dict(
+    import_time=import_time,
+    heavy_modules=[name for name in {} if name in sys.modules])))
+"""
+
+
+def run_python(code):
+    output = subprocess.run([sys.executable, '-c', code], check=True,
+                            stdout=subprocess.PIPE, universal_newlines=True)
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+class TestImportTime(unittest.TestCase):
+    def test_import_main(self):
+        result = run_python(LOADED_HEAVY_MODULES.format('', HEAVY_MODULES))
+        self.assertEqual(result['heavy_modules'], [])
+        self.assertLess(result['import_time'], IMPORT_TIME_BUDGET)
+
+    def test_help(self):
+        show_help = """
+try:
+    chronix2grid.main.generate_mp(['--help'])
+except SystemExit:
+    pass"""
+        result = run_python(LOADED_HEAVY_MODULES.format(show_help, HEAVY_MODULES))
+        self.assertEqual(result['heavy_modules'], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import json
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from chronix2grid import instrumentation as instr
+
+
+class TestInstrumentation(unittest.TestCase):
+    def setUp(self):
+        self.timings_folder = tempfile.mkdtemp()
+        self.output_folder = tempfile.mkdtemp()
+        self.df = pd.DataFrame(np.random.RandomState(0).rand(100, 3),
+                               columns=['a', 'b', 'c'])
+
+    def tearDown(self):
+        instr.set_timings_folder(None)
+
+    def test_disabled(self):
+        with instr.record_stage('Scenario_0', 'L'):
+            with instr.timed('interpolation'):
+                pass
+        self.assertEqual(os.listdir(self.timings_folder), [])
+
+    def test_to_csv(self):
+        path = os.path.join(self.output_folder, 'load_p.csv.bz2')
+        expected_path = os.path.join(self.output_folder, 'expected.csv.bz2')
+        instr.to_csv(self.df, path, sep=';', index=False, float_format='%.1f')
+        self.df.to_csv(expected_path, sep=';', index=False, float_format='%.1f')
+        with open(path, 'rb') as f, open(expected_path, 'rb') as expected_f:
+            self.assertEqual(f.read(), expected_f.read())
+
+    def test_record_stage(self):
+        instr.set_timings_folder(self.timings_folder)
+        for scenario_name in ['Scenario_0', 'Scenario_1']:
+            with instr.record_stage(scenario_name, 'L'):
+                for _ in range(2):
+                    with instr.timed('interpolation'):
+                        pass
+                instr.to_csv(self.df, os.path.join(
+                    self.output_folder, scenario_name + '.csv.bz2'), sep=';')
+
+        with open(os.path.join(self.timings_folder, 'Scenario_0.jsonl')) as f:
+            records = {record['step']: record
+                       for record in map(json.loads, f)}
+        self.assertEqual(set(records), {'interpolation', 'csv formatting',
+                                        'compression', 'total'})
+        self.assertEqual(records['interpolation']['calls'], 2)
+        self.assertEqual(records['total']['bytes_written'], os.path.getsize(
+            os.path.join(self.output_folder, 'Scenario_0.csv.bz2')))
+
+        summary = instr.summarize(self.timings_folder, wall_time=1.)
+        self.assertEqual(summary['n_scenarios'], 2)
+        self.assertEqual(summary['stages']['L']['interpolation']['calls'], 4)
+        self.assertTrue(os.path.isfile(
+            os.path.join(self.timings_folder, instr.SUMMARY_FILE_NAME)))
+
+    @unittest.skipIf(not instr.reset_peak_rss(),
+                     'the peak resident memory cannot be reset')
+    def test_peak_rss_per_stage(self):
+        instr.set_timings_folder(self.timings_folder)
+        with instr.record_stage('Scenario_0', 'L'):
+            # About 400 MB
+            large = np.ones(50 * 10 ** 6)
+            del large
+        with instr.record_stage('Scenario_0', 'R'):
+            pass
+        summary = instr.summarize(self.timings_folder)
+        peaks = {stage: steps['total']['peak_rss_mb']
+                 for stage, steps in summary['stages'].items()}
+        # The peak of L is not reported by R
+        self.assertGreater(peaks['L'] - peaks['R'], 300.)
+        self.assertEqual(summary['peak_rss_mb'], peaks['L'])
+
+        instr.clear_timings(self.timings_folder)
+        self.assertEqual(os.listdir(self.timings_folder), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
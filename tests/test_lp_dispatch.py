@@ -0,0 +1,590 @@
+import multiprocessing
+import os
+import pathlib
+import shutil
+from types import SimpleNamespace
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from chronix2grid.generation.dispatch import lp_dispatch
+from chronix2grid.generation.dispatch.EDispatch_L2RPN2020.run_economic_dispatch import main_run_disptach
+from chronix2grid.generation.dispatch.EDispatch_L2RPN2020.utils import (
+    calendar_windows, dispatch_calendar, marginal_prices_from_dispatch,
+    preprocess_input_data)
+from chronix2grid.generation.dispatch.utils import RampMode
+from chronix2grid.worker_resources import solver_options
+
+try:
+    import pypsa
+except ImportError:
+    pypsa = None
+
+
+def make_generators():
+    """A cheap ramp limited unit, an expensive flexible one and hydro"""
+    return pd.DataFrame(
+        index=['cheap', 'expensive', 'hydro'],
+        data=dict(p_nom=[100., 100., 50.], marginal_cost=[10., 20., 5.],
+                  p_min_pu=[0., 0., 0.], p_max_pu=[1., 1., 1.],
+                  ramp_limit_up=[.2, np.nan, np.nan],
+                  ramp_limit_down=[.2, np.nan, np.nan],
+                  carrier=['nuclear', 'thermal', 'hydro']))
+
+
+class TestLPDispatch(unittest.TestCase):
+    def setUp(self):
+        self.generators = lp_dispatch.generator_data(make_generators())
+        self.index = pd.date_range('2012-01-01', periods=4, freq='5min')
+        self.hydro_max = pd.DataFrame(index=self.index, columns=['hydro'],
+                                      data=[.5, .5, 1., 1.])
+        self.hydro_min = pd.DataFrame(index=self.index, columns=['hydro'],
+                                      data=0.)
+
+    def test_merit_order_and_ramps(self):
+        demand = pd.DataFrame(index=self.index, columns=['agg_load'],
+                              data=[45., 105., 125., 125.])
+        dispatch, termination_condition, prices = lp_dispatch.run_lp_window(
+            {}, self.generators, demand, self.hydro_max, self.hydro_min,
+            engine='linprog')
+        self.assertEqual(termination_condition, 'optimal')
+        np.testing.assert_allclose(dispatch.sum(axis=1), demand['agg_load'])
+        # The cheap unit ramps by 20 MW per step at most: it runs instead of
+        # hydro at first to be higher when demand peaks, the expensive unit
+        # fills the gap
+        np.testing.assert_allclose(dispatch['cheap'], [45., 65., 75., 75.])
+        np.testing.assert_allclose(dispatch['hydro'], [0., 25., 50., 50.])
+        np.testing.assert_allclose(dispatch['expensive'], [0., 15., 0., 0.])
+        np.testing.assert_allclose(prices.values[1:3], [20., 10.])
+
+    def test_lp_reused_across_windows(self):
+        lp_cache = {}
+        for level in [30., 60., 90.]:
+            demand = pd.DataFrame(index=self.index, columns=['agg_load'],
+                                  data=level)
+            dispatch, termination_condition, _ = lp_dispatch.run_lp_window(
+                lp_cache, self.generators, demand, self.hydro_max,
+                self.hydro_min, engine='linprog')
+            self.assertEqual(termination_condition, 'optimal')
+            np.testing.assert_allclose(dispatch.sum(axis=1), level)
+        self.assertEqual(list(lp_cache), [4])
+
+        short_demand = pd.DataFrame(index=self.index[:2], columns=['agg_load'],
+                                    data=10.)
+        lp_dispatch.run_lp_window(lp_cache, self.generators, short_demand,
+                                  self.hydro_max.iloc[:2],
+                                  self.hydro_min.iloc[:2], engine='linprog')
+        self.assertEqual(sorted(lp_cache), [2, 4])
+
+    @unittest.skipIf(lp_dispatch.highspy is None,
+                     'highspy is not installed, see requirements.txt')
+    def test_warm_start(self):
+        # Two windows of a day at 15 minutes, the second one close to the first
+        n_steps = 96
+        demand = 120. + 60. * np.sin(np.arange(n_steps) / 8.)
+        next_demand = demand + np.random.default_rng(0).normal(0., 3., n_steps)
+        p_min = np.zeros((n_steps, 3))
+        p_max = np.tile(self.generators.p_nom, (n_steps, 1))
+        p_max[:, 2] = 25.
+        iterations, dispatches = {}, {}
+        for warm_start in [True, False]:
+            lp = lp_dispatch.WindowLP(self.generators, n_steps, 'highspy',
+                                      warm_start=warm_start)
+            lp.solve(demand, p_min, p_max)
+            dispatches[warm_start], termination_condition, _ = lp.solve(
+                next_demand, p_min, p_max)
+            self.assertEqual(termination_condition, 'optimal')
+            iterations[warm_start] = lp.iterations
+        # The second window starts from the basis of the first one
+        self.assertLess(iterations[True], iterations[False] / 4)
+        costs = self.generators.marginal_cost
+        self.assertAlmostEqual((dispatches[True] * costs).sum(),
+                               (dispatches[False] * costs).sum(), places=4)
+
+    def test_initial_state_linprog(self):
+        # The cheap unit ends the previous window at 100 MW and can only go
+        # down by 20 MW per step, with hydro cheaper below it
+        lp = lp_dispatch.WindowLP(self.generators, 4, 'linprog')
+        p_min = np.zeros((4, 3))
+        p_max = np.tile(self.generators.p_nom, (4, 1))
+        cold, _, _ = lp.solve(np.full(4, 90.), p_min, p_max)
+        np.testing.assert_allclose(cold[:, 0], 40.)
+        carried, termination_condition, _ = lp.solve(
+            np.full(4, 90.), p_min, p_max, initial=np.array([100., 0., 0.]))
+        self.assertEqual(termination_condition, 'optimal')
+        np.testing.assert_allclose(carried[:, 0], [80., 60., 40., 40.])
+
+    def test_infeasible_window(self):
+        demand = pd.DataFrame(index=self.index, columns=['agg_load'], data=1000.)
+        dispatch, termination_condition, _ = lp_dispatch.run_lp_window(
+            {}, self.generators, demand, self.hydro_max, self.hydro_min,
+            engine='linprog')
+        self.assertNotEqual(termination_condition, 'optimal')
+        self.assertTrue(dispatch.isna().all().all())
+
+    @unittest.skipIf(lp_dispatch.highspy is None,
+                     'highspy is not installed, see requirements.txt')
+    def test_highspy_engine_matches_linprog(self):
+        demand = pd.DataFrame(index=self.index, columns=['agg_load'],
+                              data=[45., 105., 125., 125.])
+        expected, _, expected_prices = lp_dispatch.run_lp_window(
+            {}, self.generators, demand, self.hydro_max, self.hydro_min,
+            engine='linprog')
+        # The persistent model is updated from another demand first
+        lp_cache = {}
+        lp_dispatch.run_lp_window(lp_cache, self.generators, demand * .5,
+                                  self.hydro_max, self.hydro_min, 'highspy')
+        dispatch, termination_condition, prices = lp_dispatch.run_lp_window(
+            lp_cache, self.generators, demand, self.hydro_max,
+            self.hydro_min, 'highspy')
+        self.assertEqual(termination_condition, 'optimal')
+        np.testing.assert_allclose(dispatch, expected, atol=1e-6)
+        # Prices with their sign, 20 when the ramp of the cheap unit leaves
+        # the expensive one marginal
+        np.testing.assert_allclose(prices, expected_prices, atol=1e-6)
+        np.testing.assert_allclose(prices, [0., 20., 10., 10.], atol=1e-6)
+        # Positive with positive costs: the cheap unit, above hydro at its
+        # maximum, sets the price
+        for engine in ['linprog', 'highspy']:
+            _, _, prices = lp_dispatch.run_lp_window(
+                {}, self.generators, demand * 0. + 90., self.hydro_max * 0. + 1.,
+                self.hydro_min, engine)
+            np.testing.assert_allclose(prices, 10., atol=1e-6)
+
+
+
+def parallel_dispatch(demand):
+    generators = lp_dispatch.prepare_generators(make_generators(),
+                                                RampMode.hard, 5)
+    demand = demand.to_frame('agg_load')
+    no_bounds = pd.DataFrame(index=demand.index)
+    windows = [(i, min(i + 96, len(demand))) for i in range(0, len(demand), 96)]
+    results, termination_conditions, _ = lp_dispatch.run_parallel_windows(
+        generators, demand, no_bounds, no_bounds, windows, 2, 12)
+    assert termination_conditions == ['optimal'] * len(windows)
+    return pd.concat(results)
+
+
+class TestNativeDispatch(unittest.TestCase):
+    def setUp(self):
+        # Two days at 5 minutes, the demand jumping every hour
+        index = pd.date_range('2012-01-01', periods=2 * 288, freq='5min')
+        hours = np.arange(len(index)) // 12
+        self.load = pd.DataFrame(index=index, data=dict(
+            load_1=60. + 40. * (hours % 2), load_2=20.))
+        self.hydro_max = pd.DataFrame(index=index, columns=['hydro'], data=.5)
+        self.generators = make_generators()
+        self.params = dict(step_opf_min=5, mode_opf='day', reactive_comp=1.,
+                           solver_name=lp_dispatch.NATIVE_SOLVER_NAME)
+
+    def run_dispatch(self, ramp_mode, **params):
+        net = SimpleNamespace(generators=self.generators.copy())
+        prod_p, termination_conditions, prices = main_run_disptach(
+            net, self.load.copy(), dict(self.params, **params),
+            dict(p_max_pu=self.hydro_max.copy()), ramp_mode)
+        # The generators table is left as is
+        pd.testing.assert_frame_equal(net.generators, self.generators)
+        self.assertEqual(termination_conditions,
+                         ['optimal'] * (len(self.load) // 288))
+        np.testing.assert_allclose(prod_p.sum(axis=1),
+                                   self.load.sum(axis=1).values)
+        return prod_p, prices
+
+    @unittest.skipIf(pypsa is None or shutil.which('cbc') is None,
+                     'pypsa or cbc is not installed')
+    def test_matches_pypsa(self):
+        self.hydro_max[:] = 0.
+        net = pypsa.Network()
+        net.add('Bus', 'node')
+        net.add('Load', name='agg_load', bus='node')
+        for name, generator in self.generators.iterrows():
+            net.add('Generator', name=name, bus='node', carrier=generator.carrier,
+                    **generator[['p_nom', 'marginal_cost', 'ramp_limit_up',
+                                 'ramp_limit_down']].to_dict())
+        # With the threads of the solver limited as in the workers
+        params = dict(self.params, solver_name='cbc', pyomo=False,
+                      solver_threads=1)
+        prod_p, termination_conditions, prices = main_run_disptach(
+            net, self.load.copy(), params, dict(p_max_pu=self.hydro_max.copy()),
+            RampMode.hard, pyomo=False, solver_name='cbc',
+            solver_options=solver_options('cbc', params))
+        self.assertEqual(termination_conditions, ['optimal'] * 2)
+        expected, expected_prices = self.run_dispatch(RampMode.hard)
+        np.testing.assert_allclose(prod_p[expected.columns], expected, atol=1e-4)
+        np.testing.assert_allclose(prices, expected_prices, atol=1e-4)
+
+    @unittest.skipIf(lp_dispatch.highspy is None,
+                     'highspy is not installed, see requirements.txt')
+    def test_highspy_engine(self):
+        expected, expected_prices = self.run_dispatch(RampMode.hard,
+                                                      lp_engine='linprog')
+        # Prices are compared where the marginal unit is unique only: they
+        # are degenerate when hydro is between its bounds
+        marginal = expected['expensive'] > 1e-6
+        for params in [{}, dict(parallel_windows=2)]:
+            prod_p, prices = self.run_dispatch(RampMode.hard, lp_engine='highspy',
+                                               **params)
+            np.testing.assert_allclose(prod_p, expected, atol=1e-6)
+            np.testing.assert_allclose(prices[marginal], expected_prices[marginal],
+                                       atol=1e-6)
+
+    def test_merit_order_without_ramps(self):
+        prod_p, prices = self.run_dispatch(RampMode.none)
+        demand = self.load.sum(axis=1).values
+        np.testing.assert_allclose(prod_p['hydro'], 25.)
+        np.testing.assert_allclose(prod_p['cheap'], np.minimum(demand - 25., 100.))
+        np.testing.assert_allclose(prod_p['expensive'], 0.)
+        np.testing.assert_allclose(prices, 10.)
+
+    def test_ramps(self):
+        # Without hydro to follow the jumps of demand
+        self.hydro_max[:] = 0.
+        prod_p, _ = self.run_dispatch(RampMode.hard)
+        # 0.2 * p_nom per 5 minutes, also between the two days (windows) as
+        # the second one starts from the end of the first one
+        self.assertLessEqual(prod_p['cheap'].diff().abs().max(), 20. + 1e-6)
+        self.assertGreater(prod_p['expensive'].max(), 0.)
+
+    def test_initial_state(self):
+        generators = lp_dispatch.prepare_generators(self.generators,
+                                                    RampMode.hard, 5)
+        demand = pd.DataFrame(index=self.load.index[:3], columns=['agg_load'],
+                              data=150.)
+        no_bounds = pd.DataFrame(index=demand.index)
+        dispatch, termination_condition, _ = lp_dispatch.run_lp_window(
+            {}, generators, demand, no_bounds, no_bounds, engine='linprog',
+            initial=np.array([30., 70., 50.]))
+        self.assertEqual(termination_condition, 'optimal')
+        # The cheap unit ramps up from 30 MW
+        np.testing.assert_allclose(dispatch['cheap'], [50., 70., 90.])
+        _, termination_condition, _ = lp_dispatch.run_lp_window(
+            {}, generators, demand, no_bounds, no_bounds, engine='linprog',
+            initial=np.array([30., 70., 50.]), final=np.array([0., 100., 50.]))
+        self.assertEqual(termination_condition, 'optimal')
+        # Out of reach of the initial dispatch
+        _, termination_condition, _ = lp_dispatch.run_lp_window(
+            {}, generators, demand.iloc[:1], no_bounds.iloc[:1],
+            no_bounds.iloc[:1], engine='linprog', initial=np.array([30., 70., 50.]),
+            final=np.array([100., 0., 50.]))
+        self.assertEqual(termination_condition, 'infeasible')
+
+    def test_parallel_windows(self):
+        self.hydro_max[:] = 0.
+        sequential, _ = self.run_dispatch(RampMode.hard)
+        parallel, _ = self.run_dispatch(RampMode.hard, parallel_windows=2,
+                                        window_margin_min=60)
+        # Ramps hold across the seam between the two days too
+        self.assertLessEqual(parallel['cheap'].diff().abs().max(), 20. + 1e-6)
+        costs = self.generators['marginal_cost']
+        self.assertAlmostEqual((parallel * costs).values.sum(),
+                               (sequential * costs).values.sum(), delta=1.)
+
+    def test_parallel_windows_in_pool_worker(self):
+        # Worker processes of a Pool solve windows in threads
+        with multiprocessing.Pool(1) as pool:
+            dispatch = pool.apply(parallel_dispatch, (self.load.sum(axis=1),))
+        self.assertLessEqual(dispatch['cheap'].diff().abs().max(), 20. + 1e-6)
+
+    def test_prices(self):
+        self.hydro_max[:] = 0.
+        _, prices = zip(*[self.run_dispatch(RampMode.hard, prices_from_duals=from_duals)
+                          for from_duals in [True, False]])
+        dual_prices, dispatch_prices = prices
+        # The expensive unit is marginal when it runs
+        expensive = self.run_dispatch(RampMode.hard)[0]['expensive'] > 1e-6
+        np.testing.assert_allclose(dual_prices[expensive], 20.)
+        np.testing.assert_allclose(dispatch_prices[expensive], 20.)
+
+    def test_refine_dispatch(self):
+        # Demand jumping every hour, which an OPF every 15 minutes misses
+        self.hydro_max[:] = 0.
+        hours = np.arange(len(self.load)) // 12
+        self.load['load_1'] = 60. + 40. * (hours % 2) + 10. * (np.arange(len(self.load)) % 3)
+        full, _ = self.run_dispatch(RampMode.hard)
+        # Balanced at 5 minutes, which run_dispatch checks, within ramps and
+        # bounds
+        refined, _ = self.run_dispatch(RampMode.hard, step_opf_min=15,
+                                       refine_dispatch=True, refine_block_min=240)
+        self.assertEqual(len(refined), len(self.load))
+        self.assertLessEqual(refined['cheap'].diff().abs().max(), 20. + 1e-6)
+        self.assertGreaterEqual(refined.values.min(), -1e-6)
+        self.assertLessEqual(refined.values.max(), 100. + 1e-6)
+        costs = self.generators['marginal_cost']
+        self.assertLessEqual((refined * costs).values.sum(),
+                             1.01 * (full * costs).values.sum())
+        # Concurrently
+        parallel, _ = self.run_dispatch(RampMode.hard, step_opf_min=15,
+                                        refine_dispatch=True, refine_block_min=240,
+                                        parallel_windows=2)
+        np.testing.assert_allclose(parallel, refined, atol=1e-6)
+        # Without ramps, in merit order at 5 minutes
+        merit_order, _ = self.run_dispatch(RampMode.none, step_opf_min=15,
+                                           refine_dispatch=True)
+        np.testing.assert_allclose(merit_order['cheap'],
+                                   np.minimum(self.load.sum(axis=1), 100.))
+
+    def test_feasibility_screen(self):
+        generators = lp_dispatch.prepare_generators(self.generators,
+                                                    RampMode.hard, 5)
+        p_max = np.tile(generators.p_nom, (4, 1))
+        # Above the capacity, then a drop the cheap unit at 100 MW cannot
+        # follow with the others at 0
+        checks = lp_dispatch.screen_dispatch(
+            generators, np.array([200., 260., 100., 40.]), np.zeros((4, 3)), p_max)
+        np.testing.assert_array_equal(checks['shortage'], [False, True, False, False])
+        np.testing.assert_array_equal(checks['ramp_up'], [False] * 4)
+        np.testing.assert_array_equal(checks['ramp_down'], [False] * 4)
+        p_max[2:, 1:] = 0.
+        checks = lp_dispatch.screen_dispatch(
+            generators, np.array([200., 250., 100., 40.]), np.zeros((4, 3)), p_max)
+        np.testing.assert_array_equal(checks['ramp_down'], [False, False, False, True])
+
+        # Second day above the capacity of 250 MW
+        self.load.iloc[400:410, 0] = 300.
+        # Not screened by default: the window is given to the solver
+        _, termination_conditions, _ = main_run_disptach(
+            SimpleNamespace(generators=self.generators.copy()), self.load.copy(),
+            self.params, dict(p_max_pu=self.hydro_max.copy()), RampMode.hard)
+        self.assertEqual(termination_conditions[0], 'optimal')
+        self.assertNotEqual(termination_conditions[1], 'optimal')
+        params = dict(self.params, feasibility_screen='flag')
+        with self.assertRaisesRegex(RuntimeError, '2012-01-02 00:00:00'):
+            main_run_disptach(
+                SimpleNamespace(generators=self.generators.copy()),
+                self.load.copy(), params, dict(p_max_pu=self.hydro_max.copy()),
+                RampMode.hard)
+
+        params['feasibility_screen'] = 'relax'
+        prod_p, termination_conditions, _ = main_run_disptach(
+            SimpleNamespace(generators=self.generators.copy()), self.load.copy(),
+            params, dict(p_max_pu=self.hydro_max.copy()), RampMode.hard)
+        self.assertEqual(termination_conditions, ['optimal'] * 2)
+        # At full capacity, hydro being at half of its nominal power
+        np.testing.assert_allclose(prod_p.iloc[400:410].sum(axis=1), 225.)
+        np.testing.assert_allclose(prod_p.iloc[:400].sum(axis=1),
+                                   self.load.iloc[:400].sum(axis=1))
+        # Refined at 5 minutes from an OPF every 15 minutes, with the same
+        # relaxed demand
+        refined, termination_conditions, _ = main_run_disptach(
+            SimpleNamespace(generators=self.generators.copy()), self.load.copy(),
+            dict(params, step_opf_min=15, refine_dispatch=True,
+                 refine_block_min=240),
+            dict(p_max_pu=self.hydro_max.copy()), RampMode.hard)
+        self.assertEqual(termination_conditions, ['optimal'] * 2)
+        self.assertEqual(len(refined), len(self.load))
+        np.testing.assert_allclose(refined.sum(axis=1), prod_p.sum(axis=1),
+                                   atol=1e-6)
+        self.assertLessEqual(refined['cheap'].diff().abs().max(), 20. + 1e-6)
+        self.assertLessEqual(refined['hydro'].max(), 25. + 1e-6)
+        self.assertGreaterEqual(refined.values.min(), -1e-6)
+
+    def test_dispatch_calendar(self):
+        # Ten days from a Thursday, every 15 minutes
+        snapshots = pd.date_range('2012-01-26', periods=10 * 288, freq='5min')
+        calendar = dispatch_calendar(snapshots, 15, 'week')
+        self.assertEqual(len(calendar.index), 10 * 96)
+        self.assertTrue(calendar.index.equals(snapshots[::3]))
+        # Thursday to Sunday, Monday to January 31st, then February
+        self.assertListEqual(calendar_windows(calendar),
+                             [(0, 4 * 96), (4 * 96, 6 * 96), (6 * 96, 10 * 96)])
+        self.assertListEqual(calendar_windows(dispatch_calendar(snapshots, 5, None)),
+                             [(0, 10 * 288)])
+
+        hours = np.arange(len(snapshots)) // 12
+        params = dict(snapshots=snapshots, step_opf_min=15, reactive_comp=2.)
+        load, constraints = preprocess_input_data(
+            pd.DataFrame(index=snapshots, data=dict(
+                load_1=60. + 40. * (hours % 2), load_2=20.)),
+            dict(p_max_pu=pd.DataFrame(index=snapshots, columns=['hydro'], data=.5),
+                 p_min_pu=None), params, calendar)
+        self.assertTrue(load.index.equals(calendar.index))
+        np.testing.assert_allclose(load.agg_load.values[:9],
+                                   [160.] * 4 + [240.] * 4 + [160.])
+        self.assertEqual(constraints['p_max_pu'].shape, (10 * 96, 1))
+        self.assertEqual(constraints['p_min_pu'].shape, (10 * 96, 0))
+
+    @unittest.skipIf(pypsa is None or shutil.which('cbc') is None,
+                     'pypsa or cbc is not installed')
+    def test_pypsa_dual_prices(self):
+        from chronix2grid.generation.dispatch.EconomicDispatch import Dispatcher
+
+        # Generators of case118, and a day of demand from 30% to 70% of
+        # their capacity
+        prods_charac = pd.read_csv(os.path.join(
+            pathlib.Path(__file__).parent.absolute(), 'data', 'input',
+            'generation', 'case118_l2rpn_wcci', 'prods_charac.csv'))
+        dispatcher = Dispatcher.from_gen_table(pd.DataFrame(
+            index=pd.Index(prods_charac['name'], name='name'),
+            data=dict(type=prods_charac['type'].values,
+                      pmax=prods_charac['Pmax'].values,
+                      max_ramp_up=prods_charac['max_ramp_up'].fillna(0.).values,
+                      max_ramp_down=prods_charac['max_ramp_down'].fillna(0.).values,
+                      cost_per_MW=prods_charac['marginal_cost'].values)))
+        generators = dispatcher.generators.copy()
+        index = pd.date_range('2012-01-01', periods=288, freq='5min')
+        load = pd.DataFrame(index=index, data={'load': generators.p_nom.sum() * (
+            .5 + .2 * np.sin(np.arange(len(index)) / len(index) * 2 * np.pi))})
+        prod_p, termination_conditions, prices = main_run_disptach(
+            dispatcher, load, dict(self.params, solver_name='cbc'), {},
+            RampMode.hard, pyomo=False, solver_name='cbc')
+        self.assertEqual(termination_conditions, ['optimal'])
+
+        # Where a unit at the cost of the most expensive producing one is
+        # strictly within its bounds and ramps, it sets the price
+        dispatch_prices = marginal_prices_from_dispatch(
+            prod_p, generators.marginal_cost).values
+        dispatch = prod_p[generators.index]
+        ramps = (generators.ramp_limit_up * generators.p_nom).fillna(np.inf)
+        variations = dispatch.diff().abs().fillna(0.)
+        free = ((dispatch > 1e-3) & (dispatch < generators.p_nom - 1e-3)
+                & variations.lt(ramps - 1e-3)
+                & variations.shift(-1).fillna(0.).lt(ramps - 1e-3))
+        marginal = np.isclose(generators.marginal_cost.values,
+                              dispatch_prices[:, np.newaxis])
+        setting_price = (free.values & marginal).any(axis=1)
+        self.assertGreater(setting_price.mean(), .2)
+        np.testing.assert_allclose(prices.values[setting_price],
+                                   dispatch_prices[setting_price])
+
+    def test_marginal_prices_from_dispatch(self):
+        rng = np.random.default_rng(0)
+        dispatch = pd.DataFrame(rng.uniform(-1., 1., (50, 4)),
+                                columns=['a', 'b', 'c', 'd'])
+        dispatch.iloc[0] = 0.
+        costs = pd.Series([3., 1., 4., 2.], index=['d', 'a', 'c', 'b'])
+        expected = dispatch.apply(lambda row: costs[row[row > 0].index].max(),
+                                  axis=1)
+        pd.testing.assert_series_equal(
+            marginal_prices_from_dispatch(dispatch, costs), expected)
+        self.assertTrue(np.isnan(expected.iloc[0]))
+
+    def test_merit_order_matches_lp(self):
+        rng = np.random.default_rng(0)
+        n_steps, n_gens = 24, 8
+        table = pd.DataFrame(
+            index=[f'gen_{i}' for i in range(n_gens)],
+            data=dict(p_nom=rng.uniform(10., 100., n_gens),
+                      marginal_cost=rng.permutation(n_gens) * 10.,
+                      p_min_pu=0., p_max_pu=1., ramp_limit_up=np.nan,
+                      ramp_limit_down=np.nan, carrier='thermal'))
+        generators = lp_dispatch.generator_data(table)
+        p_max = np.tile(generators.p_nom, (n_steps, 1)) * rng.uniform(.5, 1., (n_steps, n_gens))
+        p_min = p_max * rng.uniform(0., .2, (n_steps, n_gens))
+        demand = rng.uniform(p_min.sum(axis=1), p_max.sum(axis=1))
+
+        dispatch, termination_condition, prices = lp_dispatch.merit_order_dispatch(
+            generators, demand, p_min, p_max)
+        expected, _, duals = lp_dispatch.WindowLP(generators, n_steps, 'linprog').solve(
+            demand, p_min, p_max)
+        self.assertEqual(termination_condition, 'optimal')
+        np.testing.assert_allclose(dispatch, expected, atol=1e-6)
+        np.testing.assert_allclose(prices, duals, atol=1e-6)
+
+        _, termination_condition, _ = lp_dispatch.merit_order_dispatch(
+            generators, p_max.sum(axis=1) + 1., p_min, p_max)
+        self.assertEqual(termination_condition, 'infeasible')
+
+    def test_aggregation_is_lossless(self):
+        # Pairs of units differing by p_nom only, hydro units with their own
+        # guide curves
+        table = pd.DataFrame(
+            index=['t1', 't2', 'n1', 'n2', 'n3', 'h1', 'h2', 'h3'],
+            data=dict(p_nom=[100., 50., 400., 200., 300., 60., 30., 90.],
+                      marginal_cost=[40., 40., 10., 10., 10., 5., 5., 5.],
+                      p_min_pu=0., p_max_pu=1.,
+                      ramp_limit_up=[.1, .1, .02, .02, .05, .3, .3, .3],
+                      ramp_limit_down=[.1, .1, .02, .02, .05, .3, .3, .3],
+                      carrier=['thermal'] * 2 + ['nuclear'] * 3 + ['hydro'] * 3))
+        generators = lp_dispatch.prepare_generators(table, RampMode.hard, 5)
+        index = self.load.index[:48]
+        curve = np.linspace(.2, .9, len(index))
+        hydro_max = pd.DataFrame(index=index, data=dict(
+            h1=curve, h2=curve, h3=curve[::-1]))
+        hydro_min = pd.DataFrame(index=index, data=dict(h1=.1, h2=.1, h3=.1))
+        demand = pd.DataFrame(index=index, columns=['agg_load'],
+                              data=500. + 100. * np.sin(np.arange(len(index)) / 5.))
+
+        aggregation = lp_dispatch.aggregate_generators(generators, hydro_max,
+                                                       hydro_min)
+        self.assertEqual(list(aggregation.generators.names),
+                         ['t1', 'n1', 'n3', 'h1', 'h3'])
+        aggregated, termination_condition, _ = lp_dispatch.run_lp_window(
+            {}, aggregation.generators, demand,
+            lp_dispatch.aggregate_bounds(aggregation, hydro_max),
+            lp_dispatch.aggregate_bounds(aggregation, hydro_min), 'linprog')
+        self.assertEqual(termination_condition, 'optimal')
+        dispatch = lp_dispatch.disaggregate(aggregation, aggregated)
+        expected, _, _ = lp_dispatch.run_lp_window(
+            {}, generators, demand, hydro_max, hydro_min, 'linprog')
+
+        costs = table['marginal_cost']
+        self.assertAlmostEqual((dispatch * costs).values.sum(),
+                               (expected * costs).values.sum(), places=4)
+        np.testing.assert_allclose(dispatch.sum(axis=1), demand['agg_load'])
+        # The dispatch of every unit is within its own bounds and ramps
+        p_min, p_max = lp_dispatch.window_bounds(generators, index, hydro_min,
+                                                 hydro_max)
+        self.assertTrue((dispatch.values >= p_min - 1e-6).all())
+        self.assertTrue((dispatch.values <= p_max + 1e-6).all())
+        ramps = np.abs(np.diff(dispatch.values, axis=0))
+        self.assertTrue((ramps <= generators.ramp_up + 1e-6).all())
+
+    def test_disaggregate_carriers(self):
+        table = pd.DataFrame(
+            index=['t1', 't2', 't3', 'h1', 'h2'],
+            data=dict(p_nom=[100., 300., 50., 60., 90.],
+                      marginal_cost=[40., 40., 40., 5., 5.],
+                      p_min_pu=0., p_max_pu=1.,
+                      ramp_limit_up=[.1, .02, .2, .3, .3],
+                      ramp_limit_down=[.1, .02, .2, .3, .3],
+                      carrier=['thermal'] * 3 + ['hydro'] * 2))
+        index = self.load.index[:96]
+        hydro_max = pd.DataFrame(index=index, data=dict(
+            h1=np.linspace(.2, .9, len(index)), h2=.5))
+        hydro_min = pd.DataFrame(index=index, data=dict(h1=.1, h2=.1))
+        # Dispatch by carrier, as simplify_net builds it, but with a thermal
+        # ramp all its generators can follow (t2 alone allows 9 MW per step
+        # for the whole carrier)
+        carriers = pd.DataFrame(index=['thermal', 'hydro'], data=dict(
+            p_nom=[450., 150.], marginal_cost=[40., 5.], p_min_pu=0., p_max_pu=1.,
+            ramp_limit_up=[9. / 450., 45. / 150.],
+            ramp_limit_down=[9. / 450., 45. / 150.], carrier=['thermal', 'hydro']))
+        carrier_max = lp_dispatch.carrier_bounds(hydro_max, table, 'p_max_pu')
+        carrier_min = lp_dispatch.carrier_bounds(hydro_min, table, 'p_min_pu')
+        np.testing.assert_allclose(carrier_max['hydro'],
+                                   (hydro_max['h1'] * 60. + 45.) / 150.)
+        self.assertEqual(list(carrier_max.columns), ['hydro'])
+        demand = pd.DataFrame(index=index, columns=['agg_load'],
+                              data=200. + 100. * np.sin(np.arange(len(index)) / 10.))
+        carrier_dispatch, termination_condition, _ = lp_dispatch.run_lp_window(
+            {}, lp_dispatch.prepare_generators(carriers, RampMode.hard, 5),
+            demand, carrier_max, carrier_min, 'linprog')
+        self.assertEqual(termination_condition, 'optimal')
+
+        dispatch = lp_dispatch.disaggregate_carriers(
+            carrier_dispatch, table, RampMode.hard, hydro_max, hydro_min)
+        self.assertEqual(list(dispatch.columns), list(table.index))
+        np.testing.assert_allclose(dispatch[['t1', 't2', 't3']].sum(axis=1),
+                                   carrier_dispatch['thermal'])
+        np.testing.assert_allclose(dispatch[['h1', 'h2']].sum(axis=1),
+                                   carrier_dispatch['hydro'])
+        generators = lp_dispatch.prepare_generators(table, RampMode.hard, 5)
+        p_min, p_max = lp_dispatch.window_bounds(generators, index, hydro_min,
+                                                 hydro_max)
+        self.assertTrue((dispatch.values >= p_min - 1e-6).all())
+        self.assertTrue((dispatch.values <= p_max + 1e-6).all())
+        ramps = np.abs(np.diff(dispatch.values, axis=0))
+        self.assertTrue((ramps <= generators.ramp_up + 1e-6).all())
+
+    def test_prepare_generators(self):
+        generators = lp_dispatch.prepare_generators(self.generators,
+                                                    RampMode.hard, 15)
+        np.testing.assert_allclose(generators.ramp_up, [60., np.nan, np.nan])
+        generators = lp_dispatch.prepare_generators(self.generators,
+                                                    RampMode.none, 15)
+        self.assertTrue(np.isnan(generators.ramp_up).all())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import os
+import tempfile
+import unittest
+from functools import partial
+
+from chronix2grid.pipeline import StagePipeline, parse_stage_cores
+
+
+def split_stage(batch):
+    return [(i, os.getpid()) for i in batch]
+
+
+def square_stage(item):
+    i, _ = item
+    return [i * i]
+
+
+def record_stage(folder, value):
+    with open(os.path.join(folder, str(value)), 'w') as f:
+        f.write(str(os.getpid()))
+    return []
+
+
+def failing_stage(item):
+    raise RuntimeError('dispatch failed')
+
+
+class TestStagePipeline(unittest.TestCase):
+    def test_parse_stage_cores(self):
+        self.assertEqual(parse_stage_cores('LR=4,t=2'),
+                         {'LR': 4, 'T': 2, 'K': 1})
+        with self.assertRaises(ValueError):
+            parse_stage_cores('X=2')
+        with self.assertRaises(ValueError):
+            parse_stage_cores('T=0')
+
+    def test_run(self):
+        folder = tempfile.mkdtemp()
+        stages = [('LR', split_stage, 2), ('T', square_stage, 2),
+                  ('K', partial(record_stage, folder), 1)]
+        StagePipeline(stages, queue_size=1).run(
+            [[0, 1], [2, 3], [4], [5, 6]])
+        self.assertEqual(sorted(int(name) for name in os.listdir(folder)),
+                         [i * i for i in range(7)])
+        # The last stage ran in its own single process
+        pids = set()
+        for name in os.listdir(folder):
+            with open(os.path.join(folder, name)) as f:
+                pids.add(f.read())
+        self.assertEqual(len(pids), 1)
+        self.assertNotIn(str(os.getpid()), pids)
+
+    def test_error(self):
+        stages = [('LR', split_stage, 1), ('T', failing_stage, 1)]
+        with self.assertRaises(RuntimeError):
+            StagePipeline(stages).run([[0], [1], [2]])
+
+
+if __name__ == '__main__':
+    unittest.main()
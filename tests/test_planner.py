@@ -0,0 +1,83 @@
+import json
+import os
+import pathlib
+import tempfile
+import unittest
+
+from chronix2grid import planner
+
+
+class TestPlanner(unittest.TestCase):
+    def setUp(self):
+        self.input_folder = os.path.join(
+            pathlib.Path(__file__).parent.absolute(), 'data', 'input')
+        self.case = 'case118_l2rpn_wcci'
+        self.sizes = planner.case_sizes(self.input_folder, self.case)
+
+    def test_case_sizes(self):
+        self.assertEqual(self.sizes['n_loads'], 99)
+        self.assertEqual(self.sizes['n_prods'], 62)
+        self.assertEqual(self.sizes['n_solar'] + self.sizes['n_wind'], 30)
+        self.assertEqual(self.sizes['mode_opf'], 'month')
+
+    def test_count_opf_windows(self):
+        self.assertEqual(planner.count_opf_windows('2012-01-01', 4, None), 1)
+        self.assertEqual(planner.count_opf_windows('2012-01-01', 4, 'day'), 28)
+        # Four weeks from January 20th span two months
+        self.assertEqual(planner.count_opf_windows('2012-01-20', 4, 'month'), 2)
+        self.assertEqual(planner.count_opf_windows('2012-01-01', 4, 'day', 60), 28)
+
+    def test_estimate(self):
+        cost_model = planner.read_cost_model()
+        one_core = planner.estimate(self.sizes, 4, 8, 'LR', 4, 1,
+                                    cost_model=cost_model)
+        four_cores = planner.estimate(self.sizes, 4, 8, 'LR', 4, 4,
+                                      cost_model=cost_model)
+        self.assertEqual(one_core['n_time_steps'], 4 * 7 * 24 * 12)
+        self.assertEqual(one_core['n_opf_windows'], 0)
+        self.assertEqual(set(one_core['stage_seconds_per_scenario']), {'L', 'R'})
+        self.assertAlmostEqual(
+            four_cores['wall_time'],
+            one_core['wall_time'] / 4 / cost_model['parallel_efficiency'])
+        self.assertEqual(four_cores['peak_rss_mb_per_worker'],
+                         one_core['peak_rss_mb_per_worker'])
+        self.assertLess(one_core['output_bytes']['bz2'],
+                        one_core['output_bytes']['csv'])
+
+        dispatch = planner.estimate(self.sizes, 8, 1, 'LRT', 4, 1,
+                                    cost_model=cost_model)
+        self.assertEqual(dispatch['n_opf_windows'], 2)
+        self.assertEqual(dispatch['n_chunks'], 2)
+
+    def test_recommendations(self):
+        # 10 scenarios on 8 CPUs take two rounds, as with 5 workers
+        self.assertEqual(planner.recommend_nb_core(10, 100., n_cpus=8), 5)
+        # Memory for 3 workers only
+        self.assertEqual(planner.recommend_nb_core(10, 1000., n_cpus=8,
+                                                   memory_mb=4000.), 3)
+        self.assertEqual(planner.recommend_chunk_weeks(self.sizes, 2), 2)
+        self.assertEqual(planner.recommend_chunk_weeks(self.sizes, 520), 12)
+
+    def test_calibrated_cost_model(self):
+        path = os.path.join(tempfile.mkdtemp(), 'cost_model.json')
+        with open(path, 'w') as f:
+            json.dump(dict(stages={'L': dict(seconds_per_value=1.)},
+                           parallel_efficiency=None, mb_per_value=1.), f)
+        cost_model = planner.read_cost_model(path)
+        self.assertEqual(cost_model['stages']['L']['seconds_per_value'], 1.)
+        self.assertEqual(cost_model['stages']['L']['seconds'],
+                         planner.DEFAULT_COST_MODEL['stages']['L']['seconds'])
+        self.assertEqual(cost_model['parallel_efficiency'],
+                         planner.DEFAULT_COST_MODEL['parallel_efficiency'])
+        self.assertEqual(cost_model['mb_per_value'], 1.)
+
+    def test_plan_run(self):
+        plan = planner.plan_run(self.input_folder, self.case, 52, 100, 'LRTK',
+                                4, 64, memory_mb=64000.)
+        self.assertLessEqual(plan['recommended']['nb_core'], plan['n_cpus'])
+        self.assertIn('Recommended: --nb_core', planner.format_plan(plan))
+        json.dumps(plan)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import os
+import pstats
+import tempfile
+import time
+import unittest
+
+from chronix2grid import profiling
+
+
+def busy_function(duration):
+    end = time.perf_counter() + duration
+    total = 0
+    while time.perf_counter() < end:
+        total += sum(range(100))
+    return total
+
+
+class TestProfiling(unittest.TestCase):
+    def setUp(self):
+        self.profile_folder = tempfile.mkdtemp()
+
+    def profiled_names(self, path):
+        return {function[2] for function in pstats.Stats(path).stats}
+
+    def test_cprofile(self):
+        settings = profiling.ProfileSettings(self.profile_folder, 'cprofile', None)
+        with profiling.profile(settings, 'Scenario_0'):
+            busy_function(0.01)
+        self.assertIn('busy_function', self.profiled_names(
+            os.path.join(self.profile_folder, 'Scenario_0.prof')))
+
+    def test_sampling(self):
+        settings = profiling.ProfileSettings(self.profile_folder, 'sampling', 0.001)
+        with profiling.profile(settings, 'Scenario_0'):
+            busy_function(0.2)
+        stats = pstats.Stats(os.path.join(self.profile_folder, 'Scenario_0.prof'))
+        busy_stats = [values for function, values in stats.stats.items()
+                      if function[2] == 'busy_function']
+        self.assertEqual(len(busy_stats), 1)
+        _, n_samples, _, cumulative_time, callers = busy_stats[0]
+        self.assertGreater(n_samples, 0)
+        self.assertGreater(cumulative_time, 0.)
+        self.assertIn('test_sampling', {caller[2] for caller in callers})
+
+    def test_merge_profiles(self):
+        settings = profiling.ProfileSettings(self.profile_folder, 'cprofile', None)
+        for name in ['Scenario_0', 'Scenario_1']:
+            with profiling.profile(settings, name):
+                busy_function(0.01)
+        report_path = profiling.merge_profiles(self.profile_folder)
+        with open(report_path) as f:
+            report = f.read()
+        self.assertIn('Merged profiles of 2 scenarios', report)
+        self.assertIn('busy_function', report)
+        self.assertTrue(os.path.isfile(os.path.join(
+            self.profile_folder, profiling.MERGED_PROFILE_FILE_NAME)))
+
+        profiling.clear_profiles(self.profile_folder)
+        self.assertEqual(os.listdir(self.profile_folder), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from chronix2grid.stage_cache import (BoundedCache, StageCache, hash_inputs,
+                                      run_cached_stage)
+
+
+class TestStageCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = StageCache(tempfile.mkdtemp())
+        self.scenario_folder = tempfile.mkdtemp()
+        self.params = {'dt': 5., 'start_date': pd.Timestamp('2012-01-01')}
+        self.charac = pd.DataFrame({'name': ['load_0', 'load_1'],
+                                    'Pmax': [10., 20.]})
+        self.n_calls = 0
+
+    def stage(self):
+        self.n_calls += 1
+        df = pd.DataFrame({'load_0': np.random.rand(3)})
+        df.to_csv(os.path.join(self.scenario_folder, 'load_p.csv.bz2'),
+                  sep=';', index=False)
+        return df
+
+    def test_hash_inputs(self):
+        key = hash_inputs(1, self.params, self.charac)
+        self.assertEqual(key, hash_inputs(1, dict(self.params), self.charac.copy()))
+        self.assertNotEqual(key, hash_inputs(2, self.params, self.charac))
+        other_charac = self.charac.copy()
+        other_charac.loc[0, 'Pmax'] = 11.
+        self.assertNotEqual(key, hash_inputs(1, self.params, other_charac))
+
+    def test_run_cached_stage(self):
+        np.random.seed(0)
+        df = run_cached_stage(self.cache, 'L', (0, self.params, self.charac),
+                              self.scenario_folder, ['load_p.csv.bz2'],
+                              self.stage)
+        next_draw = np.random.rand()
+        os.remove(os.path.join(self.scenario_folder, 'load_p.csv.bz2'))
+
+        np.random.seed(1)
+        cached_df = run_cached_stage(self.cache, 'L', (0, self.params, self.charac),
+                                     self.scenario_folder, ['load_p.csv.bz2'],
+                                     self.stage)
+        self.assertEqual(self.n_calls, 1)
+        pd.testing.assert_frame_equal(df, cached_df)
+        self.assertTrue(os.path.isfile(
+            os.path.join(self.scenario_folder, 'load_p.csv.bz2')))
+        # The random state is restored as it was at the end of the stage
+        self.assertEqual(np.random.rand(), next_draw)
+
+        run_cached_stage(self.cache, 'L', (1, self.params, self.charac),
+                         self.scenario_folder, ['load_p.csv.bz2'], self.stage)
+        self.assertEqual(self.n_calls, 2)
+
+    def test_no_cache(self):
+        run_cached_stage(None, 'L', (), self.scenario_folder, None, self.stage)
+        run_cached_stage(None, 'L', (), self.scenario_folder, None, self.stage)
+        self.assertEqual(self.n_calls, 2)
+
+    def test_bounded_cache(self):
+        cache = BoundedCache(tempfile.mkdtemp(), max_entries=2)
+        self.assertIsNone(cache.get('a'))
+        for i, key in enumerate(['a', 'b']):
+            cache.put(key, self.charac)
+            os.utime(cache.entry_path(key), (i, i))
+        pd.testing.assert_frame_equal(cache.get('a'), self.charac)
+        # b is now the least recently used entry
+        cache.put('c', self.charac)
+        self.assertIsNone(cache.get('b'))
+        self.assertIsNotNone(cache.get('a'))
+        self.assertIsNotNone(cache.get('c'))
+
+        cache = BoundedCache(tempfile.mkdtemp(), max_mb=1e-6)
+        cache.put('a', self.charac)
+        cache.put('b', self.charac)
+        # The last entry is kept even when it exceeds the size alone
+        self.assertEqual(os.listdir(cache.cache_folder), ['b.pkl'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,6 @@
 import os
 import tempfile
+from types import SimpleNamespace
 import unittest
 
 import numpy as np
@@ -9,6 +10,7 @@ import pathlib
 from chronix2grid.main import create_directory_tree
 import chronix2grid.constants as cst
 import chronix2grid.generation.generation_utils as gu
+from chronix2grid.generation.dispatch.utils import iso_week, minute_of_year
 
 
 class TestUtils(unittest.TestCase):
@@ -16,6 +18,22 @@ class TestUtils(unittest.TestCase):
         self.output_directory = tempfile.mkdtemp()
         self.n_scenarios = 10
 
+    def test_minute_of_year(self):
+        minutes = minute_of_year(pd.to_datetime(
+            ['2012-01-01 00:05', '2012-02-29 00:00', '2012-03-01 00:00',
+             '2013-03-01 00:00', '2013-12-31 23:55']))
+        np.testing.assert_array_equal(
+            minutes, [5, 59 * 1440, 60 * 1440, 60 * 1440, 366 * 1440 - 5])
+
+    def test_iso_week(self):
+        index = pd.to_datetime(['2012-01-01', '2012-01-02', '2012-12-31',
+                                '2015-12-31'])
+        np.testing.assert_array_equal(iso_week(index), [52, 1, 1, 53])
+        # Without DatetimeIndex.isocalendar, as with pandas < 1.1
+        np.testing.assert_array_equal(
+            iso_week(SimpleNamespace(week=pd.Index([52, 1, 1, 53]))),
+            [52, 1, 1, 53])
+
     def test_create_directory_tree(self):
         create_directory_tree('case', 'start_date', self.output_directory,
                               cst.SCENARIO_FOLDER_BASE_NAME, self.n_scenarios, 'L')
@@ -0,0 +1,63 @@
+import multiprocessing
+import os
+import unittest
+
+from chronix2grid import worker_resources as wr
+
+
+def worker_settings(_):
+    cpus = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else None
+    return os.environ['OMP_NUM_THREADS'], cpus, wr.solver_options('cbc')
+
+
+class TestWorkerResources(unittest.TestCase):
+    def test_defaults_share_cpus(self):
+        n_cpus = len(wr.available_cpus())
+        resources = wr.make_worker_resources(2)
+        self.assertEqual(resources.blas_threads, max(n_cpus // 2, 1))
+        self.assertEqual(resources.solver_threads, max(n_cpus // 2, 1))
+        self.assertFalse(resources.pin_workers)
+        self.assertEqual(wr.make_worker_resources(10 * n_cpus).blas_threads, 1)
+
+    def test_precedence(self):
+        params_opf = dict(blas_threads=2, solver_threads=3, pin_workers=True)
+        resources = wr.make_worker_resources(4, params_opf=params_opf)
+        self.assertEqual(resources, wr.WorkerResources(4, 2, 3, True))
+        resources = wr.make_worker_resources(4, blas_threads=1,
+                                             params_opf=params_opf)
+        self.assertEqual(resources.blas_threads, 1)
+        self.assertEqual(resources.solver_threads, 3)
+
+    def test_worker_cpus(self):
+        resources = wr.WorkerResources(3, 2, 2, True)
+        cpus = [0, 1, 2, 3]
+        self.assertEqual(wr.worker_cpus(0, resources, cpus), [0, 1])
+        self.assertEqual(wr.worker_cpus(1, resources, cpus), [2, 3])
+        self.assertEqual(wr.worker_cpus(2, resources, cpus), [0, 1])
+
+    def test_solver_options(self):
+        self.assertEqual(wr.solver_options('cbc', dict(solver_threads=2)),
+                         dict(threads=2))
+        self.assertEqual(wr.solver_options('glpk', dict(solver_threads=2)), {})
+        self.assertEqual(wr.solver_options('cbc', {}), {})
+        # Command line of pypsa without pyomo, HiGHS options with the LP dispatch
+        params_opf = dict(solver_threads=2, pyomo=False)
+        self.assertEqual(wr.solver_options('cbc', params_opf), '-threads 2 ')
+        self.assertEqual(wr.solver_options('glpk', params_opf), {})
+        self.assertEqual(wr.solver_options('gurobi', params_opf), dict(Threads=2))
+        self.assertEqual(wr.solver_options('cbc', dict(params_opf, persistent_lp=True)),
+                         dict(threads=2))
+
+    def test_pool_workers(self):
+        resources = wr.WorkerResources(2, 1, 1, True)
+        with multiprocessing.Pool(2, **wr.pool_kwargs(resources)) as pool:
+            settings = pool.map(worker_settings, range(4))
+        for omp_threads, cpus, solver_options in settings:
+            self.assertEqual(omp_threads, '1')
+            self.assertEqual(solver_options, dict(threads=1))
+            if cpus is not None:
+                self.assertEqual(len(cpus), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()